@@ -8,6 +8,8 @@ import datetime
 import logging
 from pathlib import Path
 
+from metricas import medido, registrar_resumen
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -22,6 +24,7 @@ def ensure_backup_dir():
     """Crear directorio de backups si no existe"""
     Path(BACKUP_DIR).mkdir(exist_ok=True)
 
+@medido('backup')
 def create_local_backup():
     """Crear backup local de la base de datos"""
     ensure_backup_dir()
@@ -59,6 +62,7 @@ def create_local_backup():
         logger.error(f"Error al crear backup local: {e}")
         return None
 
+@medido('backup')
 def upload_to_b2(file_path):
     """Subir backup a Backblaze B2 usando b2 CLI"""
     if not file_path or not os.path.exists(file_path):
@@ -101,6 +105,7 @@ def upload_to_b2(file_path):
         logger.error(f"Error inesperado al subir a B2: {e}")
         return False
 
+@medido('backup')
 def cleanup_old_backups(keep_days=30):
     """Eliminar backups locales antiguos"""
     ensure_backup_dir()
@@ -126,6 +131,7 @@ def cleanup_old_backups(keep_days=30):
     except Exception as e:
         logger.error(f"Error al limpiar backups antiguos: {e}")
 
+@medido('backup')
 def cleanup_old_b2_backups(keep_days=30):
     """Eliminar backups antiguos de B2"""
     if not B2_KEY_ID or not B2_APP_KEY:
@@ -159,6 +165,7 @@ def cleanup_old_b2_backups(keep_days=30):
     except Exception as e:
         logger.error(f"Error al limpiar backups de B2: {e}")
 
+@medido('backup')
 def run_backup():
     """Ejecutar backup completo"""
     logger.info("=== Iniciando proceso de backup ===")
@@ -187,3 +194,4 @@ def run_backup():
 
 if __name__ == '__main__':
     run_backup()
+    registrar_resumen()
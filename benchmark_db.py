@@ -0,0 +1,817 @@
+#!/usr/bin/env python3
+"""
+Benchmark reproducible de database.py.
+
+Genera un dataset sintético con una semilla fija (clanes, miembros repartidos
+de forma sesgada hacia unos pocos clanes populares, historial de XP con sus
+resúmenes, invitaciones y canales; los clanes repartidos entre servidores,
+con uno grande y muchos chicos) y mide cada función pública en un solo
+hilo y con varios hilos compitiendo por la base. Cada escenario corre sobre
+una copia limpia del dataset, así dos corridas con los mismos parámetros
+parten del mismo estado.
+
+Los resultados se guardan como JSON para comparar versiones:
+
+    python benchmark_db.py --salida bench_v2.json
+    python benchmark_db.py --salida bench_v3.json --comparar bench_v2.json
+    python benchmark_db.py --guilds 500 --solo obtener_top_clanes_guild,obtener_estado_reconciliacion_guild
+
+Con --procesos se mide en cambio una carga mixta de shard (MEZCLA) con varios
+procesos a la vez, abriendo cada uno la base o a través de servicio_db.py:
+
+    python benchmark_db.py --procesos 1,2,4,8 --repeticiones 4000 --salida bench_procesos.json
+
+Con --estres-xp varios hilos reparten XP a unos pocos clanes a la vez y al
+final se comprueba que no se perdió ninguna suma (XP del clan, historial y
+resúmenes); sale con código 1 si alguna se perdió:
+
+    python benchmark_db.py --estres-xp 1,4,8,16 --repeticiones 4000
+
+Uso:
+    python benchmark_db.py [--clanes 1000] [--miembros 50000] [--historial 200000] [--guilds 1]
+                           [--repeticiones 500] [--hilos 1,4,8] [--semilla 42]
+                           [--solo obtener_clan,agregar_xp_clan] [--salida benchmark.json]
+                           [--comparar anterior.json] [--umbral 1.2] [--procesos 1,2,4,8]
+                           [--estres-xp 1,4,8,16]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import logging
+import platform
+import tempfile
+import itertools
+import subprocess
+from collections import Counter
+from contextlib import closing
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import database
+
+logger = logging.getLogger(__name__)
+
+ROLES = ['Líder', 'Co-Líder', 'Miembro', 'Recluta', 'Recluta', 'Recluta']
+RAZONES_XP = ['Nuevo miembro unido', 'Evento semanal', 'Torneo', 'Actividad en voz']
+ID_USUARIOS_NUEVOS = 10**9   # usuarios que no están en ningún clan del dataset
+
+# ==================== DATASET ====================
+
+class Dataset:
+    """Parámetros del dataset y contadores que reparten IDs únicos entre hilos"""
+
+    def __init__(self, n_clanes: int, n_miembros: int, n_historial: int,
+                 n_invitaciones: int, semilla: int, n_guilds: int = 1):
+        self.n_clanes = n_clanes
+        self.n_guilds = n_guilds
+        self.n_miembros = n_miembros
+        self.n_historial = n_historial
+        self.n_invitaciones = n_invitaciones
+        self.semilla = semilla
+        self.reiniciar_contadores()
+
+    def reiniciar_contadores(self, proceso: int = 0):
+        # next() sobre itertools.count es atómico con el GIL; cada proceso usa su propio rango de IDs
+        self.usuarios_nuevos = itertools.count(ID_USUARIOS_NUEVOS + proceso * 10**7)
+        self.clanes_nuevos = itertools.count(proceso * 10**7)
+        self.canales_nuevos = itertools.count(2 * 10**9 + proceso * 10**7)
+        self.invitaciones = itertools.count(1)
+        self.miembros = itertools.count()
+
+    def clan(self, i: int) -> Tuple[int, str]:
+        """(servidor, nombre) del clan i"""
+        return self.guild_de_clan(i), f"clan{i}"
+
+    def clan_sesgado(self, rng: random.Random) -> Tuple[int, str]:
+        """Un clan elegido con el mismo sesgo que los miembros: los primeros son los populares"""
+        return self.clan(int(self.n_clanes * rng.random() ** 3))
+
+    def clan_uniforme(self, rng: random.Random) -> Tuple[int, str]:
+        return self.clan(rng.randrange(self.n_clanes))
+
+    def clan_del_servidor(self, guild_id: int, rng: random.Random) -> str:
+        """Un clan cualquiera del servidor `guild_id`"""
+        while True:
+            i = rng.randrange(self.n_clanes)
+            if self.guild_de_clan(i) == guild_id:
+                return f"clan{i}"
+
+    def guild_de_clan(self, i: int) -> int:
+        """Servidor del clan i (desde 1; 0 es "sin servidor"): el primero, con los clanes populares, es el más grande"""
+        return 1 + int(self.n_guilds * (i / self.n_clanes) ** 2)
+
+    def guild_uniforme(self, rng: random.Random) -> int:
+        return 1 + rng.randrange(self.n_guilds)
+
+    def miembro(self, i: int) -> int:
+        return i % self.n_miembros
+
+    def clan_de_miembro(self, usuario_id: int) -> Tuple[int, str]:
+        # Misma fórmula que generar_dataset, sin consultar la base
+        return self.clan(int(self.n_clanes * random.Random(self.semilla * 1000003 + usuario_id).random() ** 3))
+
+def generar_dataset(ruta: str, d: Dataset):
+    """Crear la base con el esquema actual y llenarla según el Dataset"""
+    database.DATABASE_FILE = ruta
+    database.init_database()
+
+    rng = random.Random(d.semilla)
+    ahora = datetime.now()
+
+    with sqlite3.connect(ruta) as conn:
+        conn.executemany('''
+            INSERT INTO clanes (guild_id, nombre, creador_id, descripcion, nivel, xp_actual, rol_id, categoria_id,
+                                canal_anuncios_id, canal_admin_id, canal_general_id, invite_code)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            (*d.clan(i), 10**8 + i, f"Descripción del clan {i}", 1 + min(5, int(6 * rng.random() ** 2)),
+             rng.randrange(15000), 10 * i, 10 * i + 1, 10 * i + 2, 10 * i + 3, 10 * i + 4, f"inv{i}")
+            for i in range(d.n_clanes)
+        ))
+
+        # Cada miembro está en un solo clan; la distribución se concentra en los primeros clanes
+        conn.executemany('''
+            INSERT INTO miembros_clan (guild_id, clan_nombre, usuario_id, rol_clan, activo) VALUES (?, ?, ?, ?, ?)
+        ''', (
+            (*d.clan_de_miembro(j), j, ROLES[j % len(ROLES)], 0 if j % 10 == 0 else 1)
+            for j in range(d.n_miembros)
+        ))
+        conn.execute('''
+            UPDATE clanes SET
+                total_miembros_actuales = (SELECT COUNT(*) FROM miembros_clan m
+                                           WHERE m.guild_id = clanes.guild_id AND m.clan_nombre = clanes.nombre
+                                             AND m.activo = 1),
+                total_miembros_historico = (SELECT COUNT(*) FROM miembros_clan m
+                                            WHERE m.guild_id = clanes.guild_id AND m.clan_nombre = clanes.nombre)
+        ''')
+
+        # Historial de 120 días (parte queda fuera de la retención) y sus resúmenes
+        segundos = 120 * 86400
+        conn.executemany('''
+            INSERT INTO historial_xp (guild_id, clan_nombre, cantidad_xp, razon, origen, fecha)
+            VALUES (?, ?, ?, ?, 'sistema', datetime('now', ?))
+        ''', (
+            (*d.clan_sesgado(rng), rng.choice((10, 25, 50, 100)), rng.choice(RAZONES_XP),
+             f"-{rng.randrange(segundos)} seconds")
+            for _ in range(d.n_historial)
+        ))
+        conn.execute('''
+            INSERT INTO historial_xp_diario (guild_id, clan_nombre, dia, xp_total, eventos)
+            SELECT guild_id, clan_nombre, date(fecha), SUM(cantidad_xp), COUNT(*) FROM historial_xp
+            GROUP BY guild_id, clan_nombre, date(fecha)
+        ''')
+        conn.execute('''
+            INSERT INTO historial_xp_horario (guild_id, clan_nombre, hora, xp_total, eventos)
+            SELECT guild_id, clan_nombre, strftime('%Y-%m-%d %H:00:00', fecha), SUM(cantidad_xp), COUNT(*)
+            FROM historial_xp WHERE fecha >= datetime('now', ?)
+            GROUP BY guild_id, clan_nombre, strftime('%Y-%m-%d %H:00:00', fecha)
+        ''', (f"-{database.DIAS_RETENCION_HORARIO} days",))
+
+        # Invitaciones pendientes a usuarios sin clan (ids 1..n, en orden) y algunas vencidas
+        conn.executemany('''
+            INSERT INTO invitaciones_pendientes
+            (guild_id, clan_nombre, usuario_invitado_id, usuario_que_invita_id, rol_asignado, fecha_expiracion)
+            VALUES (?, ?, ?, ?, 'Recluta', ?)
+        ''', (
+            (*d.clan_uniforme(rng), 5 * 10**8 + i, 10**8, ahora + timedelta(hours=1 + rng.randrange(48)))
+            for i in range(d.n_invitaciones)
+        ))
+        conn.executemany('''
+            INSERT INTO invitaciones_pendientes
+            (guild_id, clan_nombre, usuario_invitado_id, usuario_que_invita_id, rol_asignado, fecha_expiracion)
+            VALUES (?, ?, ?, ?, 'Recluta', ?)
+        ''', (
+            (*d.clan_uniforme(rng), 6 * 10**8 + i, 10**8, ahora - timedelta(hours=1 + rng.randrange(48)))
+            for i in range(d.n_invitaciones // 4)
+        ))
+
+        conn.executemany('''
+            INSERT INTO canales_clan (guild_id, clan_nombre, canal_id, nombre, tipo) VALUES (?, ?, ?, ?, ?)
+        ''', (
+            (*d.clan_sesgado(rng), 10**9 + i, f"canal{i}", 'texto' if i % 3 else 'voz')
+            for i in range(d.n_clanes * 3)
+        ))
+        conn.execute('ANALYZE')
+
+# ==================== ESCENARIOS ====================
+
+# Cada escenario recibe (dataset, rng) y ejecuta una llamada. `maximo` limita las
+# repeticiones de las operaciones caras o que agotan datos del dataset.
+ESCENARIOS: Dict[str, Dict] = {}
+
+def escenario(nombre: str, maximo: Optional[int] = None):
+    def registrar(func: Callable[[Dataset, random.Random], object]):
+        ESCENARIOS[nombre] = {'funcion': func, 'maximo': maximo}
+        return func
+    return registrar
+
+# ---- Clanes ----
+
+@escenario('crear_clan')
+def _crear_clan(d: Dataset, rng: random.Random):
+    i = next(d.clanes_nuevos)
+    base = 3 * 10**9 + 10 * i
+    database.crear_clan(d.guild_uniforme(rng), f"nuevo{i}", base, 'Clan del benchmark', base + 1, base + 2,
+                        base + 3, base + 4, base + 5, f"nuevo{i}")
+
+@escenario('obtener_clan')
+def _obtener_clan(d: Dataset, rng: random.Random):
+    database.obtener_clan(*d.clan_sesgado(rng))
+
+@escenario('clan_existe')
+def _clan_existe(d: Dataset, rng: random.Random):
+    database.clan_existe(*d.clan_uniforme(rng))
+
+@escenario('obtener_todos_clanes_guild')
+def _obtener_todos_clanes_guild(d: Dataset, rng: random.Random):
+    database.obtener_todos_clanes(d.guild_uniforme(rng))
+
+@escenario('obtener_clan_por_canal_admin')
+def _obtener_clan_por_canal_admin(d: Dataset, rng: random.Random):
+    i = rng.randrange(d.n_clanes)
+    database.obtener_clan_por_canal_admin(d.guild_de_clan(i), 10 * i + 3)
+
+# ---- XP ----
+
+@escenario('agregar_xp_clan')
+def _agregar_xp_clan(d: Dataset, rng: random.Random):
+    database.agregar_xp_clan(*d.clan_sesgado(rng), 50, 'Benchmark', None, 'sistema')
+
+@escenario('obtener_xp_ganada')
+def _obtener_xp_ganada(d: Dataset, rng: random.Random):
+    database.obtener_xp_ganada(*d.clan_sesgado(rng), 7)
+
+@escenario('obtener_serie_xp_dia')
+def _obtener_serie_xp_dia(d: Dataset, rng: random.Random):
+    database.obtener_serie_xp(*d.clan_sesgado(rng), 'dia')
+
+@escenario('obtener_serie_xp_mes')
+def _obtener_serie_xp_mes(d: Dataset, rng: random.Random):
+    database.obtener_serie_xp(*d.clan_sesgado(rng), 'mes')
+
+@escenario('obtener_ranking_crecimiento')
+def _obtener_ranking_crecimiento(d: Dataset, rng: random.Random):
+    database.obtener_ranking_crecimiento(d.guild_uniforme(rng), 7, 10)
+
+@escenario('obtener_top_clanes')
+def _obtener_top_clanes(d: Dataset, rng: random.Random):
+    database.obtener_top_clanes(10)
+
+@escenario('obtener_top_clanes_guild')
+def _obtener_top_clanes_guild(d: Dataset, rng: random.Random):
+    database.obtener_top_clanes(10, d.guild_uniforme(rng))
+
+@escenario('obtener_posicion_clan')
+def _obtener_posicion_clan(d: Dataset, rng: random.Random):
+    database.obtener_posicion_clan(*d.clan_uniforme(rng))
+
+@escenario('compactar_historial_xp', maximo=1)
+def _compactar_historial_xp(d: Dataset, rng: random.Random):
+    database.compactar_historial_xp(pausa=0)
+
+# ---- Miembros ----
+
+@escenario('agregar_miembro_clan')
+def _agregar_miembro_clan(d: Dataset, rng: random.Random):
+    database.agregar_miembro_clan(*d.clan_sesgado(rng), next(d.usuarios_nuevos))
+
+@escenario('remover_miembro_clan')
+def _remover_miembro_clan(d: Dataset, rng: random.Random):
+    usuario = d.miembro(next(d.miembros))
+    database.remover_miembro_clan(*d.clan_de_miembro(usuario), usuario)
+
+@escenario('transferir_miembro')
+def _transferir_miembro(d: Dataset, rng: random.Random):
+    usuario = d.miembro(next(d.miembros))
+    guild_id, clan = d.clan_de_miembro(usuario)
+    database.transferir_miembro(guild_id, usuario, clan, d.clan_del_servidor(guild_id, rng))
+
+@escenario('remover_usuario_de_clanes')
+def _remover_usuario_de_clanes(d: Dataset, rng: random.Random):
+    usuario = d.miembro(next(d.miembros))
+    database.remover_usuario_de_clanes(d.clan_de_miembro(usuario)[0], usuario)
+
+@escenario('obtener_miembros_clan')
+def _obtener_miembros_clan(d: Dataset, rng: random.Random):
+    database.obtener_miembros_clan(*d.clan_sesgado(rng))
+
+@escenario('obtener_rol_miembro')
+def _obtener_rol_miembro(d: Dataset, rng: random.Random):
+    usuario = rng.randrange(d.n_miembros)
+    database.obtener_rol_miembro(*d.clan_de_miembro(usuario), usuario)
+
+@escenario('obtener_membresias_usuario')
+def _obtener_membresias_usuario(d: Dataset, rng: random.Random):
+    database.obtener_membresias_usuario(rng.randrange(d.n_miembros))
+
+@escenario('obtener_clanes_usuario')
+def _obtener_clanes_usuario(d: Dataset, rng: random.Random):
+    usuario = rng.randrange(d.n_miembros)
+    database.obtener_clanes_usuario(d.clan_de_miembro(usuario)[0], usuario)
+
+@escenario('obtener_clanes_usuario_guild')
+def _obtener_clanes_usuario_guild(d: Dataset, rng: random.Random):
+    database.obtener_clanes_usuario(d.guild_uniforme(rng), rng.randrange(d.n_miembros))
+
+# ---- Invitaciones ----
+
+@escenario('crear_invitacion')
+def _crear_invitacion(d: Dataset, rng: random.Random):
+    database.crear_invitacion(*d.clan_uniforme(rng), next(d.usuarios_nuevos), 10**8)
+
+@escenario('crear_invitaciones_25')
+def _crear_invitaciones(d: Dataset, rng: random.Random):
+    database.crear_invitaciones(*d.clan_uniforme(rng), [next(d.usuarios_nuevos) for _ in range(25)], 10**8)
+
+@escenario('obtener_invitados_pendientes')
+def _obtener_invitados_pendientes(d: Dataset, rng: random.Random):
+    database.obtener_invitados_pendientes(*d.clan_uniforme(rng))
+
+@escenario('obtener_invitacion')
+def _obtener_invitacion(d: Dataset, rng: random.Random):
+    database.obtener_invitacion(1 + rng.randrange(d.n_invitaciones))
+
+@escenario('obtener_invitacion_cacheada')
+def _obtener_invitacion_cacheada(d: Dataset, rng: random.Random):
+    # Pocas invitaciones muy consultadas: el caso para el que existe la caché
+    database.obtener_invitacion_cacheada(1 + int(d.n_invitaciones * rng.random() ** 4))
+
+@escenario('aceptar_invitacion')
+def _aceptar_invitacion(d: Dataset, rng: random.Random):
+    database.aceptar_invitacion(next(d.invitaciones))
+
+@escenario('rechazar_invitacion')
+def _rechazar_invitacion(d: Dataset, rng: random.Random):
+    database.rechazar_invitacion(next(d.invitaciones))
+
+@escenario('obtener_proxima_expiracion')
+def _obtener_proxima_expiracion(d: Dataset, rng: random.Random):
+    database.obtener_proxima_expiracion()
+
+@escenario('expirar_invitaciones_vencidas', maximo=20)
+def _expirar_invitaciones_vencidas(d: Dataset, rng: random.Random):
+    database.expirar_invitaciones_vencidas(200)
+
+# ---- Canales y reconciliación ----
+
+@escenario('agregar_canal_extra')
+def _agregar_canal_extra(d: Dataset, rng: random.Random):
+    database.agregar_canal_extra(*d.clan_sesgado(rng), next(d.canales_nuevos), 'canal', 'texto')
+
+@escenario('contar_canales_extra')
+def _contar_canales_extra(d: Dataset, rng: random.Random):
+    database.contar_canales_extra(*d.clan_sesgado(rng), 'texto')
+
+# El servidor grande (1) y uno cualquiera: la reconciliación de uno no debe costar la de todos
+@escenario('obtener_estado_reconciliacion_guild_grande', maximo=50)
+def _obtener_estado_reconciliacion_guild_grande(d: Dataset, rng: random.Random):
+    database.obtener_estado_reconciliacion(1)
+
+@escenario('obtener_estado_reconciliacion_guild')
+def _obtener_estado_reconciliacion_guild(d: Dataset, rng: random.Random):
+    database.obtener_estado_reconciliacion(d.guild_uniforme(rng))
+
+# ==================== MEDICIÓN ====================
+
+class ContadorErrores(logging.Handler):
+    """database.py atrapa sus excepciones y las registra: se cuentan los logger.error"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.total = 0
+
+    def emit(self, record: logging.LogRecord):
+        self.total += 1
+
+def percentil(valores: List[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+def _medicion(duraciones: List[float], segundos: float, errores: int) -> Dict:
+    return {
+        'llamadas': len(duraciones),
+        'segundos': round(segundos, 4),
+        'por_segundo': round(len(duraciones) / segundos, 1) if segundos else 0.0,
+        'p50_ms': round(percentil(duraciones, 50), 4),
+        'p95_ms': round(percentil(duraciones, 95), 4),
+        'p99_ms': round(percentil(duraciones, 99), 4),
+        'max_ms': round(max(duraciones, default=0.0), 4),
+        'errores': errores
+    }
+
+def _preparar_copia(base: str, trabajo: str, d: Dataset):
+    """Partir de una copia limpia del dataset, con las cachés en memoria recargadas"""
+    for sufijo in ('', '-journal'):
+        if os.path.exists(trabajo + sufijo):
+            os.remove(trabajo + sufijo)
+    shutil.copyfile(base, trabajo)
+    database.DATABASE_FILE = trabajo
+    database._invalidar_invitacion()
+    database.cargar_indice_membresias()
+    database.cargar_clasificacion()
+    d.reiniciar_contadores()
+
+def medir_escenario(nombre: str, d: Dataset, repeticiones: int, hilos: int) -> Dict:
+    """
+    Ejecutar `repeticiones` llamadas repartidas entre `hilos` hilos.
+
+    Returns:
+        {'llamadas', 'segundos', 'por_segundo', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'errores'}
+    """
+    funcion = ESCENARIOS[nombre]['funcion']
+    por_hilo = max(1, repeticiones // hilos)
+
+    def trabajador(numero: int) -> List[float]:
+        rng = random.Random(d.semilla * 1000 + numero)
+        duraciones = []
+        for _ in range(por_hilo):
+            inicio = time.perf_counter()
+            funcion(d, rng)
+            duraciones.append((time.perf_counter() - inicio) * 1000)
+        return duraciones
+
+    errores = ContadorErrores()
+    logging.getLogger('database').addHandler(errores)
+    inicio = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=hilos) as pool:
+            duraciones = [x for lista in pool.map(trabajador, range(hilos)) for x in lista]
+    finally:
+        logging.getLogger('database').removeHandler(errores)
+    return _medicion(duraciones, time.perf_counter() - inicio, errores.total)
+
+# ==================== VARIOS PROCESOS ====================
+
+# Carga mixta de un shard del bot: mayormente lecturas, una de cada tres llamadas escribe
+MEZCLA = {
+    'obtener_clan': 25, 'obtener_rol_miembro': 20, 'obtener_top_clanes_guild': 10,
+    'obtener_xp_ganada': 10, 'agregar_xp_clan': 25, 'crear_invitacion': 5, 'agregar_canal_extra': 5
+}
+MODOS_PROCESOS = ('directo', 'servicio')
+
+def _proceso_mezcla(numero: int, parametros: Dict, trabajo: str, llamadas: int, barrera, resultados):
+    """Un proceso "shard": espera a los demás en la barrera y ejecuta su parte de la MEZCLA"""
+    logging.getLogger('database').propagate = False
+    d = Dataset(**parametros)
+    d.reiniciar_contadores(proceso=numero + 1)
+    if not os.getenv('DB_SOCKET'):
+        # Sin servicio cada proceso abre la base y tiene sus propias cachés
+        database.DATABASE_FILE = trabajo
+        database.cargar_indice_membresias()
+        database.cargar_clasificacion()
+
+    rng = random.Random(d.semilla * 1000 + numero)
+    nombres = list(MEZCLA)
+    pesos = list(MEZCLA.values())
+    errores = ContadorErrores()
+    logging.getLogger('database').addHandler(errores)
+    duraciones = []
+
+    barrera.wait()
+    comienzo = time.time()
+    for nombre in rng.choices(nombres, pesos, k=llamadas):
+        inicio = time.perf_counter()
+        try:
+            ESCENARIOS[nombre]['funcion'](d, rng)
+        except (ConnectionError, RuntimeError):
+            errores.total += 1
+        duraciones.append((time.perf_counter() - inicio) * 1000)
+    resultados.put((comienzo, time.time(), duraciones, errores.total))
+
+def _iniciar_servicio(trabajo: str, socket_servicio: str, log) -> subprocess.Popen:
+    servicio = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'servicio_db.py'),
+         '--socket', socket_servicio, '--db', trabajo],
+        stdout=subprocess.DEVNULL, stderr=log
+    )
+    limite = time.monotonic() + 60
+    while not os.path.exists(socket_servicio):
+        if servicio.poll() is not None or time.monotonic() > limite:
+            servicio.kill()
+            raise RuntimeError("El servicio de base de datos no arrancó")
+        time.sleep(0.05)
+    return servicio
+
+def medir_procesos(modo: str, d: Dataset, trabajo: str, repeticiones: int, procesos: int) -> Dict:
+    """
+    Ejecutar `repeticiones` llamadas de la MEZCLA repartidas entre `procesos` procesos,
+    abriendo la base cada uno ('directo') o a través de servicio_db.py ('servicio').
+
+    Returns:
+        las mismas claves que medir_escenario
+    """
+    import multiprocessing
+    # spawn: cada proceso importa database.py desde cero, como un shard del bot
+    contexto = multiprocessing.get_context('spawn')
+    barrera = contexto.Barrier(procesos)
+    resultados = contexto.Queue()
+    parametros = {
+        'n_clanes': d.n_clanes, 'n_miembros': d.n_miembros, 'n_historial': d.n_historial,
+        'n_invitaciones': d.n_invitaciones, 'semilla': d.semilla, 'n_guilds': d.n_guilds
+    }
+    socket_servicio = os.path.join(os.path.dirname(trabajo), 'servicio.sock')
+    ruta_log = os.path.join(os.path.dirname(trabajo), 'servicio.log')
+    servicio = None
+    errores_servicio = 0
+
+    try:
+        if modo == 'servicio':
+            with open(ruta_log, 'w') as log:
+                servicio = _iniciar_servicio(trabajo, socket_servicio, log)
+        if servicio:
+            os.environ['DB_SOCKET'] = socket_servicio
+        hijos = [
+            contexto.Process(target=_proceso_mezcla,
+                             args=(i, parametros, trabajo, max(1, repeticiones // procesos), barrera, resultados))
+            for i in range(procesos)
+        ]
+        for hijo in hijos:
+            hijo.start()
+        os.environ.pop('DB_SOCKET', None)
+
+        partes = [resultados.get(timeout=600) for _ in hijos]
+        for hijo in hijos:
+            hijo.join()
+    finally:
+        os.environ.pop('DB_SOCKET', None)
+        if servicio:
+            servicio.terminate()
+            servicio.wait(timeout=60)
+            # Los errores de database.py quedan en el log del servicio, no en los procesos
+            with open(ruta_log) as log:
+                errores_servicio = sum(1 for linea in log if '[ERROR' in linea)
+
+    segundos = max(p[1] for p in partes) - min(p[0] for p in partes)
+    duraciones = [x for p in partes for x in p[2]]
+    return _medicion(duraciones, segundos, sum(p[3] for p in partes) + errores_servicio)
+
+# ==================== ESTRÉS DE XP ====================
+
+# Pocos clanes para que casi todas las llamadas compitan por la misma fila
+CLANES_ESTRES = 4
+XP_ESTRES = 50
+
+def _estado_xp(clanes: List[Tuple[int, str]]) -> Dict[Tuple[int, str], tuple]:
+    """(servidor, clan) -> (xp_actual, nivel, filas de historial_xp, xp y eventos de historial_xp_diario)"""
+    with closing(sqlite3.connect(database.DATABASE_FILE)) as conn:
+        return {
+            (guild_id, clan): conn.execute('''
+                SELECT xp_actual, nivel,
+                       (SELECT COUNT(*) FROM historial_xp WHERE guild_id = :guild AND clan_nombre = :clan),
+                       (SELECT COALESCE(SUM(xp_total), 0) FROM historial_xp_diario
+                        WHERE guild_id = :guild AND clan_nombre = :clan),
+                       (SELECT COALESCE(SUM(eventos), 0) FROM historial_xp_diario
+                        WHERE guild_id = :guild AND clan_nombre = :clan)
+                FROM clanes WHERE guild_id = :guild AND nombre = :clan
+            ''', {'guild': guild_id, 'clan': clan}).fetchone()
+            for guild_id, clan in clanes
+        }
+
+def medir_estres_xp(d: Dataset, repeticiones: int, hilos: int) -> Dict:
+    """
+    Repartir `repeticiones` llamadas a agregar_xp_clan sobre los CLANES_ESTRES clanes
+    más populares entre `hilos` hilos, y comparar el estado final con las llamadas
+    que devolvieron resultado.
+
+    Returns:
+        las claves de medir_escenario más 'actualizaciones_perdidas' (sumas de XP que
+        no llegaron al clan) e 'inconsistencias' (clanes cuyo historial, resumen diario
+        o nivel no cuadra con su XP)
+    """
+    clanes = [d.clan(i) for i in range(CLANES_ESTRES)]
+    por_hilo = max(1, repeticiones // hilos)
+    antes = _estado_xp(clanes)
+
+    def trabajador(numero: int):
+        rng = random.Random(d.semilla * 1000 + numero)
+        duraciones, otorgadas = [], Counter()
+        for _ in range(por_hilo):
+            clan = rng.choice(clanes)
+            inicio = time.perf_counter()
+            if database.agregar_xp_clan(*clan, XP_ESTRES, 'Estrés XP', None, 'sistema'):
+                otorgadas[clan] += 1
+            duraciones.append((time.perf_counter() - inicio) * 1000)
+        return duraciones, otorgadas
+
+    errores = ContadorErrores()
+    logging.getLogger('database').addHandler(errores)
+    inicio = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=hilos) as pool:
+            partes = list(pool.map(trabajador, range(hilos)))
+    finally:
+        logging.getLogger('database').removeHandler(errores)
+    segundos = time.perf_counter() - inicio
+
+    otorgadas = sum((p[1] for p in partes), Counter())
+    despues = _estado_xp(clanes)
+    perdidas = inconsistencias = 0
+    for clan in clanes:
+        xp, nivel, historial, xp_diario, eventos_diario = despues[clan]
+        esperadas = otorgadas[clan]
+        perdidas += (antes[clan][0] + esperadas * XP_ESTRES - xp) // XP_ESTRES
+        nivel_esperado = max(n for n, config in database.NIVELES_CLAN.items() if xp >= config['xp_requerido'])
+        if (historial - antes[clan][2] != esperadas
+                or xp_diario - antes[clan][3] != esperadas * XP_ESTRES
+                or eventos_diario - antes[clan][4] != esperadas
+                or nivel != nivel_esperado):
+            inconsistencias += 1
+
+    medicion = _medicion([x for p in partes for x in p[0]], segundos, errores.total)
+    medicion['actualizaciones_perdidas'] = perdidas
+    medicion['inconsistencias'] = inconsistencias
+    return medicion
+
+def perdidas_estres_xp(reporte: Dict) -> int:
+    """Actualizaciones de XP perdidas más clanes inconsistentes, sumando todas las medidas de estrés"""
+    return sum(m['actualizaciones_perdidas'] + m['inconsistencias']
+               for m in reporte['resultados'].get('estres_xp', {}).values())
+
+def _version() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def ejecutar(n_clanes: int = 1000, n_miembros: int = 50000, n_historial: int = 200000,
+             repeticiones: int = 500, hilos: List[int] = None, semilla: int = 42,
+             solo: List[str] = None, n_guilds: int = 1, procesos: List[int] = None,
+             estres_xp: List[int] = None) -> Dict:
+    """
+    Generar el dataset y medir los escenarios. Con `procesos`, en lugar de los
+    escenarios se mide la MEZCLA con cada cantidad de procesos, en cada modo;
+    con `estres_xp`, el estrés de XP con cada cantidad de hilos.
+
+    Returns:
+        {'version', 'fecha', 'entorno', 'parametros', 'generacion_s',
+         'resultados': {escenario: {str(hilos): medicion}}}
+    """
+    hilos = hilos or [1, 4, 8]
+    nombres = solo or list(ESCENARIOS)
+    desconocidos = [n for n in nombres if n not in ESCENARIOS]
+    if desconocidos:
+        raise ValueError(f"Escenarios desconocidos: {', '.join(desconocidos)}")
+
+    # Las invitaciones se consumen una por llamada en aceptar/rechazar
+    d = Dataset(n_clanes, n_miembros, n_historial, max(repeticiones, 1000), semilla, n_guilds)
+    directorio = tempfile.mkdtemp(prefix='benchmark_db_')
+    base = os.path.join(directorio, 'base.db')
+    trabajo = os.path.join(directorio, 'trabajo.db')
+
+    try:
+        inicio = time.perf_counter()
+        generar_dataset(base, d)
+        generacion = time.perf_counter() - inicio
+        logger.info(f"Dataset generado en {generacion:.1f}s ({os.path.getsize(base) / 1e6:.1f} MB)")
+
+        resultados = {}
+        for modo in (MODOS_PROCESOS if procesos else ()):
+            resultados[f"mezcla_{modo}"] = {}
+            for n_procesos in procesos:
+                _preparar_copia(base, trabajo, d)
+                medicion = medir_procesos(modo, d, trabajo, repeticiones, n_procesos)
+                resultados[f"mezcla_{modo}"][str(n_procesos)] = medicion
+                logger.info(
+                    f"mezcla_{modo} x{n_procesos} procesos: {medicion['por_segundo']:.0f}/s, "
+                    f"p50 {medicion['p50_ms']:.2f}ms, p99 {medicion['p99_ms']:.2f}ms, errores {medicion['errores']}"
+                )
+
+        if estres_xp:
+            resultados['estres_xp'] = {}
+        for n_hilos in (estres_xp or ()):
+            _preparar_copia(base, trabajo, d)
+            medicion = medir_estres_xp(d, repeticiones, n_hilos)
+            resultados['estres_xp'][str(n_hilos)] = medicion
+            logger.info(
+                f"estres_xp x{n_hilos}: {medicion['por_segundo']:.0f}/s, p99 {medicion['p99_ms']:.2f}ms, "
+                f"errores {medicion['errores']}, perdidas {medicion['actualizaciones_perdidas']}, "
+                f"inconsistencias {medicion['inconsistencias']}"
+            )
+
+        for nombre in ([] if procesos or estres_xp else nombres):
+            maximo = ESCENARIOS[nombre]['maximo']
+            veces = min(repeticiones, maximo) if maximo else repeticiones
+            resultados[nombre] = {}
+            for n_hilos in hilos:
+                _preparar_copia(base, trabajo, d)
+                medicion = medir_escenario(nombre, d, veces, min(n_hilos, veces))
+                resultados[nombre][str(n_hilos)] = medicion
+                logger.info(
+                    f"{nombre} x{n_hilos}: {medicion['por_segundo']:.0f}/s, "
+                    f"p50 {medicion['p50_ms']:.2f}ms, p99 {medicion['p99_ms']:.2f}ms, errores {medicion['errores']}"
+                )
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    return {
+        'version': _version(),
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'entorno': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count()
+        },
+        'parametros': {
+            'clanes': n_clanes, 'miembros': n_miembros, 'historial': n_historial, 'guilds': n_guilds,
+            'repeticiones': repeticiones, 'hilos': hilos, 'semilla': semilla,
+            **({'procesos': procesos} if procesos else {}),
+            **({'estres_xp': estres_xp} if estres_xp else {})
+        },
+        'generacion_s': round(generacion, 2),
+        'resultados': resultados
+    }
+
+def comparar(anterior: Dict, actual: Dict, umbral: float = 1.2) -> List[Dict]:
+    """
+    Regresiones de `actual` respecto de `anterior`: p50 más lento que umbral veces
+    o errores nuevos. Devuelve [{'escenario', 'hilos', 'antes_ms', 'despues_ms', 'factor', 'errores'}]
+    """
+    if anterior.get('parametros') != actual.get('parametros'):
+        logger.warning("Los parámetros de las corridas difieren: la comparación no es directa")
+
+    regresiones = []
+    for nombre, por_hilos in actual['resultados'].items():
+        for n_hilos, medicion in por_hilos.items():
+            previa = anterior.get('resultados', {}).get(nombre, {}).get(n_hilos)
+            if not previa:
+                continue
+            factor = medicion['p50_ms'] / previa['p50_ms'] if previa['p50_ms'] else 1.0
+            if factor > umbral or medicion['errores'] > previa['errores']:
+                regresiones.append({
+                    'escenario': nombre, 'hilos': n_hilos,
+                    'antes_ms': previa['p50_ms'], 'despues_ms': medicion['p50_ms'],
+                    'factor': round(factor, 2), 'errores': medicion['errores'] - previa['errores']
+                })
+    return regresiones
+
+def imprimir_resultados(reporte: Dict):
+    parametros = reporte['parametros']
+    hilos = [str(h) for h in parametros.get('procesos') or parametros.get('estres_xp') or parametros['hilos']]
+    print(f"\n{'escenario':40}" + ''.join(f"{f'x{h} ops/s':>12}{f'x{h} p99':>12}" for h in hilos) + f"{'errores':>9}")
+    for nombre, por_hilos in reporte['resultados'].items():
+        fila = f"{nombre:40}"
+        for h in hilos:
+            m = por_hilos[h]
+            fila += f"{m['por_segundo']:12.0f}{m['p99_ms']:10.2f}ms"
+        print(fila + f"{sum(m['errores'] for m in por_hilos.values()):9}")
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    # database.py registra cada error; el benchmark los cuenta en vez de mostrarlos
+    logging.getLogger('database').propagate = False
+    argumentos = sys.argv[1:]
+
+    if '--help' in argumentos or '-h' in argumentos:
+        print(__doc__)
+        sys.exit(0)
+
+    def opcion(nombre: str, defecto=None):
+        return argumentos[argumentos.index(nombre) + 1] if nombre in argumentos else defecto
+
+    solo = opcion('--solo')
+    reporte = ejecutar(
+        n_clanes=int(opcion('--clanes', 1000)),
+        n_miembros=int(opcion('--miembros', 50000)),
+        n_historial=int(opcion('--historial', 200000)),
+        repeticiones=int(opcion('--repeticiones', 500)),
+        hilos=[int(h) for h in opcion('--hilos', '1,4,8').split(',')],
+        semilla=int(opcion('--semilla', 42)),
+        solo=solo.split(',') if solo else None,
+        n_guilds=int(opcion('--guilds', 1)),
+        procesos=[int(p) for p in opcion('--procesos').split(',')] if opcion('--procesos') else None,
+        estres_xp=[int(h) for h in opcion('--estres-xp').split(',')] if opcion('--estres-xp') else None
+    )
+    imprimir_resultados(reporte)
+
+    salida = opcion('--salida', 'benchmark.json')
+    with open(salida, 'w') as f:
+        json.dump(reporte, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados guardados en {salida}")
+
+    if 'estres_xp' in reporte['resultados']:
+        perdidas = perdidas_estres_xp(reporte)
+        print("\n✅ Sin actualizaciones de XP perdidas" if not perdidas else f"\n⚠️  {perdidas} actualizaciones de XP perdidas o inconsistentes")
+        if perdidas:
+            sys.exit(1)
+
+    previo = opcion('--comparar')
+    if previo:
+        with open(previo) as f:
+            regresiones = comparar(json.load(f), reporte, float(opcion('--umbral', 1.2)))
+        for r in regresiones:
+            errores = f", {r['errores']} errores nuevos" if r['errores'] > 0 else ''
+            print(f"⚠️  {r['escenario']} x{r['hilos']}: p50 {r['antes_ms']:.2f}ms -> {r['despues_ms']:.2f}ms "
+                  f"({r['factor']}x){errores}")
+        print("✅ Sin regresiones" if not regresiones else f"{len(regresiones)} regresiones")
+        sys.exit(1 if regresiones else 0)
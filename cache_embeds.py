@@ -0,0 +1,49 @@
+"""
+Caché de los embeds de los paneles de clan (/info_clan, /stats_clan).
+
+Cada entrada guarda el embed serializado junto con la versión del clan
+(database.version_clan, que cambia con cualquier escritura que lo toque) y una
+firma de lo que el embed toma de fuera de la base: color del rol, si el líder
+sigue en el servidor, el día UTC para las ventanas de XP. Mientras ninguna
+cambie, repetir el comando no consulta la base ni recorre la lista de miembros.
+"""
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+import discord
+
+from database import version_clan
+from metricas import contar
+
+TAMANO_CACHE = 1024
+
+_cache: Dict[Tuple[str, int, str], Dict] = {}
+
+def obtener(vista: str, guild_id: int, clan_nombre: str,
+            construir: Callable[[], Optional[Tuple[discord.Embed, Dict]]],
+            firma: Callable[[Dict], Hashable] = lambda contexto: None) -> Optional[discord.Embed]:
+    """
+    Embed de `vista` para el clan, desde la caché si sigue vigente.
+
+    Args:
+        construir: arma el embed; devuelve (embed, contexto) o None si el clan no existe.
+            El contexto son los datos del clan que necesita `firma` (ids de rol, líder...)
+        firma: valor que cambia cuando cambia algo ajeno a la base que el embed muestra
+    """
+    clave = (vista, guild_id, clan_nombre)
+    version = version_clan(guild_id, clan_nombre)
+    entrada = _cache.get(clave)
+    if entrada and entrada['version'] == version and entrada['firma'] == firma(entrada['contexto']):
+        contar(f"embeds.{vista}.aciertos")
+        return discord.Embed.from_dict(entrada['datos'])
+
+    contar(f"embeds.{vista}.fallos")
+    resultado = construir()
+    if resultado is None:
+        return None
+    embed, contexto = resultado
+
+    if len(_cache) >= TAMANO_CACHE:
+        _cache.clear()
+    # Se guarda la versión leída antes de construir: si hubo una escritura en medio, la próxima vez se reconstruye
+    _cache[clave] = {'version': version, 'firma': firma(contexto), 'contexto': contexto, 'datos': embed.to_dict()}
+    return embed
@@ -0,0 +1,100 @@
+"""
+Clasificación de clanes en memoria (database.py mantiene una por servidor).
+
+Los clanes se guardan en una lista ordenada por (nivel desc, xp desc, nombre):
+la posición de un clan y el lugar de inserción se ubican con búsqueda binaria y
+el top-N es un slice. Mover un clan es un del + insert en la lista, O(n) en
+copias de punteros (memmove): con los clanes de un solo servidor (cientos, unos
+pocos miles) cuesta microsegundos, menos que mantener buckets o un árbol.
+"""
+import threading
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Tuple
+
+Clave = Tuple[int, int, str]
+
+def _clave(nombre: str, nivel: int, xp: int) -> Clave:
+    return (-nivel, -xp, nombre)
+
+class Clasificacion:
+    """Clanes ordenados por nivel y XP, con posición por nombre en O(log n)"""
+
+    def __init__(self):
+        self._orden: List[Clave] = []
+        self._claves: Dict[str, Clave] = {}
+        self._secuencias: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._orden)
+
+    def __contains__(self, nombre: str) -> bool:
+        return nombre in self._claves
+
+    def cargar(self, clanes: Iterable[Tuple[str, int, int]]):
+        """Reemplazar el contenido con [(nombre, nivel, xp), ...]"""
+        claves = {nombre: _clave(nombre, nivel, xp) for nombre, nivel, xp in clanes}
+        with self._lock:
+            self._claves = claves
+            self._secuencias = {}
+            self._orden = sorted(claves.values())
+
+    def actualizar(self, nombre: str, nivel: int, xp: int,
+                   secuencia: Optional[int] = None) -> Tuple[Optional[int], int]:
+        """
+        Insertar o mover un clan (hacia arriba o hacia abajo). Devuelve (posición anterior,
+        posición nueva), empezando en 1; la anterior es None si el clan no estaba.
+
+        `secuencia` ordena las escrituras de un mismo clan: una menor que la última
+        aplicada es de una transacción que confirmó antes pero llegó después, y se
+        ignora (las dos posiciones son la actual).
+        """
+        nueva = _clave(nombre, nivel, xp)
+        with self._lock:
+            anterior = self._claves.get(nombre)
+            if secuencia is not None:
+                if secuencia < self._secuencias.get(nombre, secuencia):
+                    actual = bisect_left(self._orden, anterior) + 1 if anterior is not None else None
+                    return actual, actual
+                self._secuencias[nombre] = secuencia
+
+            posicion_anterior = None
+            if anterior is not None:
+                indice = bisect_left(self._orden, anterior)
+                posicion_anterior = indice + 1
+                del self._orden[indice]
+
+            insort(self._orden, nueva)
+            self._claves[nombre] = nueva
+            return posicion_anterior, bisect_left(self._orden, nueva) + 1
+
+    def posiciones(self, nombre: str, nivel: int, xp: int) -> Tuple[Optional[int], int]:
+        """Lo que devolvería actualizar(nombre, nivel, xp), sin mover el clan"""
+        nueva = _clave(nombre, nivel, xp)
+        with self._lock:
+            anterior = self._claves.get(nombre)
+            if anterior is None:
+                return None, bisect_left(self._orden, nueva) + 1
+            indice = bisect_left(self._orden, anterior)
+            nuevo_indice = bisect_left(self._orden, nueva)
+            if nueva > anterior:
+                # Baja: su entrada vieja, que se quitaría, está antes del nuevo lugar
+                nuevo_indice -= 1
+            return indice + 1, nuevo_indice + 1
+
+    def posicion(self, nombre: str) -> Optional[int]:
+        """Posición del clan (1 = primero) o None si no está"""
+        with self._lock:
+            clave = self._claves.get(nombre)
+            if clave is None:
+                return None
+            return bisect_left(self._orden, clave) + 1
+
+    def top(self, n: int = 10) -> List[Dict]:
+        """Los n primeros: [{'posicion', 'nombre', 'nivel', 'xp'}]"""
+        with self._lock:
+            primeros = self._orden[:n]
+        return [
+            {'posicion': i, 'nombre': nombre, 'nivel': -nivel, 'xp': -xp}
+            for i, (nivel, xp, nombre) in enumerate(primeros, 1)
+        ]
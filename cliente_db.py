@@ -0,0 +1,153 @@
+"""
+Cliente del servicio de base de datos (servicio_db.py).
+
+Con DB_SOCKET definida, database.py reemplaza sus funciones públicas por
+ClienteDB.funcion(nombre): la llamada viaja por el socket Unix, el servicio
+la ejecuta contra clan_data.db y devuelve el resultado tal cual (dicts, sets,
+datetime...). Cada hilo usa su propia conexión al socket.
+
+Un hilo aparte queda suscrito a los cambios de clanes que difunde el servicio,
+para que las cachés locales (embeds, paneles) se invaliden igual que cuando
+la base se abre en el mismo proceso.
+
+Mensajes: 4 bytes de largo (big endian) + pickle. El socket se crea con
+permisos 0600, así que solo el usuario del bot puede conectarse.
+"""
+import time
+import pickle
+import socket
+import struct
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Optional, Tuple
+
+from metricas import contar
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT = 120.0   # segundos; las exclusivas (migraciones, compactar) pueden tardar
+ESPERA_MAXIMA_RECONEXION = 30.0
+
+_CABECERA = struct.Struct('>I')
+
+# ==================== PROTOCOLO ====================
+
+def codificar(mensaje: Any) -> bytes:
+    datos = pickle.dumps(mensaje, protocol=pickle.HIGHEST_PROTOCOL)
+    return _CABECERA.pack(len(datos)) + datos
+
+def _leer_exacto(sock: socket.socket, n: int) -> bytes:
+    partes = []
+    while n:
+        parte = sock.recv(n)
+        if not parte:
+            raise EOFError('el servicio cerró la conexión')
+        partes.append(parte)
+        n -= len(parte)
+    return b''.join(partes)
+
+def recibir(sock: socket.socket) -> Any:
+    largo, = _CABECERA.unpack(_leer_exacto(sock, _CABECERA.size))
+    return pickle.loads(_leer_exacto(sock, largo))
+
+async def recibir_async(reader: asyncio.StreamReader) -> Any:
+    largo, = _CABECERA.unpack(await reader.readexactly(_CABECERA.size))
+    return pickle.loads(await reader.readexactly(largo))
+
+# ==================== CLIENTE ====================
+
+class ClienteDB:
+    """Llamadas síncronas al servicio, una conexión por hilo"""
+
+    def __init__(self, ruta_socket: str, timeout: float = TIMEOUT):
+        self.ruta_socket = ruta_socket
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _socket(self) -> socket.socket:
+        sock = getattr(self._local, 'socket', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.ruta_socket)
+            except OSError:
+                sock.close()
+                raise
+            self._local.socket = sock
+        return sock
+
+    def _cerrar(self):
+        sock = getattr(self._local, 'socket', None)
+        self._local.socket = None
+        if sock is not None:
+            sock.close()
+
+    def llamar(self, nombre: str, args: tuple, kwargs: dict, reintentar: bool = False) -> Any:
+        """
+        Ejecutar `nombre` en el servicio. Con `reintentar`, un fallo de conexión
+        (p. ej. el servicio se reinició) se reintenta una vez con una conexión nueva;
+        solo para lecturas, una escritura podría haberse aplicado antes del corte.
+        """
+        for intento in range(2 if reintentar else 1):
+            try:
+                sock = self._socket()
+                sock.sendall(codificar(('llamar', nombre, args, kwargs)))
+                estado, valor = recibir(sock)
+                break
+            except (OSError, EOFError) as e:
+                self._cerrar()
+                if intento or not reintentar:
+                    contar('servicio_db.errores')
+                    raise ConnectionError(f"Servicio de base de datos no disponible en {self.ruta_socket}: {e}") from e
+
+        if estado == 'error':
+            raise RuntimeError(f"{nombre} falló en el servicio de base de datos: {valor}")
+        return valor
+
+    def funcion(self, nombre: str, reintentar: bool = False, fallo: Optional[Callable[[], Any]] = None) -> Callable:
+        """
+        Función con la firma de database.<nombre> que llama al servicio. Con `fallo`, si la
+        llamada falla (servicio caído, timeout, error en el servicio) se registra y se devuelve
+        fallo(), lo mismo que devuelve la función de database.py cuando falla.
+        """
+        def llamada(*args, **kwargs):
+            try:
+                return self.llamar(nombre, args, kwargs, reintentar)
+            except (ConnectionError, RuntimeError) as e:
+                if fallo is None:
+                    raise
+                logger.error(f"Error en {nombre}: {e}")
+                return fallo()
+        llamada.__name__ = llamada.__qualname__ = nombre
+        return llamada
+
+    def escuchar_cambios(self, funcion: Callable[[Optional[Tuple[int, str]]], None]):
+        """Llamar `funcion((guild_id, clan_nombre))` (None = todos) por cada cambio que difunda el servicio"""
+        threading.Thread(
+            target=self._escuchar, args=(funcion,), name='cliente-db-cambios', daemon=True
+        ).start()
+
+    def _escuchar(self, funcion: Callable[[Optional[Tuple[int, str]]], None]):
+        espera = 0.5
+        conectado_antes = False
+        while True:
+            conectado = False
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.connect(self.ruta_socket)
+                    sock.sendall(codificar(('suscribir',)))
+                    conectado = True
+                    if conectado_antes:
+                        # Pudieron perderse avisos mientras no había conexión
+                        funcion(None)
+                    conectado_antes = True
+                    espera = 0.5
+                    while True:
+                        funcion(recibir(sock))
+            except (OSError, EOFError) as e:
+                if conectado:
+                    logger.warning(f"Se perdió la suscripción a cambios del servicio de base de datos: {e}")
+            time.sleep(espera)
+            espera = min(espera * 2, ESPERA_MAXIMA_RECONEXION)
@@ -1,14 +1,29 @@
+import os
 import sqlite3
 import json
+import threading
+import functools
+import itertools
+from collections import OrderedDict
 from contextlib import contextmanager
-from typing import Dict, List, Optional, Tuple
-from datetime import datetime, timedelta
+from typing import Any, Dict, Generator, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+import time
 import logging
 
+from metricas import medido, contar, marcar_error
+from almacenamiento import crear_almacen
+from indices import asegurar_indices, verificar_indices, ORDEN_ROLES_SQL
+from migraciones import aplicar_migraciones
+from clasificacion import Clasificacion
+
 logger = logging.getLogger(__name__)
 
 DATABASE_FILE = 'clan_data.db'
 
+# SQLite en DATABASE_FILE, o PostgreSQL si DATABASE_URL apunta a uno (ver almacenamiento.py)
+_almacen = crear_almacen(os.getenv('DATABASE_URL'), lambda: DATABASE_FILE)
+
 # Configuración de niveles de clanes
 NIVELES_CLAN = {
     1: {'xp_requerido': 0, 'limite_miembros': 10, 'canales_texto': 3, 'canales_voz': 2},
@@ -19,31 +34,202 @@ NIVELES_CLAN = {
     6: {'xp_requerido': 15000, 'limite_miembros': 100, 'canales_texto': 999, 'canales_voz': 999},
 }
 
+def _nivel_segun_xp(xp: int) -> int:
+    """El mayor nivel cuyo requisito de XP se alcanza"""
+    return max((nivel for nivel, config in NIVELES_CLAN.items() if xp >= config['xp_requerido']), default=1)
+
+# La misma regla en SQL, evaluada en el UPDATE sobre la XP ya sumada: un ? por nivel, con la cantidad
+_NIVEL_SEGUN_XP_SQL = 'CASE ' + ' '.join(
+    f"WHEN xp_actual + ? >= {config['xp_requerido']} THEN {nivel}"
+    for nivel, config in sorted(NIVELES_CLAN.items(), reverse=True)
+) + ' ELSE 1 END'
+
+# Un clan se identifica por su servidor y su nombre: dos servidores pueden tener clanes
+# con el mismo nombre. En memoria, la clave de un clan es la tupla (guild_id, clan_nombre)
+ClaveClan = Tuple[int, str]
+
+# Índice en memoria de membresías activas: usuario_id -> {(guild_id, clan_nombre): rol_clan}
+_indice_membresias: Dict[int, Dict[ClaveClan, str]] = {}
+_indice_cargado = False
+
+# Clasificación de los clanes de cada servidor por (nivel, xp), mantenida en cada agregar_xp_clan
+_clasificaciones: Dict[int, Clasificacion] = {}
+_clasificacion_cargada = False
+# Orden de las escrituras de XP: se toma con la fila del clan bloqueada, así que para un
+# mismo clan sigue el orden de los commits aunque sus efectos se apliquen desordenados
+_secuencia_xp = itertools.count(1)
+
+# Versión de los datos de cada clan: cambia con cada escritura que lo toca, así las
+# cachés derivadas (embeds de info/estadísticas) saben si siguen vigentes sin consultar
+# la base. _epoca_clanes invalida todos a la vez (p. ej. al asignarles servidor).
+_versiones_clan: Dict[ClaveClan, int] = {}
+_epoca_clanes = 0
+# Funciones avisadas en cada cambio de versión ((guild_id, clan_nombre), o None si cambiaron todos)
+_oyentes_cambios: List = []
+
+# Conexión con transacción abierta en cada hilo: las llamadas anidadas (una función que
+# llama a otra, o un lote del servicio de base de datos) la reutilizan con un SAVEPOINT.
+# Los efectos en memoria de sus escrituras (versiones, índices, clasificación, avisos)
+# esperan en al_confirmar hasta el commit
+_transaccion_hilo = threading.local()
+
+# Caché LRU de invitaciones consultadas desde los botones de los DMs. La usan los hilos de
+# to_thread y los lectores del servicio de base de datos: todo acceso va bajo su lock.
+# Cada invalidación sube la generación, así una lectura de la base que se cruzó con un
+# cambio no vuelve a guardar la fila vieja
+TAMANO_CACHE_INVITACIONES = 256
+_cache_invitaciones: 'OrderedDict[int, Dict]' = OrderedDict()
+_lock_cache_invitaciones = threading.Lock()
+_generacion_invitaciones = 0
+
+def _al_confirmar(funcion, *args):
+    """
+    Ejecutar `funcion(*args)` cuando se confirme la transacción abierta en el hilo (ya mismo si
+    no hay ninguna). Si se deshace, o se deshace el SAVEPOINT en que se registró, no se ejecuta.
+    """
+    if getattr(_transaccion_hilo, 'conexion', None) is None:
+        funcion(*args)
+    else:
+        _transaccion_hilo.al_confirmar.append((funcion, args))
+
+def _tras_confirmar(funcion):
+    """Efecto en memoria de una escritura: se aplica con _al_confirmar"""
+    @functools.wraps(funcion)
+    def diferida(*args):
+        _al_confirmar(funcion, *args)
+    return diferida
+
+def _ejecutar_al_confirmar(pendientes: list):
+    for funcion, args in pendientes:
+        try:
+            funcion(*args)
+        except Exception as e:
+            logger.error(f"Error al aplicar {funcion.__name__} tras confirmar: {e}")
+
+def version_clan(guild_id: int, clan_nombre: str) -> int:
+    """Versión actual de los datos del clan (solo crece mientras el proceso vive)"""
+    return _epoca_clanes + _versiones_clan.get((guild_id, clan_nombre), 0)
+
+def _clasificacion_de(guild_id: int) -> Clasificacion:
+    clasificacion = _clasificaciones.get(guild_id)
+    if clasificacion is None:
+        clasificacion = _clasificaciones.setdefault(guild_id, Clasificacion())
+    return clasificacion
+
+def al_cambiar_clan(funcion):
+    """
+    Registrar `funcion((guild_id, clan_nombre))` para cada escritura que toque un clan (None = todos).
+    Se llama desde el hilo que escribió: la función debe ser rápida y thread-safe.
+    """
+    _oyentes_cambios.append(funcion)
+
+def _avisar_cambio(clave: Optional[ClaveClan]):
+    for funcion in _oyentes_cambios:
+        try:
+            funcion(clave)
+        except Exception as e:
+            logger.error(f"Error al avisar cambio del clan {clave}: {e}")
+
+@_tras_confirmar
+def _tocar_clan(guild_id: int, *clanes: str):
+    for clan_nombre in clanes:
+        clave = (guild_id, clan_nombre)
+        _versiones_clan[clave] = _versiones_clan.get(clave, 0) + 1
+        _avisar_cambio(clave)
+
+@_tras_confirmar
+def _tocar_todos_los_clanes():
+    global _epoca_clanes
+    _epoca_clanes += 1
+    _avisar_cambio(None)
+
+class _Deshacer(Exception):
+    """Deshacer la transacción (o el SAVEPOINT) en curso sin contarla como error"""
+
 @contextmanager
 def get_db_connection():
-    """Context manager para conexiones a la base de datos"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")
+    """
+    Context manager para conexiones a la base de datos.
+    Si el hilo ya tiene una abierta, la reutiliza dentro de un SAVEPOINT: una segunda
+    conexión esperaría el lock de escritura de la primera hasta el timeout.
+    """
+    conn = getattr(_transaccion_hilo, 'conexion', None)
+    if conn is not None:
+        yield from _savepoint(conn)
+        return
+
+    try:
+        conn = _almacen.conectar()
+    except Exception:
+        marcar_error()
+        raise
+    _transaccion_hilo.conexion = conn
+    _transaccion_hilo.profundidad = 0
+    _transaccion_hilo.al_confirmar = pendientes = []
     try:
         yield conn
         conn.commit()
+    except _Deshacer:
+        conn.rollback()
+        raise
     except Exception as e:
         conn.rollback()
+        marcar_error()
+        contar('db.transacciones_fallidas')
         logger.error(f"Error en transacción de base de datos: {e}")
         raise
     finally:
+        _transaccion_hilo.conexion = None
+        _transaccion_hilo.al_confirmar = None
         conn.close()
+    # Confirmada: recién ahora se ven los cambios en memoria y se avisa a los oyentes
+    _ejecutar_al_confirmar(pendientes)
+
+def _savepoint(conn: sqlite3.Connection):
+    _transaccion_hilo.profundidad += 1
+    nombre = f"anidada_{_transaccion_hilo.profundidad}"
+    marca = len(_transaccion_hilo.al_confirmar)
+    conn.execute(f"SAVEPOINT {nombre}")
+    try:
+        yield conn
+        conn.execute(f"RELEASE {nombre}")
+    except Exception as e:
+        # Deshacer solo lo de esta llamada (y sus efectos en memoria); la transacción exterior sigue
+        conn.execute(f"ROLLBACK TO {nombre}")
+        conn.execute(f"RELEASE {nombre}")
+        del _transaccion_hilo.al_confirmar[marca:]
+        if not isinstance(e, _Deshacer):
+            marcar_error()
+            contar('db.transacciones_fallidas')
+        raise
+    finally:
+        _transaccion_hilo.profundidad -= 1
+
+@contextmanager
+def lote_escrituras():
+    """
+    Ejecutar varias funciones de escritura en una sola transacción del hilo actual:
+    cada una queda en su SAVEPOINT (si falla se deshace solo la suya) y hay un
+    único commit al final. Lo usa servicio_db.py para agrupar escrituras.
+    """
+    with get_db_connection() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        yield conn
 
+@medido('db')
 def init_database():
     """Inicializar la base de datos con las tablas necesarias"""
+    # Primero las migraciones (bases creadas con esquemas anteriores): cada una trabaja con el
+    # esquema de su versión. Una base vacía queda directamente en la última
+    aplicar_migraciones(get_db_connection, _almacen)
+
     with get_db_connection() as conn:
         cursor = conn.cursor()
 
         # Tabla de clanes (actualizada)
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS clanes (
-                nombre TEXT PRIMARY KEY,
+                nombre TEXT NOT NULL,
                 creador_id INTEGER NOT NULL,
                 descripcion TEXT DEFAULT '',
                 nivel INTEGER DEFAULT 1,
@@ -57,7 +243,10 @@ def init_database():
                 canal_admin_id INTEGER NOT NULL,
                 canal_general_id INTEGER NOT NULL,
                 invite_code TEXT NOT NULL,
-                color_rol TEXT DEFAULT NULL
+                color_rol TEXT DEFAULT NULL,
+                panel_mensaje_id INTEGER DEFAULT NULL,
+                guild_id INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (guild_id, nombre)
             )
         ''')
 
@@ -65,13 +254,15 @@ def init_database():
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS miembros_clan (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                guild_id INTEGER NOT NULL DEFAULT 0,
                 clan_nombre TEXT NOT NULL,
                 usuario_id INTEGER NOT NULL,
                 rol_clan TEXT DEFAULT 'Recluta',
                 fecha_union TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 activo INTEGER DEFAULT 1,
-                FOREIGN KEY (clan_nombre) REFERENCES clanes(nombre) ON DELETE CASCADE,
-                UNIQUE(clan_nombre, usuario_id)
+                FOREIGN KEY (guild_id, clan_nombre) REFERENCES clanes(guild_id, nombre)
+                    ON DELETE CASCADE ON UPDATE CASCADE,
+                UNIQUE(guild_id, clan_nombre, usuario_id)
             )
         ''')
 
@@ -79,6 +270,7 @@ def init_database():
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS invitaciones_pendientes (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                guild_id INTEGER NOT NULL DEFAULT 0,
                 clan_nombre TEXT NOT NULL,
                 usuario_invitado_id INTEGER NOT NULL,
                 usuario_que_invita_id INTEGER NOT NULL,
@@ -87,7 +279,8 @@ def init_database():
                 fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 fecha_expiracion TIMESTAMP NOT NULL,
                 estado TEXT DEFAULT 'pendiente',
-                FOREIGN KEY (clan_nombre) REFERENCES clanes(nombre) ON DELETE CASCADE
+                FOREIGN KEY (guild_id, clan_nombre) REFERENCES clanes(guild_id, nombre)
+                    ON DELETE CASCADE ON UPDATE CASCADE
             )
         ''')
 
@@ -95,13 +288,41 @@ def init_database():
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS historial_xp (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                guild_id INTEGER NOT NULL DEFAULT 0,
                 clan_nombre TEXT NOT NULL,
                 cantidad_xp INTEGER NOT NULL,
                 razon TEXT NOT NULL,
                 origen TEXT DEFAULT 'sistema',
                 fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 usuario_id INTEGER,
-                FOREIGN KEY (clan_nombre) REFERENCES clanes(nombre) ON DELETE CASCADE
+                FOREIGN KEY (guild_id, clan_nombre) REFERENCES clanes(guild_id, nombre)
+                    ON DELETE CASCADE ON UPDATE CASCADE
+            )
+        ''')
+
+        # Resúmenes del historial de XP por día y por hora (UTC), actualizados en cada agregar_xp_clan
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS historial_xp_diario (
+                guild_id INTEGER NOT NULL DEFAULT 0,
+                clan_nombre TEXT NOT NULL,
+                dia TEXT NOT NULL,
+                xp_total INTEGER NOT NULL DEFAULT 0,
+                eventos INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (guild_id, clan_nombre, dia),
+                FOREIGN KEY (guild_id, clan_nombre) REFERENCES clanes(guild_id, nombre)
+                    ON DELETE CASCADE ON UPDATE CASCADE
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS historial_xp_horario (
+                guild_id INTEGER NOT NULL DEFAULT 0,
+                clan_nombre TEXT NOT NULL,
+                hora TEXT NOT NULL,
+                xp_total INTEGER NOT NULL DEFAULT 0,
+                eventos INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (guild_id, clan_nombre, hora),
+                FOREIGN KEY (guild_id, clan_nombre) REFERENCES clanes(guild_id, nombre)
+                    ON DELETE CASCADE ON UPDATE CASCADE
             )
         ''')
 
@@ -109,30 +330,32 @@ def init_database():
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS canales_clan (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                guild_id INTEGER NOT NULL DEFAULT 0,
                 clan_nombre TEXT NOT NULL,
                 canal_id INTEGER NOT NULL,
                 nombre TEXT NOT NULL,
                 tipo TEXT NOT NULL,
                 fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (clan_nombre) REFERENCES clanes(nombre) ON DELETE CASCADE
+                FOREIGN KEY (guild_id, clan_nombre) REFERENCES clanes(guild_id, nombre)
+                    ON DELETE CASCADE ON UPDATE CASCADE
             )
         ''')
 
-        # Índices para mejorar performance
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_miembros_clan ON miembros_clan(clan_nombre)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_miembros_usuario ON miembros_clan(usuario_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_invitaciones_estado ON invitaciones_pendientes(estado)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_historial_clan ON historial_xp(clan_nombre)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_canales_clan ON canales_clan(clan_nombre)')
+        # Índices (declarados en indices.py junto a las consultas que sirven)
+        asegurar_indices(conn)
+        # Los planes esperados son los de SQLite (EXPLAIN QUERY PLAN)
+        for problema in (verificar_indices(conn) if _almacen.nombre == 'sqlite' else []):
+            logger.warning(f"El índice {problema['nombre']} no se usa: {' / '.join(problema['plan'])}")
 
         logger.info("Base de datos v2 inicializada correctamente")
 
 # ==================== FUNCIONES DE CLANES ====================
 
-def crear_clan(nombre: str, creador_id: int, descripcion: str, rol_id: int,
+@medido('db')
+def crear_clan(guild_id: int, nombre: str, creador_id: int, descripcion: str, rol_id: int,
                categoria_id: int, canal_anuncios_id: int, canal_admin_id: int,
                canal_general_id: int, invite_code: str) -> bool:
-    """Crear un nuevo clan"""
+    """Crear un nuevo clan en el servidor `guild_id` (el nombre es único dentro del servidor)"""
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
@@ -140,32 +363,37 @@ def crear_clan(nombre: str, creador_id: int, descripcion: str, rol_id: int,
             # Crear clan
             cursor.execute('''
                 INSERT INTO clanes
-                (nombre, creador_id, descripcion, rol_id, categoria_id, canal_anuncios_id,
+                (guild_id, nombre, creador_id, descripcion, rol_id, categoria_id, canal_anuncios_id,
                  canal_admin_id, canal_general_id, invite_code)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (nombre, creador_id, descripcion, rol_id, categoria_id, canal_anuncios_id,
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (guild_id, nombre, creador_id, descripcion, rol_id, categoria_id, canal_anuncios_id,
                   canal_admin_id, canal_general_id, invite_code))
 
             # Agregar creador como miembro con rol Líder
             cursor.execute('''
-                INSERT INTO miembros_clan (clan_nombre, usuario_id, rol_clan)
-                VALUES (?, ?, 'Líder')
-            ''', (nombre, creador_id))
-
+                INSERT INTO miembros_clan (guild_id, clan_nombre, usuario_id, rol_clan)
+                VALUES (?, ?, ?, 'Líder')
+            ''', (guild_id, nombre, creador_id))
+
+        _indexar_membresia(creador_id, guild_id, nombre, 'Líder')
+        _tocar_clan(guild_id, nombre)
+        if _clasificacion_cargada:
+            _al_confirmar(_clasificacion_de(guild_id).actualizar, nombre, 1, 0)
         return True
-    except sqlite3.IntegrityError:
-        logger.warning(f"El clan '{nombre}' ya existe")
+    except _almacen.ErrorIntegridad:
+        logger.warning(f"El clan '{nombre}' ya existe en el servidor {guild_id}")
         return False
     except Exception as e:
         logger.error(f"Error al crear clan: {e}")
         return False
 
-def obtener_clan(nombre: str) -> Optional[Dict]:
-    """Obtener información completa de un clan"""
+@medido('db')
+def obtener_clan(guild_id: int, nombre: str) -> Optional[Dict]:
+    """Obtener información completa de un clan del servidor `guild_id`"""
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT * FROM clanes WHERE nombre = ?', (nombre,))
+            cursor.execute('SELECT * FROM clanes WHERE guild_id = ? AND nombre = ?', (guild_id, nombre))
             row = cursor.fetchone()
 
             if not row:
@@ -175,8 +403,8 @@ def obtener_clan(nombre: str) -> Optional[Dict]:
             cursor.execute('''
                 SELECT canal_id, nombre, tipo
                 FROM canales_clan
-                WHERE clan_nombre = ?
-            ''', (nombre,))
+                WHERE guild_id = ? AND clan_nombre = ?
+            ''', (guild_id, nombre))
             canales_extra = [
                 {'id': r['canal_id'], 'nombre': r['nombre'], 'tipo': r['tipo']}
                 for r in cursor.fetchall()
@@ -203,34 +431,37 @@ def obtener_clan(nombre: str) -> Optional[Dict]:
                 'invite_code': row['invite_code'],
                 'color_rol': row['color_rol'],
                 'fecha_creacion': row['fecha_creacion'],
-                'canales_extra': canales_extra
+                'canales_extra': canales_extra,
+                'guild_id': row['guild_id']
             }
     except Exception as e:
         logger.error(f"Error al obtener clan: {e}")
         return None
 
-def clan_existe(nombre: str) -> bool:
-    """Verificar si un clan existe"""
+@medido('db')
+def clan_existe(guild_id: int, nombre: str) -> bool:
+    """Verificar si el servidor `guild_id` tiene un clan con ese nombre"""
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT 1 FROM clanes WHERE nombre = ? LIMIT 1', (nombre,))
+            cursor.execute('SELECT 1 FROM clanes WHERE guild_id = ? AND nombre = ? LIMIT 1', (guild_id, nombre))
             return cursor.fetchone() is not None
     except Exception as e:
         logger.error(f"Error al verificar clan: {e}")
         return False
 
-def obtener_todos_clanes() -> Dict[str, Dict]:
-    """Obtener lista de todos los clanes con info básica"""
+@medido('db')
+def obtener_todos_clanes(guild_id: int) -> Dict[str, Dict]:
+    """Obtener los clanes del servidor `guild_id` con info básica"""
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT nombre, creador_id, descripcion, nivel, xp_actual,
-                       total_miembros_actuales, fecha_creacion
-                FROM clanes
+                       total_miembros_actuales, fecha_creacion, rol_id, invite_code
+                FROM clanes WHERE guild_id = ?
                 ORDER BY nivel DESC, xp_actual DESC
-            ''')
+            ''', (guild_id,))
 
             clanes = {}
             for row in cursor.fetchall():
@@ -240,7 +471,9 @@ def obtener_todos_clanes() -> Dict[str, Dict]:
                     'nivel': row['nivel'],
                     'xp_actual': row['xp_actual'],
                     'total_miembros': row['total_miembros_actuales'],
-                    'fecha_creacion': row['fecha_creacion']
+                    'fecha_creacion': row['fecha_creacion'],
+                    'rol_id': row['rol_id'],
+                    'invite_code': row['invite_code']
                 }
 
             return clanes
@@ -248,9 +481,39 @@ def obtener_todos_clanes() -> Dict[str, Dict]:
         logger.error(f"Error al obtener todos los clanes: {e}")
         return {}
 
+@medido('db')
+def asignar_guild_a_clanes_huerfanos(guild_id: int) -> int:
+    """
+    Asignar el servidor `guild_id` a los clanes sin servidor (creados antes de
+    guardar el servidor de cada clan). Sus miembros, historial e invitaciones los
+    siguen (ON UPDATE CASCADE). Los que ya tienen tocayo en ese servidor se quedan
+    sin asignar. Nunca es automático: lo pide un administrador con
+    importador_json.py --adoptar-huerfanos. Devuelve cuántos se asignaron
+    """
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.execute('''
+                UPDATE clanes SET guild_id = ?
+                WHERE guild_id = 0 AND nombre NOT IN (SELECT nombre FROM clanes WHERE guild_id = ?)
+            ''', (guild_id, guild_id))
+            asignados = cursor.rowcount
+
+        if asignados:
+            if _indice_cargado:
+                cargar_indice_membresias()
+            if _clasificacion_cargada:
+                cargar_clasificacion()
+            _tocar_todos_los_clanes()
+            logger.info(f"{asignados} clanes sin servidor asignados a {guild_id}")
+        return asignados
+    except Exception as e:
+        logger.error(f"Error al asignar servidor a clanes: {e}")
+        return 0
+
 # ==================== FUNCIONES DE XP ====================
 
-def agregar_xp_clan(clan_nombre: str, cantidad_xp: int, razon: str,
+@medido('db')
+def agregar_xp_clan(guild_id: int, clan_nombre: str, cantidad_xp: int, razon: str,
                     usuario_id: int = None, origen: str = "sistema") -> Optional[Dict]:
     """
     Función genérica para agregar XP a un clan
@@ -262,116 +525,374 @@ def agregar_xp_clan(clan_nombre: str, cantidad_xp: int, razon: str,
             'nivel_anterior': 1,
             'nivel_nuevo': 2,
             'subio_nivel': True,
-            'nuevo_limite_miembros': 20
+            'nuevo_limite_miembros': 20,
+            'posicion_anterior': 4,
+            'posicion_nueva': 3
         }
     """
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
 
-            # Obtener estado actual del clan
-            cursor.execute('''
-                SELECT nivel, xp_actual FROM clanes WHERE nombre = ?
-            ''', (clan_nombre,))
-            row = cursor.fetchone()
+            # Suma y nivel en un solo UPDATE atómico: sin leer antes, dos premios simultáneos
+            # no pueden pisarse y la transacción toma el lock de escritura desde la primera sentencia
+            parametros = (cantidad_xp,) * (1 + len(NIVELES_CLAN)) + (guild_id, clan_nombre)
+            if _almacen.soporta_returning:
+                cursor.execute(f'''
+                    UPDATE clanes
+                    SET xp_actual = xp_actual + ?, nivel = {_NIVEL_SEGUN_XP_SQL}
+                    WHERE guild_id = ? AND nombre = ?
+                    RETURNING xp_actual, nivel
+                ''', parametros)
+                row = cursor.fetchone()
+            else:
+                # SQLite < 3.35: se relee dentro de la misma transacción, que ya tiene el lock
+                cursor.execute(f'''
+                    UPDATE clanes
+                    SET xp_actual = xp_actual + ?, nivel = {_NIVEL_SEGUN_XP_SQL}
+                    WHERE guild_id = ? AND nombre = ?
+                ''', parametros)
+                row = cursor.execute('SELECT xp_actual, nivel FROM clanes WHERE guild_id = ? AND nombre = ?',
+                                     (guild_id, clan_nombre)).fetchone() if cursor.rowcount else None
 
             if not row:
                 logger.error(f"Clan '{clan_nombre}' no encontrado")
                 return None
 
-            nivel_anterior = row['nivel']
-            xp_anterior = row['xp_actual']
-            xp_nuevo = xp_anterior + cantidad_xp
-
-            # Calcular nuevo nivel
-            nivel_nuevo = nivel_anterior
-            for nivel, config in sorted(NIVELES_CLAN.items(), reverse=True):
-                if xp_nuevo >= config['xp_requerido']:
-                    nivel_nuevo = nivel
-                    break
-
-            # Actualizar clan
-            cursor.execute('''
-                UPDATE clanes
-                SET xp_actual = ?, nivel = ?
-                WHERE nombre = ?
-            ''', (xp_nuevo, nivel_nuevo, clan_nombre))
+            xp_nuevo = row['xp_actual']
+            nivel_nuevo = row['nivel']
+            secuencia = next(_secuencia_xp)
+            xp_anterior = xp_nuevo - cantidad_xp
+            nivel_anterior = _nivel_segun_xp(xp_anterior)
 
             # Registrar en historial
             cursor.execute('''
                 INSERT INTO historial_xp
-                (clan_nombre, cantidad_xp, razon, origen, usuario_id)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (clan_nombre, cantidad_xp, razon, origen, usuario_id))
+                (guild_id, clan_nombre, cantidad_xp, razon, origen, usuario_id)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (guild_id, clan_nombre, cantidad_xp, razon, origen, usuario_id))
+
+            # Acumular en los resúmenes por hora y por día
+            cursor.execute('''
+                INSERT INTO historial_xp_horario (guild_id, clan_nombre, hora, xp_total, eventos)
+                VALUES (?, ?, strftime('%Y-%m-%d %H:00:00', 'now'), ?, 1)
+                ON CONFLICT(guild_id, clan_nombre, hora) DO UPDATE SET
+                    xp_total = historial_xp_horario.xp_total + excluded.xp_total,
+                    eventos = historial_xp_horario.eventos + 1
+            ''', (guild_id, clan_nombre, cantidad_xp))
+            cursor.execute('''
+                INSERT INTO historial_xp_diario (guild_id, clan_nombre, dia, xp_total, eventos)
+                VALUES (?, ?, date('now'), ?, 1)
+                ON CONFLICT(guild_id, clan_nombre, dia) DO UPDATE SET
+                    xp_total = historial_xp_diario.xp_total + excluded.xp_total,
+                    eventos = historial_xp_diario.eventos + 1
+            ''', (guild_id, clan_nombre, cantidad_xp))
 
             subio_nivel = nivel_nuevo > nivel_anterior
 
-            return {
-                'xp_anterior': xp_anterior,
-                'xp_nuevo': xp_nuevo,
-                'nivel_anterior': nivel_anterior,
-                'nivel_nuevo': nivel_nuevo,
-                'subio_nivel': subio_nivel,
-                'nuevo_limite_miembros': NIVELES_CLAN[nivel_nuevo]['limite_miembros'],
-                'nuevos_canales_texto': NIVELES_CLAN[nivel_nuevo]['canales_texto'],
-                'nuevos_canales_voz': NIVELES_CLAN[nivel_nuevo]['canales_voz']
-            }
+        _tocar_clan(guild_id, clan_nombre)
+
+        # La clasificación se actualiza una vez confirmada la transacción (que puede ser la
+        # de un lote): las posiciones se calculan ya, sin moverla
+        posicion_anterior = posicion_nueva = None
+        if _clasificacion_cargada:
+            clasificacion = _clasificacion_de(guild_id)
+            posicion_anterior, posicion_nueva = clasificacion.posiciones(clan_nombre, nivel_nuevo, xp_nuevo)
+            _al_confirmar(clasificacion.actualizar, clan_nombre, nivel_nuevo, xp_nuevo, secuencia)
+
+        return {
+            'xp_anterior': xp_anterior,
+            'xp_nuevo': xp_nuevo,
+            'nivel_anterior': nivel_anterior,
+            'nivel_nuevo': nivel_nuevo,
+            'subio_nivel': subio_nivel,
+            'nuevo_limite_miembros': NIVELES_CLAN[nivel_nuevo]['limite_miembros'],
+            'nuevos_canales_texto': NIVELES_CLAN[nivel_nuevo]['canales_texto'],
+            'nuevos_canales_voz': NIVELES_CLAN[nivel_nuevo]['canales_voz'],
+            'posicion_anterior': posicion_anterior,
+            'posicion_nueva': posicion_nueva
+        }
 
     except Exception as e:
         logger.error(f"Error al agregar XP: {e}")
         return None
 
+@medido('db')
+def obtener_xp_ganada(guild_id: int, clan_nombre: str, dias: int = 7) -> int:
+    """XP ganada por el clan desde el inicio del día (UTC) de hace `dias` días"""
+    try:
+        with get_db_connection() as conn:
+            row = conn.execute('''
+                SELECT COALESCE(SUM(xp_total), 0) FROM historial_xp_diario
+                WHERE guild_id = ? AND clan_nombre = ? AND dia >= date('now', ?)
+            ''', (guild_id, clan_nombre, f'-{dias} days')).fetchone()
+            return row[0]
+    except Exception as e:
+        logger.error(f"Error al obtener XP ganada: {e}")
+        return 0
+
+# Periodos de /xp_historial: (tabla, columna, cantidad de buckets, tamaño del bucket)
+PERIODOS_XP = {
+    'dia': ('historial_xp_horario', 'hora', 24, timedelta(hours=1)),
+    'semana': ('historial_xp_diario', 'dia', 7, timedelta(days=1)),
+    'mes': ('historial_xp_diario', 'dia', 30, timedelta(days=1)),
+}
+
+@medido('db')
+def obtener_serie_xp(guild_id: int, clan_nombre: str, periodo: str = 'semana') -> List[Tuple[str, int]]:
+    """
+    XP del clan por bucket en el periodo, del más viejo al actual, con ceros donde no hubo actividad.
+
+    Returns:
+        [('2024-05-01', 120), ('2024-05-02', 0), ...]
+    """
+    tabla, columna, cantidad, paso = PERIODOS_XP[periodo]
+    formato = '%Y-%m-%d %H:00:00' if columna == 'hora' else '%Y-%m-%d'
+    ahora = datetime.now(timezone.utc)
+    claves = [(ahora - paso * i).strftime(formato) for i in range(cantidad - 1, -1, -1)]
+
+    try:
+        with get_db_connection() as conn:
+            filas = conn.execute(f'''
+                SELECT {columna}, xp_total FROM {tabla}
+                WHERE guild_id = ? AND clan_nombre = ? AND {columna} >= ?
+            ''', (guild_id, clan_nombre, claves[0])).fetchall()
+        valores = {fila[0]: fila[1] for fila in filas}
+        return [(clave, valores.get(clave, 0)) for clave in claves]
+    except Exception as e:
+        logger.error(f"Error al obtener serie de XP: {e}")
+        return []
+
+@medido('db')
+def obtener_ranking_crecimiento(guild_id: int, dias: int = 7, limite: int = 10) -> List[Tuple[str, int]]:
+    """Clanes del servidor `guild_id` que más XP ganaron desde el inicio del día (UTC) de hace `dias` días"""
+    try:
+        with get_db_connection() as conn:
+            # Recorre solo los días de los clanes del servidor (prefijo de la PRIMARY KEY)
+            filas = conn.execute('''
+                SELECT clan_nombre, SUM(xp_total) AS xp FROM historial_xp_diario
+                WHERE guild_id = ? AND dia >= date('now', ?)
+                GROUP BY clan_nombre
+                ORDER BY xp DESC
+                LIMIT ?
+            ''', (guild_id, f'-{dias} days', limite)).fetchall()
+            return [(fila['clan_nombre'], fila['xp']) for fila in filas]
+    except Exception as e:
+        logger.error(f"Error al obtener ranking de crecimiento: {e}")
+        return []
+
+# ==================== CLASIFICACIÓN ====================
+
+@medido('db')
+def cargar_clasificacion() -> int:
+    """Cargar en memoria la clasificación de los clanes de cada servidor. Devuelve el total cargado"""
+    global _clasificacion_cargada
+    try:
+        with get_db_connection() as conn:
+            filas = conn.execute('SELECT nombre, nivel, xp_actual, guild_id FROM clanes').fetchall()
+
+        por_guild: Dict[int, List[Tuple[str, int, int]]] = {}
+        for f in filas:
+            por_guild.setdefault(f['guild_id'], []).append((f['nombre'], f['nivel'], f['xp_actual']))
+
+        clasificaciones = {}
+        for guild_id, clanes in por_guild.items():
+            clasificaciones[guild_id] = Clasificacion()
+            clasificaciones[guild_id].cargar(clanes)
+
+        _clasificaciones.clear()
+        _clasificaciones.update(clasificaciones)
+        _clasificacion_cargada = True
+        logger.info(f"Clasificación cargada: {len(filas)} clanes en {len(clasificaciones)} servidores")
+        return len(filas)
+    except Exception as e:
+        logger.error(f"Error al cargar la clasificación: {e}")
+        return 0
+
+@medido('db')
+def obtener_top_clanes(n: int = 10, guild_id: Optional[int] = None) -> List[Dict]:
+    """
+    Los n mejores clanes del servidor `guild_id` (o de todos) por nivel y XP.
+    Si la clasificación aún no se ha cargado, o se pide la de todos los servidores,
+    consulta la base de datos.
+
+    Returns:
+        [{'posicion': 1, 'nombre': 'Los Lobos', 'nivel': 4, 'xp': 4100}, ...]
+    """
+    if _clasificacion_cargada and guild_id is not None:
+        return _clasificacion_de(guild_id).top(n)
+
+    filtro, parametros = ('WHERE guild_id = ?', (guild_id, n)) if guild_id is not None else ('', (n,))
+    try:
+        with get_db_connection() as conn:
+            filas = conn.execute(f'''
+                SELECT nombre, nivel, xp_actual FROM clanes {filtro}
+                ORDER BY nivel DESC, xp_actual DESC
+                LIMIT ?
+            ''', parametros).fetchall()
+        return [
+            {'posicion': i, 'nombre': f['nombre'], 'nivel': f['nivel'], 'xp': f['xp_actual']}
+            for i, f in enumerate(filas, 1)
+        ]
+    except Exception as e:
+        logger.error(f"Error al obtener top de clanes: {e}")
+        return []
+
+@medido('db')
+def obtener_posicion_clan(guild_id: int, clan_nombre: str) -> Optional[int]:
+    """Posición del clan en la clasificación de su servidor (1 = primero), o None si no está cargada"""
+    if not _clasificacion_cargada:
+        return None
+    return _clasificacion_de(guild_id).posicion(clan_nombre)
+
+# ==================== RETENCIÓN DEL HISTORIAL DE XP ====================
+
+# Los eventos (ya resumidos por día) más viejos que esto se borran
+DIAS_RETENCION_XP = 90
+# Los resúmenes por hora solo se usan para las últimas 24 horas
+DIAS_RETENCION_HORARIO = 30
+TAMANO_LOTE_RETENCION = 1000
+PAGINAS_VACUUM = 1000
+
+def _recorrer_lotes(pasos: Generator[float, None, Any]) -> Any:
+    """Aplicar en este hilo todos los lotes de un generador *_por_lotes, con la pausa que pide cada uno"""
+    while True:
+        try:
+            pausa = next(pasos)
+        except StopIteration as fin:
+            return fin.value
+        if pausa:
+            time.sleep(pausa)
+
+def _compactar_historial_xp_por_lotes(dias: int = DIAS_RETENCION_XP, tamano_lote: int = TAMANO_LOTE_RETENCION,
+                                      pausa: float = 0.01) -> Generator[float, None, Dict]:
+    """
+    compactar_historial_xp lote a lote: cada lote en su transacción, cediendo la pausa
+    a esperar antes del siguiente. Devuelve el resumen al terminar.
+    """
+    resultado = {'eventos': 0, 'lotes': 0, 'paginas_liberadas': 0}
+    horizonte = f'-{dias} days'
+
+    try:
+        while True:
+            with get_db_connection() as conn:
+                # Los ids crecen con la fecha: el lote son los primeros eventos viejos
+                filas = conn.execute('''
+                    SELECT id, fecha < date('now', ?) AS vieja FROM historial_xp
+                    ORDER BY id LIMIT ?
+                ''', (horizonte, tamano_lote)).fetchall()
+
+                hasta = None
+                for fila in filas:
+                    if not fila['vieja']:
+                        break
+                    hasta = fila['id']
+                if hasta is None:
+                    break
+
+                cursor = conn.execute('DELETE FROM historial_xp WHERE id <= ?', (hasta,))
+
+            resultado['eventos'] += cursor.rowcount
+            resultado['lotes'] += 1
+            # Soltar el lock entre lotes para no bloquear al bot
+            yield pausa
+
+        while True:
+            with get_db_connection() as conn:
+                cursor = conn.execute('''
+                    DELETE FROM historial_xp_horario WHERE rowid IN (
+                        SELECT rowid FROM historial_xp_horario
+                        WHERE hora < date('now', ?) LIMIT ?
+                    )
+                ''', (f'-{DIAS_RETENCION_HORARIO} days', tamano_lote))
+            if cursor.rowcount < tamano_lote:
+                break
+            yield pausa
+
+        with get_db_connection() as conn:
+            resultado['paginas_liberadas'] = _almacen.liberar_espacio(conn, PAGINAS_VACUUM)
+
+        if resultado['eventos']:
+            logger.info(
+                f"Historial de XP compactado: {resultado['eventos']} eventos en {resultado['lotes']} lotes, "
+                f"{resultado['paginas_liberadas']} páginas liberadas"
+            )
+        return resultado
+
+    except Exception as e:
+        logger.error(f"Error al compactar historial de XP: {e}")
+        return resultado
+
+@medido('db')
+def compactar_historial_xp(dias: int = DIAS_RETENCION_XP, tamano_lote: int = TAMANO_LOTE_RETENCION,
+                           pausa: float = 0.01) -> Dict:
+    """
+    Borrar los eventos con más de `dias` días (ya están en historial_xp_diario) y los
+    resúmenes por hora con más de DIAS_RETENCION_HORARIO días, por lotes cortos.
+    Al final libera páginas con incremental_vacuum.
+
+    Returns:
+        {'eventos': 12000, 'lotes': 12, 'paginas_liberadas': 340}
+    """
+    return _recorrer_lotes(_compactar_historial_xp_por_lotes(dias, tamano_lote, pausa))
+
 # ==================== FUNCIONES DE MIEMBROS ====================
 
-def agregar_miembro_clan(clan_nombre: str, usuario_id: int, rol_clan: str = 'Recluta') -> bool:
+@medido('db')
+def agregar_miembro_clan(guild_id: int, clan_nombre: str, usuario_id: int, rol_clan: str = 'Recluta') -> bool:
     """Agregar un miembro al clan"""
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
 
-            # Agregar miembro
+            # Agregar miembro (o reactivarlo si ya había salido del clan)
             cursor.execute('''
-                INSERT INTO miembros_clan (clan_nombre, usuario_id, rol_clan)
-                VALUES (?, ?, ?)
-            ''', (clan_nombre, usuario_id, rol_clan))
+                INSERT INTO miembros_clan (guild_id, clan_nombre, usuario_id, rol_clan)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(guild_id, clan_nombre, usuario_id) DO UPDATE
+                SET activo = 1, rol_clan = excluded.rol_clan, fecha_union = CURRENT_TIMESTAMP
+                WHERE miembros_clan.activo = 0
+            ''', (guild_id, clan_nombre, usuario_id, rol_clan))
+
+            if cursor.rowcount == 0:
+                logger.warning(f"Usuario {usuario_id} ya está en el clan '{clan_nombre}'")
+                return False
 
             # Actualizar contador de miembros
             cursor.execute('''
                 UPDATE clanes
                 SET total_miembros_actuales = total_miembros_actuales + 1,
                     total_miembros_historico = total_miembros_historico + 1
-                WHERE nombre = ?
-            ''', (clan_nombre,))
+                WHERE guild_id = ? AND nombre = ?
+            ''', (guild_id, clan_nombre))
 
             # Dar XP por nuevo miembro (+50 XP)
-            agregar_xp_clan(clan_nombre, 50, f"Nuevo miembro unido", usuario_id, "sistema")
+            agregar_xp_clan(guild_id, clan_nombre, 50, f"Nuevo miembro unido", usuario_id, "sistema")
 
+        _indexar_membresia(usuario_id, guild_id, clan_nombre, rol_clan)
+        _tocar_clan(guild_id, clan_nombre)
         return True
-    except sqlite3.IntegrityError:
+    except _almacen.ErrorIntegridad:
         logger.warning(f"Usuario {usuario_id} ya está en el clan '{clan_nombre}'")
         return False
     except Exception as e:
         logger.error(f"Error al agregar miembro: {e}")
         return False
 
-def obtener_miembros_clan(clan_nombre: str) -> List[Dict]:
+@medido('db')
+def obtener_miembros_clan(guild_id: int, clan_nombre: str) -> List[Dict]:
     """Obtener lista de miembros del clan"""
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT usuario_id, rol_clan, fecha_union, activo
                 FROM miembros_clan
-                WHERE clan_nombre = ? AND activo = 1
+                WHERE guild_id = ? AND clan_nombre = ? AND activo = 1
                 ORDER BY
-                    CASE rol_clan
-                        WHEN 'Líder' THEN 1
-                        WHEN 'Co-Líder' THEN 2
-                        WHEN 'Miembro' THEN 3
-                        WHEN 'Recluta' THEN 4
-                    END,
+                    {ORDEN_ROLES_SQL},
                     fecha_union
-            ''', (clan_nombre,))
+            ''', (guild_id, clan_nombre))
 
             return [
                 {
@@ -385,30 +906,223 @@ def obtener_miembros_clan(clan_nombre: str) -> List[Dict]:
         logger.error(f"Error al obtener miembros: {e}")
         return []
 
-def obtener_rol_miembro(clan_nombre: str, usuario_id: int) -> Optional[str]:
+@medido('db')
+def obtener_rol_miembro(guild_id: int, clan_nombre: str, usuario_id: int) -> Optional[str]:
     """Obtener el rol de un miembro en el clan"""
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT rol_clan FROM miembros_clan
-                WHERE clan_nombre = ? AND usuario_id = ? AND activo = 1
-            ''', (clan_nombre, usuario_id))
+                WHERE guild_id = ? AND clan_nombre = ? AND usuario_id = ? AND activo = 1
+            ''', (guild_id, clan_nombre, usuario_id))
             row = cursor.fetchone()
             return row['rol_clan'] if row else None
     except Exception as e:
         logger.error(f"Error al obtener rol: {e}")
         return None
 
-def es_miembro_clan(clan_nombre: str, usuario_id: int) -> bool:
+@medido('db')
+def es_miembro_clan(guild_id: int, clan_nombre: str, usuario_id: int) -> bool:
     """Verificar si un usuario es miembro del clan"""
-    return obtener_rol_miembro(clan_nombre, usuario_id) is not None
+    return obtener_rol_miembro(guild_id, clan_nombre, usuario_id) is not None
+
+def _desactivar_miembro(cursor: sqlite3.Cursor, guild_id: int, clan_nombre: str, usuario_id: int) -> bool:
+    """Marcar un miembro como inactivo y descontarlo del clan dentro de la transacción dada"""
+    cursor.execute('''
+        UPDATE miembros_clan SET activo = 0
+        WHERE guild_id = ? AND clan_nombre = ? AND usuario_id = ? AND activo = 1
+    ''', (guild_id, clan_nombre, usuario_id))
+
+    if cursor.rowcount == 0:
+        return False
+
+    cursor.execute('''
+        UPDATE clanes
+        SET total_miembros_actuales = MAX(total_miembros_actuales - 1, 0)
+        WHERE guild_id = ? AND nombre = ?
+    ''', (guild_id, clan_nombre))
+    return True
+
+@medido('db')
+def remover_miembro_clan(guild_id: int, clan_nombre: str, usuario_id: int) -> bool:
+    """Remover un miembro del clan (salida voluntaria o expulsión)"""
+    try:
+        with get_db_connection() as conn:
+            removido = _desactivar_miembro(conn.cursor(), guild_id, clan_nombre, usuario_id)
+
+        if removido:
+            _desindexar_membresia(usuario_id, guild_id, clan_nombre)
+            _tocar_clan(guild_id, clan_nombre)
+        return removido
+    except Exception as e:
+        logger.error(f"Error al remover miembro: {e}")
+        return False
+
+@medido('db')
+def remover_usuario_de_clanes(guild_id: int, usuario_id: int) -> List[str]:
+    """Remover a un usuario de todos sus clanes del servidor `guild_id` (p. ej. al salir de él)"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT clan_nombre FROM miembros_clan
+                WHERE usuario_id = ? AND activo = 1 AND guild_id = ?
+            ''', (usuario_id, guild_id))
+            clanes = [r['clan_nombre'] for r in cursor.fetchall()]
+
+            for clan_nombre in clanes:
+                _desactivar_miembro(cursor, guild_id, clan_nombre, usuario_id)
+
+        for clan_nombre in clanes:
+            _desindexar_membresia(usuario_id, guild_id, clan_nombre)
+        _tocar_clan(guild_id, *clanes)
+        return clanes
+    except Exception as e:
+        logger.error(f"Error al remover usuario de sus clanes: {e}")
+        return []
+
+@medido('db')
+def transferir_miembro(guild_id: int, usuario_id: int, clan_origen: str, clan_destino: str,
+                       rol_clan: str = 'Recluta') -> bool:
+    """Mover un miembro de un clan a otro del mismo servidor en una sola transacción"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+
+            if not _desactivar_miembro(cursor, guild_id, clan_origen, usuario_id):
+                logger.warning(f"Usuario {usuario_id} no es miembro activo de '{clan_origen}'")
+                return False
+
+            cursor.execute('''
+                INSERT INTO miembros_clan (guild_id, clan_nombre, usuario_id, rol_clan)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(guild_id, clan_nombre, usuario_id) DO UPDATE
+                SET activo = 1, rol_clan = excluded.rol_clan, fecha_union = CURRENT_TIMESTAMP
+                WHERE miembros_clan.activo = 0
+            ''', (guild_id, clan_destino, usuario_id, rol_clan))
+
+            if cursor.rowcount == 0:
+                # Ya era miembro del destino: deshacer la baja en el origen (dentro de un lote,
+                # solo el SAVEPOINT de esta llamada)
+                raise _Deshacer(f"Usuario {usuario_id} ya está en el clan '{clan_destino}'")
+
+            cursor.execute('''
+                UPDATE clanes
+                SET total_miembros_actuales = total_miembros_actuales + 1,
+                    total_miembros_historico = total_miembros_historico + 1
+                WHERE guild_id = ? AND nombre = ?
+            ''', (guild_id, clan_destino))
+
+        _desindexar_membresia(usuario_id, guild_id, clan_origen)
+        _indexar_membresia(usuario_id, guild_id, clan_destino, rol_clan)
+        _tocar_clan(guild_id, clan_origen, clan_destino)
+        return True
+    except _Deshacer as e:
+        logger.warning(str(e))
+        return False
+    except Exception as e:
+        logger.error(f"Error al transferir miembro: {e}")
+        return False
+
+# ==================== ÍNDICE DE MEMBRESÍAS ====================
+
+@medido('db')
+def obtener_membresias_usuario(usuario_id: int) -> List[Dict]:
+    """Obtener los clanes en los que un usuario es miembro activo (usa idx_miembros_usuario)"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT guild_id, clan_nombre, rol_clan, fecha_union
+                FROM miembros_clan
+                WHERE usuario_id = ? AND activo = 1
+                ORDER BY fecha_union
+            ''', (usuario_id,))
+
+            return [
+                {
+                    'guild_id': r['guild_id'],
+                    'clan_nombre': r['clan_nombre'],
+                    'rol': r['rol_clan'],
+                    'fecha_union': r['fecha_union']
+                }
+                for r in cursor.fetchall()
+            ]
+    except Exception as e:
+        logger.error(f"Error al obtener membresías del usuario: {e}")
+        return []
+
+@medido('db')
+def cargar_indice_membresias() -> int:
+    """Cargar en memoria todas las membresías activas. Devuelve el total cargado"""
+    global _indice_cargado
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT usuario_id, guild_id, clan_nombre, rol_clan
+                FROM miembros_clan
+                WHERE activo = 1
+            ''')
+
+            indice: Dict[int, Dict[ClaveClan, str]] = {}
+            total = 0
+            for r in cursor:
+                indice.setdefault(r['usuario_id'], {})[(r['guild_id'], r['clan_nombre'])] = r['rol_clan']
+                total += 1
+
+        _indice_membresias.clear()
+        _indice_membresias.update(indice)
+        _indice_cargado = True
+        logger.info(f"Índice de membresías cargado: {total} membresías de {len(indice)} usuarios")
+        return total
+    except Exception as e:
+        logger.error(f"Error al cargar índice de membresías: {e}")
+        return 0
+
+@_tras_confirmar
+def _indexar_membresia(usuario_id: int, guild_id: int, clan_nombre: str, rol_clan: str):
+    """Registrar una membresía en el índice en memoria"""
+    _indice_membresias.setdefault(usuario_id, {})[(guild_id, clan_nombre)] = rol_clan
+
+@_tras_confirmar
+def _desindexar_membresia(usuario_id: int, guild_id: int, clan_nombre: str):
+    """Quitar una membresía del índice en memoria"""
+    clanes = _indice_membresias.get(usuario_id)
+    if clanes is None:
+        return
+    clanes.pop((guild_id, clan_nombre), None)
+    if not clanes:
+        del _indice_membresias[usuario_id]
+
+@medido('db')
+def obtener_clanes_usuario(guild_id: int, usuario_id: int) -> Dict[str, str]:
+    """
+    Obtener {clan_nombre: rol_clan} de un usuario en el servidor `guild_id`, en O(1)
+    desde el índice en memoria. Si el índice aún no se ha cargado, consulta la base de datos.
+    """
+    if _indice_cargado:
+        membresias = _indice_membresias.get(usuario_id, {})
+        return {clan: rol for (guild, clan), rol in membresias.items() if guild == guild_id}
+    return {
+        m['clan_nombre']: m['rol'] for m in obtener_membresias_usuario(usuario_id) if m['guild_id'] == guild_id
+    }
+
+@medido('db')
+def obtener_clan_usuario(guild_id: int, usuario_id: int) -> Optional[str]:
+    """Obtener el clan de un usuario en el servidor `guild_id` si pertenece exactamente a uno"""
+    clanes = obtener_clanes_usuario(guild_id, usuario_id)
+    if len(clanes) == 1:
+        return next(iter(clanes))
+    return None
 
 # ==================== FUNCIONES DE INVITACIONES ====================
 
-def crear_invitacion(clan_nombre: str, usuario_invitado_id: int, usuario_que_invita_id: int,
-                     rol_asignado: str = 'Recluta', horas_expiracion: int = 48) -> Optional[int]:
-    """Crear una invitación pendiente"""
+@medido('db')
+def crear_invitacion(guild_id: int, clan_nombre: str, usuario_invitado_id: int, usuario_que_invita_id: int,
+                     rol_asignado: str = 'Recluta', horas_expiracion: int = 48) -> Optional[Tuple[int, datetime]]:
+    """Crear una invitación pendiente. Devuelve (invitacion_id, fecha_expiracion guardada)"""
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
@@ -417,15 +1131,203 @@ def crear_invitacion(clan_nombre: str, usuario_invitado_id: int, usuario_que_inv
 
             cursor.execute('''
                 INSERT INTO invitaciones_pendientes
-                (clan_nombre, usuario_invitado_id, usuario_que_invita_id, rol_asignado, fecha_expiracion)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (clan_nombre, usuario_invitado_id, usuario_que_invita_id, rol_asignado, fecha_expiracion))
+                (guild_id, clan_nombre, usuario_invitado_id, usuario_que_invita_id, rol_asignado, fecha_expiracion)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (guild_id, clan_nombre, usuario_invitado_id, usuario_que_invita_id, rol_asignado, fecha_expiracion))
 
-            return cursor.lastrowid
+            return cursor.lastrowid, fecha_expiracion
     except Exception as e:
         logger.error(f"Error al crear invitación: {e}")
         return None
 
+@medido('db')
+def crear_invitaciones(guild_id: int, clan_nombre: str, usuarios_invitados: List[int], usuario_que_invita_id: int,
+                       rol_asignado: str = 'Recluta',
+                       horas_expiracion: int = 48) -> Tuple[Dict[int, int], Optional[datetime]]:
+    """
+    Crear varias invitaciones en una sola transacción.
+    Devuelve ({usuario_id: invitacion_id}, fecha_expiracion guardada), o ({}, None) si falla
+    """
+    if not usuarios_invitados:
+        return {}, None
+
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+
+            # Misma fecha para todo el lote: sirve para recuperar los IDs generados
+            fecha_expiracion = datetime.now() + timedelta(hours=horas_expiracion)
+
+            cursor.executemany('''
+                INSERT INTO invitaciones_pendientes
+                (guild_id, clan_nombre, usuario_invitado_id, usuario_que_invita_id, rol_asignado, fecha_expiracion)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [(guild_id, clan_nombre, u, usuario_que_invita_id, rol_asignado, fecha_expiracion)
+                  for u in usuarios_invitados])
+
+            cursor.execute('''
+                SELECT id, usuario_invitado_id FROM invitaciones_pendientes
+                WHERE estado = 'pendiente' AND fecha_expiracion = ? AND guild_id = ? AND clan_nombre = ?
+            ''', (fecha_expiracion, guild_id, clan_nombre))
+
+            return {r['usuario_invitado_id']: r['id'] for r in cursor.fetchall()}, fecha_expiracion
+    except Exception as e:
+        logger.error(f"Error al crear invitaciones: {e}")
+        return {}, None
+
+@medido('db')
+def obtener_invitados_pendientes(guild_id: int, clan_nombre: str) -> set:
+    """Obtener los usuarios con una invitación pendiente al clan"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT usuario_invitado_id FROM invitaciones_pendientes
+                WHERE estado = 'pendiente' AND guild_id = ? AND clan_nombre = ?
+            ''', (guild_id, clan_nombre))
+            return {r['usuario_invitado_id'] for r in cursor.fetchall()}
+    except Exception as e:
+        logger.error(f"Error al obtener invitados pendientes: {e}")
+        return set()
+
+@medido('db')
+def guardar_mensajes_invitacion(mensajes: List[Tuple[int, int]]) -> bool:
+    """Guardar en lote los IDs de DM: [(invitacion_id, mensaje_dm_id)]"""
+    try:
+        with get_db_connection() as conn:
+            conn.executemany('''
+                UPDATE invitaciones_pendientes SET mensaje_dm_id = ? WHERE id = ?
+            ''', [(mensaje_id, invitacion_id) for invitacion_id, mensaje_id in mensajes])
+        return True
+    except Exception as e:
+        logger.error(f"Error al guardar mensajes de invitación: {e}")
+        return False
+
+@medido('db')
+def cancelar_invitaciones(invitaciones_ids: List[int]) -> int:
+    """Cancelar invitaciones pendientes (p. ej. cuando no se pudo enviar el DM)"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                UPDATE invitaciones_pendientes SET estado = 'cancelada'
+                WHERE id = ? AND estado = 'pendiente'
+            ''', [(i,) for i in invitaciones_ids])
+            canceladas = cursor.rowcount
+
+        for invitacion_id in invitaciones_ids:
+            _invalidar_invitacion(invitacion_id)
+        return canceladas
+    except Exception as e:
+        logger.error(f"Error al cancelar invitaciones: {e}")
+        return 0
+
+@medido('db')
+def guardar_mensaje_invitacion(invitacion_id: int, mensaje_dm_id: int) -> bool:
+    """Guardar el ID del DM enviado con la invitación"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE invitaciones_pendientes SET mensaje_dm_id = ? WHERE id = ?
+            ''', (mensaje_dm_id, invitacion_id))
+            return cursor.rowcount > 0
+    except Exception as e:
+        logger.error(f"Error al guardar mensaje de invitación: {e}")
+        return False
+
+def _filtro_shards(shards: Optional[Tuple[List[int], int]]) -> Tuple[str, tuple]:
+    """
+    Condición SQL para quedarse con los servidores de unos shards: (shard_ids, shard_count).
+    Discord asigna cada servidor al shard (guild_id >> 22) % shard_count. None = todos
+    """
+    if shards is None:
+        return '', ()
+    shard_ids, shard_count = shards
+    marcas = ', '.join('?' * len(shard_ids))
+    return f' AND ((guild_id >> 22) % ?) IN ({marcas})', (shard_count, *shard_ids)
+
+@medido('db')
+def obtener_proxima_expiracion(shards: Optional[Tuple[List[int], int]] = None) -> Optional[datetime]:
+    """Obtener la fecha de expiración pendiente más próxima (de los servidores de `shards`)"""
+    try:
+        condicion, parametros = _filtro_shards(shards)
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT fecha_expiracion FROM invitaciones_pendientes
+                WHERE estado = 'pendiente'{condicion}
+                ORDER BY fecha_expiracion
+                LIMIT 1
+            ''', parametros)
+            row = cursor.fetchone()
+            return datetime.fromisoformat(row['fecha_expiracion']) if row else None
+    except Exception as e:
+        logger.error(f"Error al obtener próxima expiración: {e}")
+        return None
+
+@medido('db')
+def expirar_invitaciones_vencidas(limite: int = 200, shards: Optional[Tuple[List[int], int]] = None) -> List[Dict]:
+    """
+    Marcar como expiradas hasta `limite` invitaciones vencidas y devolverlas.
+    Con `shards` solo las de esos servidores: cada proceso expira las suyas
+    """
+    try:
+        condicion, parametros = _filtro_shards(shards)
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT id, guild_id, clan_nombre, usuario_invitado_id, mensaje_dm_id
+                FROM invitaciones_pendientes
+                WHERE estado = 'pendiente' AND fecha_expiracion <= ?{condicion}
+                ORDER BY fecha_expiracion
+                LIMIT ?
+            ''', (datetime.now(), *parametros, limite))
+            vencidas = [dict(r) for r in cursor.fetchall()]
+
+            cursor.executemany('''
+                UPDATE invitaciones_pendientes SET estado = 'expirada'
+                WHERE id = ? AND estado = 'pendiente'
+            ''', [(v['id'],) for v in vencidas])
+
+        for v in vencidas:
+            _invalidar_invitacion(v['id'])
+        return vencidas
+    except Exception as e:
+        logger.error(f"Error al expirar invitaciones: {e}")
+        return []
+
+@medido('db')
+def obtener_invitacion_cacheada(invitacion_id: int) -> Optional[Dict]:
+    """Obtener una invitación pasando por la caché LRU"""
+    with _lock_cache_invitaciones:
+        invitacion = _cache_invitaciones.get(invitacion_id)
+        if invitacion is not None:
+            _cache_invitaciones.move_to_end(invitacion_id)
+            return invitacion
+        generacion = _generacion_invitaciones
+
+    invitacion = obtener_invitacion(invitacion_id)
+    if invitacion is not None:
+        with _lock_cache_invitaciones:
+            if generacion == _generacion_invitaciones:
+                _cache_invitaciones[invitacion_id] = invitacion
+                if len(_cache_invitaciones) > TAMANO_CACHE_INVITACIONES:
+                    _cache_invitaciones.popitem(last=False)
+    return invitacion
+
+@_tras_confirmar
+def _invalidar_invitacion(invitacion_id: Optional[int] = None):
+    """Quitar una invitación de la caché (None = todas)"""
+    global _generacion_invitaciones
+    with _lock_cache_invitaciones:
+        _generacion_invitaciones += 1
+        if invitacion_id is None:
+            _cache_invitaciones.clear()
+        else:
+            _cache_invitaciones.pop(invitacion_id, None)
+
+@medido('db')
 def obtener_invitacion(invitacion_id: int) -> Optional[Dict]:
     """Obtener información de una invitación"""
     try:
@@ -444,15 +1346,17 @@ def obtener_invitacion(invitacion_id: int) -> Optional[Dict]:
         logger.error(f"Error al obtener invitación: {e}")
         return None
 
+@medido('db')
 def aceptar_invitacion(invitacion_id: int) -> bool:
     """Aceptar una invitación"""
+    _invalidar_invitacion(invitacion_id)
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
 
             # Obtener invitación
             cursor.execute('''
-                SELECT clan_nombre, usuario_invitado_id, rol_asignado, estado, fecha_expiracion
+                SELECT guild_id, clan_nombre, usuario_invitado_id, rol_asignado, estado, fecha_expiracion
                 FROM invitaciones_pendientes WHERE id = ?
             ''', (invitacion_id,))
             row = cursor.fetchone()
@@ -467,8 +1371,9 @@ def aceptar_invitacion(invitacion_id: int) -> bool:
                 ''', (invitacion_id,))
                 return False
 
-            # Agregar miembro al clan
-            agregar_miembro_clan(row['clan_nombre'], row['usuario_invitado_id'], row['rol_asignado'])
+            # Agregar miembro al clan; si no se pudo, la invitación sigue pendiente
+            if not agregar_miembro_clan(row['guild_id'], row['clan_nombre'], row['usuario_invitado_id'], row['rol_asignado']):
+                return False
 
             # Actualizar estado de invitación
             cursor.execute('''
@@ -480,8 +1385,10 @@ def aceptar_invitacion(invitacion_id: int) -> bool:
         logger.error(f"Error al aceptar invitación: {e}")
         return False
 
+@medido('db')
 def rechazar_invitacion(invitacion_id: int) -> bool:
     """Rechazar una invitación"""
+    _invalidar_invitacion(invitacion_id)
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
@@ -497,21 +1404,24 @@ def rechazar_invitacion(invitacion_id: int) -> bool:
 
 # ==================== FUNCIONES DE CANALES ====================
 
-def agregar_canal_extra(clan_nombre: str, canal_id: int, nombre: str, tipo: str) -> bool:
+@medido('db')
+def agregar_canal_extra(guild_id: int, clan_nombre: str, canal_id: int, nombre: str, tipo: str) -> bool:
     """Agregar un canal adicional al clan"""
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                INSERT INTO canales_clan (clan_nombre, canal_id, nombre, tipo)
-                VALUES (?, ?, ?, ?)
-            ''', (clan_nombre, canal_id, nombre, tipo))
+                INSERT INTO canales_clan (guild_id, clan_nombre, canal_id, nombre, tipo)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (guild_id, clan_nombre, canal_id, nombre, tipo))
+        _tocar_clan(guild_id, clan_nombre)
         return True
     except Exception as e:
         logger.error(f"Error al agregar canal extra: {e}")
         return False
 
-def contar_canales_extra(clan_nombre: str, tipo: str = None) -> int:
+@medido('db')
+def contar_canales_extra(guild_id: int, clan_nombre: str, tipo: str = None) -> int:
     """Contar canales extra del clan por tipo"""
     try:
         with get_db_connection() as conn:
@@ -519,35 +1429,68 @@ def contar_canales_extra(clan_nombre: str, tipo: str = None) -> int:
             if tipo:
                 cursor.execute('''
                     SELECT COUNT(*) as total FROM canales_clan
-                    WHERE clan_nombre = ? AND tipo = ?
-                ''', (clan_nombre, tipo))
+                    WHERE guild_id = ? AND clan_nombre = ? AND tipo = ?
+                ''', (guild_id, clan_nombre, tipo))
             else:
                 cursor.execute('''
                     SELECT COUNT(*) as total FROM canales_clan
-                    WHERE clan_nombre = ?
-                ''', (clan_nombre,))
+                    WHERE guild_id = ? AND clan_nombre = ?
+                ''', (guild_id, clan_nombre))
 
             return cursor.fetchone()['total']
     except Exception as e:
         logger.error(f"Error al contar canales: {e}")
         return 0
 
+# ==================== PANELES DE CLAN ====================
+
+@medido('db')
+def guardar_panel_clan(guild_id: int, clan_nombre: str, mensaje_id: Optional[int]) -> bool:
+    """Guardar (o borrar con None) el mensaje del panel en vivo del clan"""
+    try:
+        with get_db_connection() as conn:
+            conn.execute('UPDATE clanes SET panel_mensaje_id = ? WHERE guild_id = ? AND nombre = ?',
+                         (mensaje_id, guild_id, clan_nombre))
+        return True
+    except Exception as e:
+        logger.error(f"Error al guardar panel del clan: {e}")
+        return False
+
+@medido('db')
+def obtener_paneles_clanes() -> Dict[ClaveClan, Tuple[int, int]]:
+    """Paneles activos: {(guild_id, clan_nombre): (canal_admin_id, panel_mensaje_id)}"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.execute('''
+                SELECT guild_id, nombre, canal_admin_id, panel_mensaje_id FROM clanes
+                WHERE panel_mensaje_id IS NOT NULL
+            ''')
+            return {
+                (r['guild_id'], r['nombre']): (r['canal_admin_id'], r['panel_mensaje_id'])
+                for r in cursor.fetchall()
+            }
+    except Exception as e:
+        logger.error(f"Error al obtener paneles de clanes: {e}")
+        return {}
+
 # ==================== FUNCIONES DE UTILIDAD ====================
 
-def obtener_clan_por_canal_admin(canal_id: int) -> Optional[str]:
+@medido('db')
+def obtener_clan_por_canal_admin(guild_id: int, canal_id: int) -> Optional[str]:
     """Obtener nombre del clan por ID del canal de administración"""
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT nombre FROM clanes WHERE canal_admin_id = ?
-            ''', (canal_id,))
+                SELECT nombre FROM clanes WHERE canal_admin_id = ? AND guild_id = ?
+            ''', (canal_id, guild_id))
             row = cursor.fetchone()
             return row['nombre'] if row else None
     except Exception as e:
         logger.error(f"Error al buscar clan por canal admin: {e}")
         return None
 
+@medido('db')
 def limpiar_invitaciones_expiradas():
     """Marcar invitaciones expiradas"""
     try:
@@ -556,8 +1499,241 @@ def limpiar_invitaciones_expiradas():
             cursor.execute('''
                 UPDATE invitaciones_pendientes
                 SET estado = 'expirada'
-                WHERE estado = 'pendiente' AND fecha_expiracion < datetime('now')
-            ''')
+                WHERE estado = 'pendiente' AND fecha_expiracion < ?
+            ''', (datetime.now(),))
             logger.info(f"Limpiadas {cursor.rowcount} invitaciones expiradas")
+        _invalidar_invitacion()
     except Exception as e:
         logger.error(f"Error al limpiar invitaciones: {e}")
+
+# ==================== FUNCIONES DE RECONCILIACIÓN ====================
+
+@medido('db')
+def obtener_estado_reconciliacion(guild_id: int) -> Optional[Dict]:
+    """
+    Leer en una sola transacción todo lo necesario para reconciliar con Discord
+    los clanes del servidor `guild_id`
+
+    Returns:
+        {
+            'clanes': {nombre: {'rol_id': ..., 'categoria_id': ..., 'canales_base': {ids}}},
+            'miembros': {nombre: {usuario_id, ...}},
+            'canales_extra': {nombre: {canal_id, ...}}
+        }
+    """
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+
+            clanes = {}
+            cursor.execute('''
+                SELECT nombre, rol_id, categoria_id, canal_anuncios_id,
+                       canal_admin_id, canal_general_id
+                FROM clanes WHERE guild_id = ?
+            ''', (guild_id,))
+            for r in cursor:
+                clanes[r['nombre']] = {
+                    'rol_id': r['rol_id'],
+                    'categoria_id': r['categoria_id'],
+                    'canal_anuncios_id': r['canal_anuncios_id'],
+                    'canal_general_id': r['canal_general_id'],
+                    'canales_base': {r['canal_anuncios_id'], r['canal_admin_id'], r['canal_general_id']}
+                }
+
+            miembros = {nombre: set() for nombre in clanes}
+            cursor.execute('''
+                SELECT clan_nombre, usuario_id FROM miembros_clan
+                WHERE guild_id = ? AND activo = 1
+            ''', (guild_id,))
+            for clan_nombre, usuario_id in cursor:
+                miembros.setdefault(clan_nombre, set()).add(usuario_id)
+
+            canales_extra = {nombre: set() for nombre in clanes}
+            cursor.execute('''
+                SELECT clan_nombre, canal_id FROM canales_clan WHERE guild_id = ?
+            ''', (guild_id,))
+            for clan_nombre, canal_id in cursor:
+                canales_extra.setdefault(clan_nombre, set()).add(canal_id)
+
+            return {'clanes': clanes, 'miembros': miembros, 'canales_extra': canales_extra}
+    except Exception as e:
+        logger.error(f"Error al leer estado para reconciliación: {e}")
+        return None
+
+def _aplicar_reconciliacion_por_lotes(guild_id: int, bajas: List[Tuple[str, int]], altas: List[Tuple[str, int]],
+                                       canales_eliminados: List[int], canales_nuevos: List[Tuple[str, int, str, str]],
+                                       roles_actualizados: Dict[str, int] = None,
+                                       tamano_lote: int = 1000) -> Generator[float, None, bool]:
+    """
+    aplicar_reconciliacion lote a lote: cada lote de bajas, altas o canales eliminados en su
+    transacción, y el resto (canales nuevos, roles, contadores) en una última
+    """
+    roles_actualizados = roles_actualizados or {}
+    tocados = {c for c, _ in bajas} | {c for c, _ in altas} | {c[0] for c in canales_nuevos}
+    tocados |= set(roles_actualizados)
+    try:
+        for i in range(0, len(bajas), tamano_lote):
+            lote = bajas[i:i + tamano_lote]
+            with get_db_connection() as conn:
+                conn.executemany('''
+                    UPDATE miembros_clan SET activo = 0
+                    WHERE guild_id = ? AND clan_nombre = ? AND usuario_id = ?
+                ''', [(guild_id, c, u) for c, u in lote])
+            for clan_nombre, usuario_id in lote:
+                _desindexar_membresia(usuario_id, guild_id, clan_nombre)
+            yield 0
+
+        for i in range(0, len(altas), tamano_lote):
+            lote = altas[i:i + tamano_lote]
+            with get_db_connection() as conn:
+                conn.executemany('''
+                    INSERT INTO miembros_clan (guild_id, clan_nombre, usuario_id, rol_clan)
+                    VALUES (?, ?, ?, 'Recluta')
+                    ON CONFLICT(guild_id, clan_nombre, usuario_id) DO UPDATE
+                    SET activo = 1, rol_clan = 'Recluta', fecha_union = CURRENT_TIMESTAMP
+                ''', [(guild_id, c, u) for c, u in lote])
+            for clan_nombre, usuario_id in lote:
+                _indexar_membresia(usuario_id, guild_id, clan_nombre, 'Recluta')
+            yield 0
+
+        for i in range(0, len(canales_eliminados), tamano_lote):
+            lote = canales_eliminados[i:i + tamano_lote]
+            with get_db_connection() as conn:
+                cursor = conn.execute(f'''
+                    SELECT DISTINCT clan_nombre FROM canales_clan
+                    WHERE guild_id = ? AND canal_id IN ({','.join('?' * len(lote))})
+                ''', (guild_id, *lote))
+                tocados.update(r['clan_nombre'] for r in cursor.fetchall())
+                conn.executemany('DELETE FROM canales_clan WHERE guild_id = ? AND canal_id = ?',
+                                 [(guild_id, c) for c in lote])
+            yield 0
+
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+
+            if canales_nuevos:
+                cursor.executemany('''
+                    INSERT INTO canales_clan (guild_id, clan_nombre, canal_id, nombre, tipo)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', [(guild_id, *canal) for canal in canales_nuevos])
+
+            if roles_actualizados:
+                cursor.executemany('UPDATE clanes SET rol_id = ? WHERE guild_id = ? AND nombre = ?',
+                                   [(rol_id, guild_id, nombre) for nombre, rol_id in roles_actualizados.items()])
+
+            # Recalcular contadores solo de los clanes afectados
+            afectados = {c for c, _ in bajas} | {c for c, _ in altas}
+            cursor.executemany('''
+                UPDATE clanes
+                SET total_miembros_actuales = (
+                    SELECT COUNT(*) FROM miembros_clan
+                    WHERE guild_id = clanes.guild_id AND clan_nombre = clanes.nombre AND activo = 1
+                )
+                WHERE guild_id = ? AND nombre = ?
+            ''', [(guild_id, c) for c in afectados])
+
+        return True
+    except Exception as e:
+        # Los lotes anteriores ya quedaron aplicados: la próxima reconciliación corrige el resto
+        logger.error(f"Error al aplicar reconciliación: {e}")
+        return False
+    finally:
+        # Solo los clanes corregidos: con varios servidores, reconciliar uno no invalida a los demás
+        _tocar_clan(guild_id, *tocados)
+
+@medido('db')
+def aplicar_reconciliacion(guild_id: int, bajas: List[Tuple[str, int]], altas: List[Tuple[str, int]],
+                           canales_eliminados: List[int], canales_nuevos: List[Tuple[str, int, str, str]],
+                           roles_actualizados: Dict[str, int] = None, tamano_lote: int = 1000) -> bool:
+    """
+    Aplicar por lotes de `tamano_lote` las correcciones calculadas por la reconciliación del servidor `guild_id`
+
+    bajas/altas: [(clan_nombre, usuario_id)]
+    canales_nuevos: [(clan_nombre, canal_id, nombre, tipo)]
+    roles_actualizados: {clan_nombre: nuevo_rol_id}
+    """
+    return _recorrer_lotes(_aplicar_reconciliacion_por_lotes(
+        guild_id, bajas, altas, canales_eliminados, canales_nuevos, roles_actualizados, tamano_lote
+    ))
+
+# ==================== SERVICIO DE BASE DE DATOS ====================
+
+# Con varios procesos del bot (shards), servicio_db.py es el único que abre la base.
+# Las escrituras corren en su hilo escritor y las que llegan juntas comparten transacción
+ESCRITURAS = {
+    'crear_clan', 'agregar_xp_clan', 'agregar_miembro_clan', 'remover_miembro_clan',
+    'remover_usuario_de_clanes', 'transferir_miembro', 'crear_invitacion', 'crear_invitaciones',
+    'guardar_mensajes_invitacion', 'cancelar_invitaciones', 'guardar_mensaje_invitacion',
+    'expirar_invitaciones_vencidas', 'aceptar_invitacion', 'rechazar_invitacion',
+    'agregar_canal_extra', 'guardar_panel_clan', 'limpiar_invitaciones_expiradas'
+}
+# También en el hilo escritor, pero cada una sola: abren sus propias transacciones o son largas
+EXCLUSIVAS = {
+    'init_database', 'compactar_historial_xp', 'cargar_indice_membresias', 'cargar_clasificacion',
+    'asignar_guild_a_clanes_huerfanos', 'aplicar_reconciliacion'
+}
+# En el pool de lectura del servicio, desde sus cachés en memoria cuando las hay
+LECTURAS = {
+    'obtener_clan', 'clan_existe', 'obtener_todos_clanes', 'obtener_xp_ganada',
+    'obtener_serie_xp', 'obtener_ranking_crecimiento', 'obtener_top_clanes', 'obtener_posicion_clan',
+    'obtener_miembros_clan', 'obtener_rol_miembro', 'es_miembro_clan', 'obtener_membresias_usuario',
+    'obtener_clanes_usuario', 'obtener_clan_usuario', 'obtener_invitados_pendientes',
+    'obtener_proxima_expiracion', 'obtener_invitacion_cacheada',
+    'obtener_invitacion', 'contar_canales_extra', 'obtener_paneles_clanes', 'obtener_clan_por_canal_admin',
+    'obtener_estado_reconciliacion'
+}
+
+# Exclusivas largas que el servicio aplica lote a lote: cada lote es un trabajo aparte del hilo
+# escritor, y las escrituras que llegan mientras tanto pasan entre uno y otro
+POR_LOTES = {
+    'compactar_historial_xp': _compactar_historial_xp_por_lotes,
+    'aplicar_reconciliacion': _aplicar_reconciliacion_por_lotes,
+}
+# Lo que devuelve cada función cuando falla: el cliente del servicio devuelve lo mismo si falla
+# el socket o la llamada, en vez de lanzar (init_database sí lanza, como sin servicio)
+_FALLOS = [
+    (lambda: None, {
+        'obtener_clan', 'agregar_xp_clan', 'obtener_posicion_clan', 'obtener_rol_miembro',
+        'obtener_clan_usuario', 'crear_invitacion', 'obtener_proxima_expiracion',
+        'obtener_invitacion_cacheada', 'obtener_invitacion', 'obtener_clan_por_canal_admin',
+        'limpiar_invitaciones_expiradas', 'obtener_estado_reconciliacion'
+    }),
+    (bool, {
+        'crear_clan', 'clan_existe', 'agregar_miembro_clan', 'es_miembro_clan', 'remover_miembro_clan',
+        'transferir_miembro', 'guardar_mensajes_invitacion', 'guardar_mensaje_invitacion',
+        'aceptar_invitacion', 'rechazar_invitacion', 'agregar_canal_extra', 'guardar_panel_clan',
+        'aplicar_reconciliacion'
+    }),
+    (int, {
+        'asignar_guild_a_clanes_huerfanos', 'obtener_xp_ganada', 'cargar_clasificacion',
+        'cargar_indice_membresias', 'cancelar_invitaciones', 'contar_canales_extra'
+    }),
+    (list, {
+        'obtener_serie_xp', 'obtener_ranking_crecimiento', 'obtener_top_clanes', 'obtener_miembros_clan',
+        'remover_usuario_de_clanes', 'obtener_membresias_usuario', 'expirar_invitaciones_vencidas'
+    }),
+    (dict, {'obtener_todos_clanes', 'obtener_clanes_usuario', 'obtener_paneles_clanes'}),
+    (set, {'obtener_invitados_pendientes'}),
+    (lambda: ({}, None), {'crear_invitaciones'}),
+    (lambda: {'eventos': 0, 'lotes': 0, 'paginas_liberadas': 0}, {'compactar_historial_xp'}),
+]
+FALLOS = {nombre: fallo for fallo, nombres in _FALLOS for nombre in nombres}
+
+def _al_cambiar_en_servicio(clave: Optional[ClaveClan]):
+    # Aviso del servicio: actualizar las versiones locales (cachés de embeds) y avisar a los oyentes
+    if clave is None:
+        _tocar_todos_los_clanes()
+    else:
+        _tocar_clan(*clave)
+
+if os.getenv('DB_SOCKET'):
+    # Cliente del servicio: las funciones públicas pasan a ser llamadas por el socket
+    from cliente_db import ClienteDB
+
+    _cliente = ClienteDB(os.getenv('DB_SOCKET'))
+    for _nombre in ESCRITURAS | EXCLUSIVAS | LECTURAS:
+        globals()[_nombre] = medido('db')(
+            _cliente.funcion(_nombre, reintentar=_nombre in LECTURAS, fallo=FALLOS.get(_nombre))
+        )
+    _cliente.escuchar_cambios(_al_cambiar_en_servicio)
+    logger.info(f"database.py usa el servicio de base de datos en {os.getenv('DB_SOCKET')}")
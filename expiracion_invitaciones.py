@@ -0,0 +1,105 @@
+"""
+Programador de expiración de invitaciones: despierta justo en la próxima
+fecha_expiracion en lugar de barrer la tabla periódicamente.
+Al arrancar solo se lee la próxima expiración de la base (en un hilo); después
+de cada barrido se vuelve a consultar, así el heap nunca necesita cargar todas
+las invitaciones pendientes.
+Con varios procesos cada uno corre su programador para las invitaciones de los
+servidores de sus shards: las que crea son las únicas que agenda en su heap.
+"""
+import asyncio
+import heapq
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from database import obtener_proxima_expiracion, expirar_invitaciones_vencidas
+
+logger = logging.getLogger(__name__)
+
+TAMANO_LOTE_EXPIRACION = 200
+
+class ProgramadorExpiraciones:
+    """
+    Heap en memoria de (fecha_expiracion, invitacion_id) de las invitaciones pendientes.
+    El heap solo indica cuándo despertar; la DB decide qué invitaciones vencieron.
+    """
+
+    def __init__(self, al_expirar: Callable[[List[Dict]], Awaitable[None]],
+                 shards: Optional[Tuple[List[int], int]] = None):
+        self.al_expirar = al_expirar
+        self.shards = shards  # (shard_ids, shard_count) de este proceso; None = todos los servidores
+        self._heap: List[Tuple[datetime, int]] = []
+        self._despertar = asyncio.Event()
+        self._tarea: Optional[asyncio.Task] = None
+
+    def iniciar(self):
+        """Arrancar el loop (la próxima expiración pendiente se lee al empezar, fuera del loop de eventos)"""
+        if self._tarea and not self._tarea.done():
+            return
+        self._tarea = asyncio.create_task(self._loop())
+
+    def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+
+    def programar(self, invitacion_id: int, fecha_expiracion: datetime):
+        """Registrar una nueva invitación; despierta el loop si vence antes que la actual"""
+        anterior = self._heap[0][0] if self._heap else None
+        heapq.heappush(self._heap, (fecha_expiracion, invitacion_id))
+        if anterior is None or fecha_expiracion < anterior:
+            self._despertar.set()
+
+    async def _cargar_proxima(self):
+        proxima = await asyncio.to_thread(obtener_proxima_expiracion, self.shards)
+        if proxima:
+            heapq.heappush(self._heap, (proxima, 0))
+        logger.info(f"Programador de expiraciones iniciado (próxima expiración: {proxima or 'ninguna'})")
+
+    async def _loop(self):
+        await self._cargar_proxima()
+        while True:
+            try:
+                if self._heap:
+                    espera = (self._heap[0][0] - datetime.now()).total_seconds()
+                else:
+                    espera = None
+
+                if espera is None or espera > 0:
+                    self._despertar.clear()
+                    try:
+                        await asyncio.wait_for(self._despertar.wait(), timeout=espera)
+                        continue  # Llegó una invitación que vence antes: recalcular
+                    except asyncio.TimeoutError:
+                        pass
+
+                await self._barrer()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error en programador de expiraciones: {e}")
+                logger.exception(e)
+                await asyncio.sleep(60)
+
+    async def _barrer(self):
+        """Expirar en lotes todo lo vencido y avisar"""
+        total = 0
+        while True:
+            vencidas = await asyncio.to_thread(expirar_invitaciones_vencidas, TAMANO_LOTE_EXPIRACION, self.shards)
+            if vencidas:
+                total += len(vencidas)
+                await self.al_expirar(vencidas)
+            if len(vencidas) < TAMANO_LOTE_EXPIRACION:
+                break
+
+        ahora = datetime.now()
+        while self._heap and self._heap[0][0] <= ahora:
+            heapq.heappop(self._heap)
+
+        # La DB manda: si tiene una expiración que el heap no conoce, agendarla
+        proxima = await asyncio.to_thread(obtener_proxima_expiracion, self.shards)
+        if proxima and (not self._heap or proxima < self._heap[0][0]):
+            heapq.heappush(self._heap, (proxima, 0))
+
+        if total:
+            logger.info(f"Expiradas {total} invitaciones")
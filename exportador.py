@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Exportación de clanes, miembros e historial de XP para análisis.
+
+Las tablas se leen por lotes (la memoria no depende de su tamaño) dentro de
+una sola transacción de lectura sobre la base del bot, así los tres archivos
+son del mismo instante. Mientras dura esa transacción, con el journal clásico
+de SQLite el bot no puede confirmar escrituras; por eso una exportación
+completa de una base que no está en modo WAL lee de una copia tomada con la
+API de backup (un solo paso, el bot solo espera lo que tarda la copia). Las
+incrementales leen pocas filas y van siempre directo a la base.
+
+historial_xp admite exportación incremental: se guarda el último id exportado
+en <directorio>/marca_agua.json y con --incremental solo se exportan las filas
+nuevas. clanes y miembros_clan se exportan completas en cada corrida.
+
+Los archivos de una corrida llevan la misma marca de tiempo; si otra corrida
+ya usó esa marca (dos en el mismo segundo) se agrega un contador: nunca se
+sobrescribe una exportación anterior.
+
+Uso:
+    python exportador.py [csv|jsonl|parquet] [--db clan_data.db] [--dir exportaciones] [--incremental] [--desde ID]
+"""
+import os
+import sys
+import csv
+import json
+import gzip
+import time
+import sqlite3
+import logging
+import tempfile
+import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DATABASE_FILE = 'clan_data.db'
+EXPORT_DIR = 'exportaciones'
+TABLAS = ['clanes', 'miembros_clan', 'historial_xp']
+FORMATOS = ['csv', 'jsonl', 'parquet']
+TAMANO_LOTE = 5000
+ARCHIVO_MARCA_AGUA = 'marca_agua.json'
+
+def _copiar_snapshot(ruta_db: str, destino: str):
+    """Copia consistente de la base mientras el bot sigue funcionando"""
+    origen = sqlite3.connect(ruta_db)
+    copia = sqlite3.connect(destino)
+    try:
+        origen.backup(copia)
+    finally:
+        copia.close()
+        origen.close()
+
+def _conectar_lectura(ruta_db: str) -> sqlite3.Connection:
+    """Conexión de solo lectura con una transacción abierta: todas las lecturas ven el mismo estado"""
+    conn = sqlite3.connect(f"file:{ruta_db}?mode=ro", uri=True, isolation_level=None)
+    conn.execute('BEGIN')
+    return conn
+
+def _modo_wal(ruta_db: str) -> bool:
+    conn = sqlite3.connect(f"file:{ruta_db}?mode=ro", uri=True)
+    try:
+        return conn.execute('PRAGMA journal_mode').fetchone()[0].lower() == 'wal'
+    finally:
+        conn.close()
+
+def _nombre_corrida(directorio: str, nombres: List[str], extension: str) -> str:
+    """Marca de tiempo de la corrida, con contador si algún archivo con esa marca ya existe"""
+    marca = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    corrida, numero = marca, 1
+    while any(os.path.exists(os.path.join(directorio, f"{nombre}_{corrida}{extension}")) for nombre in nombres):
+        numero += 1
+        corrida = f"{marca}_{numero}"
+    return corrida
+
+def leer_marca_agua(directorio: str) -> int:
+    """Último historial_xp.id exportado (0 si nunca se exportó)"""
+    ruta = os.path.join(directorio, ARCHIVO_MARCA_AGUA)
+    if not os.path.exists(ruta):
+        return 0
+    with open(ruta) as f:
+        return json.load(f).get('historial_xp', 0)
+
+def _guardar_marca_agua(directorio: str, ultimo_id: int):
+    ruta = os.path.join(directorio, ARCHIVO_MARCA_AGUA)
+    temporal = ruta + '.tmp'
+    with open(temporal, 'w') as f:
+        json.dump({'historial_xp': ultimo_id, 'fecha': datetime.datetime.now().isoformat()}, f)
+    os.replace(temporal, ruta)
+
+# ==================== ESCRITORES ====================
+
+class _EscritorCSV:
+    def __init__(self, ruta: str, columnas: List[str], tipos: List[str]):
+        self.archivo = gzip.open(ruta, 'wt', newline='', encoding='utf-8')
+        self.csv = csv.writer(self.archivo)
+        self.csv.writerow(columnas)
+
+    def escribir(self, filas: List[tuple]):
+        self.csv.writerows(filas)
+
+    def cerrar(self):
+        self.archivo.close()
+
+class _EscritorJSONL:
+    def __init__(self, ruta: str, columnas: List[str], tipos: List[str]):
+        self.archivo = gzip.open(ruta, 'wt', encoding='utf-8')
+        self.columnas = columnas
+
+    def escribir(self, filas: List[tuple]):
+        self.archivo.writelines(
+            json.dumps(dict(zip(self.columnas, fila)), ensure_ascii=False) + '\n' for fila in filas
+        )
+
+    def cerrar(self):
+        self.archivo.close()
+
+class _EscritorParquet:
+    """Un row group por lote; requiere pyarrow (opcional)"""
+
+    def __init__(self, ruta: str, columnas: List[str], tipos: List[str]):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.columnas = columnas
+        self.esquema = pa.schema([
+            (nombre, pa.int64() if tipo.upper().startswith('INT') else pa.string())
+            for nombre, tipo in zip(columnas, tipos)
+        ])
+        self.escritor = pq.ParquetWriter(ruta, self.esquema, compression='zstd')
+
+    def escribir(self, filas: List[tuple]):
+        columnas = list(zip(*filas))
+        self.escritor.write_table(self.pa.Table.from_arrays(
+            [self.pa.array(valores, type=campo.type) for valores, campo in zip(columnas, self.esquema)],
+            schema=self.esquema
+        ))
+
+    def cerrar(self):
+        self.escritor.close()
+
+ESCRITORES = {
+    'csv': (_EscritorCSV, '.csv.gz'),
+    'jsonl': (_EscritorJSONL, '.jsonl.gz'),
+    'parquet': (_EscritorParquet, '.parquet'),
+}
+
+# ==================== EXPORTACIÓN ====================
+
+def _exportar_tabla(conn: sqlite3.Connection, tabla: str, ruta: str, formato: str,
+                    desde_id: int = 0, tamano_lote: int = TAMANO_LOTE) -> Dict:
+    """Volcar una tabla por lotes. Devuelve {'filas', 'ultimo_id'}"""
+    info = conn.execute(f"PRAGMA table_info({tabla})").fetchall()
+    columnas = [c[1] for c in info]
+    tipos = [c[2] for c in info]
+
+    if desde_id:
+        cursor = conn.execute(f"SELECT * FROM {tabla} WHERE id > ? ORDER BY id", (desde_id,))
+    else:
+        cursor = conn.execute(f"SELECT * FROM {tabla} ORDER BY rowid")
+
+    clase, _ = ESCRITORES[formato]
+    escritor = clase(ruta, columnas, tipos)
+    filas = 0
+    ultimo_id = desde_id
+    posicion_id = columnas.index('id') if 'id' in columnas else None
+    try:
+        while True:
+            lote = cursor.fetchmany(tamano_lote)
+            if not lote:
+                break
+            escritor.escribir(lote)
+            filas += len(lote)
+            if posicion_id is not None:
+                ultimo_id = lote[-1][posicion_id]
+    finally:
+        escritor.cerrar()
+
+    return {'filas': filas, 'ultimo_id': ultimo_id}
+
+def exportar(formato: str = 'csv', ruta_db: str = DATABASE_FILE, directorio: str = EXPORT_DIR,
+             incremental: bool = False, desde_id: Optional[int] = None,
+             tamano_lote: int = TAMANO_LOTE) -> Optional[Dict]:
+    """
+    Exportar clanes, miembros_clan e historial_xp a `directorio`.
+
+    Returns:
+        {'archivos': {tabla: ruta}, 'filas': {tabla: n}, 'marca_agua': id, 'segundos': 1.2} o None si falla
+    """
+    if formato not in ESCRITORES:
+        logger.error(f"Formato desconocido: {formato} (usa {', '.join(FORMATOS)})")
+        return None
+
+    if formato == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            logger.error("pyarrow no está instalado. Instala con: pip install pyarrow")
+            return None
+
+    if not os.path.exists(ruta_db):
+        logger.error(f"Base de datos {ruta_db} no encontrada")
+        return None
+
+    Path(directorio).mkdir(exist_ok=True)
+    if desde_id is None:
+        desde_id = leer_marca_agua(directorio) if incremental else 0
+
+    inicio = time.perf_counter()
+    _, extension = ESCRITORES[formato]
+    nombres = [f"{tabla}_desde_{desde_id}" if tabla == 'historial_xp' and desde_id else tabla for tabla in TABLAS]
+    corrida = _nombre_corrida(directorio, nombres, extension)
+    resultado = {'archivos': {}, 'filas': {}, 'marca_agua': desde_id}
+
+    with tempfile.TemporaryDirectory(dir=directorio) as temporal:
+        try:
+            if desde_id or _modo_wal(ruta_db):
+                conn = _conectar_lectura(ruta_db)
+            else:
+                snapshot = os.path.join(temporal, 'snapshot.db')
+                _copiar_snapshot(ruta_db, snapshot)
+                logger.info(f"Snapshot tomado en {time.perf_counter() - inicio:.1f}s")
+                conn = _conectar_lectura(snapshot)
+        except sqlite3.Error as e:
+            logger.error(f"Error al abrir la base de datos: {e}")
+            return None
+
+        try:
+            for tabla, nombre in zip(TABLAS, nombres):
+                desde = desde_id if tabla == 'historial_xp' else 0
+                ruta = os.path.join(directorio, f"{nombre}_{corrida}{extension}")
+
+                inicio_tabla = time.perf_counter()
+                exportado = _exportar_tabla(conn, tabla, ruta, formato, desde, tamano_lote)
+                segundos = time.perf_counter() - inicio_tabla
+
+                resultado['archivos'][tabla] = ruta
+                resultado['filas'][tabla] = exportado['filas']
+                if tabla == 'historial_xp':
+                    resultado['marca_agua'] = exportado['ultimo_id']
+                logger.info(
+                    f"{tabla}: {exportado['filas']} filas -> {ruta} "
+                    f"({exportado['filas'] / segundos if segundos else 0:.0f} filas/s)"
+                )
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Error al exportar: {e}")
+            return None
+        finally:
+            conn.close()
+
+    _guardar_marca_agua(directorio, resultado['marca_agua'])
+    resultado['segundos'] = time.perf_counter() - inicio
+    logger.info(
+        f"Exportación {formato} completada en {resultado['segundos']:.1f}s "
+        f"(historial_xp hasta id {resultado['marca_agua']})"
+    )
+    return resultado
+
+if __name__ == '__main__':
+    argumentos = sys.argv[1:]
+    formato = argumentos[0] if argumentos and not argumentos[0].startswith('--') else 'csv'
+
+    def opcion(nombre: str, defecto=None):
+        return argumentos[argumentos.index(nombre) + 1] if nombre in argumentos else defecto
+
+    desde = opcion('--desde')
+    resultado = exportar(
+        formato,
+        ruta_db=opcion('--db', DATABASE_FILE),
+        directorio=opcion('--dir', EXPORT_DIR),
+        incremental='--incremental' in argumentos,
+        desde_id=int(desde) if desde is not None else None
+    )
+    sys.exit(0 if resultado else 1)
@@ -0,0 +1,63 @@
+"""
+Gráficos de XP en texto (sparklines) para los embeds, con caché por clan y periodo.
+
+Las series salen de los resúmenes por hora/día de database.py, así que generar
+un gráfico es barato; la caché evita repetir la consulta cuando varios usuarios
+piden el mismo gráfico seguido. Una entrada vale hasta que cambia el bucket
+actual o pasan SEGUNDOS_CACHE, lo que ocurra primero.
+"""
+import time
+from typing import Dict, List, Tuple
+
+from database import obtener_serie_xp
+
+BLOQUES = '▁▂▃▄▅▆▇█'
+SEGUNDOS_CACHE = 60
+TAMANO_CACHE = 512
+
+_cache: Dict[Tuple[int, str, str], Dict] = {}
+
+def sparkline(valores: List[int]) -> str:
+    """Una barra por valor, escalada al máximo de la serie"""
+    maximo = max(valores, default=0)
+    if maximo <= 0:
+        return BLOQUES[0] * len(valores)
+    # El máximo siempre es la barra llena y el cero la más baja, también con máximos chicos
+    return ''.join(BLOQUES[max(0, v) * (len(BLOQUES) - 1) // maximo] for v in valores)
+
+def grafico_xp(guild_id: int, clan_nombre: str, periodo: str) -> Dict:
+    """
+    Serie de XP del clan lista para un embed.
+
+    Returns:
+        {'serie': [(bucket, xp), ...], 'total': 1234, 'maximo': 300, 'sparkline': '▁▃█▅'}
+    """
+    clave = (guild_id, clan_nombre, periodo)
+    entrada = _cache.get(clave)
+    if entrada and time.monotonic() < entrada['expira']:
+        return entrada['grafico']
+
+    serie = obtener_serie_xp(guild_id, clan_nombre, periodo)
+    valores = [xp for _, xp in serie]
+    grafico = {
+        'serie': serie,
+        'total': sum(valores),
+        'maximo': max(valores, default=0),
+        'sparkline': sparkline(valores)
+    }
+
+    if len(_cache) >= TAMANO_CACHE:
+        _cache.clear()
+    _cache[clave] = {'grafico': grafico, 'expira': time.monotonic() + _segundos_validez(periodo)}
+    return grafico
+
+def _segundos_validez(periodo: str) -> float:
+    """Hasta el próximo cambio de bucket (hora o día UTC), como mucho SEGUNDOS_CACHE"""
+    ahora = time.time()
+    tamano = 3600 if periodo == 'dia' else 86400
+    return min(SEGUNDOS_CACHE, tamano - ahora % tamano)
+
+def invalidar(guild_id: int, clan_nombre: str):
+    """Descartar los gráficos cacheados de un clan (por ejemplo, al ganar XP)"""
+    for clave in [c for c in _cache if c[:2] == (guild_id, clan_nombre)]:
+        del _cache[clave]
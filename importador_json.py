@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Importador de clanes desde JSON para el esquema actual.
+
+Acepta el clan_data.json heredado ({"nombre": {...}, ...}) y archivos .jsonl
+con un clan por línea ({"nombre": "...", ...}). Lee el archivo por partes,
+inserta con executemany en transacciones grandes y guarda en la tabla
+importaciones la posición del último lote confirmado: si se interrumpe, la
+siguiente ejecución continúa desde ahí. Reimportar el mismo archivo no duplica
+datos (upserts, nunca INSERT OR REPLACE, que borraría miembros en cascada).
+
+Los clanes se importan al servidor de --guild (o de la variable GUILD_ID).
+--adoptar-huerfanos asigna ese servidor a los clanes que quedaron sin servidor
+(guild_id 0, de bases anteriores a la migración 7); el bot no lo hace solo.
+
+Uso:
+    python importador_json.py clan_data.json --guild ID [--db clan_data.db] [--lote 2000] [--diferir-indices] [--reiniciar]
+    python importador_json.py --adoptar-huerfanos --guild ID [--db clan_data.db]
+"""
+import os
+import sys
+import json
+import time
+import codecs
+import logging
+from typing import Dict, Iterator, List, Tuple
+
+import database
+from database import get_db_connection, init_database
+from indices import INDICES, asegurar_indices
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TAMANO_LECTURA = 1 << 16
+# El importador los usa para no duplicar filas, así que no se difieren
+INDICES_NECESARIOS = {'idx_canales_canal_id'}
+ESPACIOS = ' \t\r\n'
+
+class _Incompleto(Exception):
+    pass
+
+def _documentos_objeto(f, inicio: int) -> Iterator[Tuple[Dict, int]]:
+    """
+    Recorrer un objeto JSON {"nombre": {...}, ...} de a una entrada.
+    Devuelve (documento, posición en bytes justo después de la entrada).
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    f.seek(inicio)
+    buffer = ''
+    base = inicio
+    dentro = inicio > 0
+
+    def leer_mas() -> bool:
+        nonlocal buffer
+        bloque = f.read(TAMANO_LECTURA)
+        if not bloque:
+            return False
+        buffer += utf8.decode(bloque)
+        return True
+
+    def saltar_espacios(pos: int) -> int:
+        while pos < len(buffer) and buffer[pos] in ESPACIOS:
+            pos += 1
+        if pos >= len(buffer):
+            raise _Incompleto()
+        return pos
+
+    while True:
+        pos = 0
+        while pos < len(buffer) and buffer[pos] in ESPACIOS + ',':
+            pos += 1
+        if pos >= len(buffer):
+            if not leer_mas():
+                return
+            continue
+
+        if not dentro:
+            if buffer[pos] != '{':
+                raise ValueError("Se esperaba un objeto JSON")
+            dentro = True
+            base += len(buffer[:pos + 1].encode('utf-8'))
+            buffer = buffer[pos + 1:]
+            continue
+
+        if buffer[pos] == '}':
+            return
+
+        try:
+            nombre, fin = decoder.raw_decode(buffer, pos)
+            fin = saltar_espacios(fin)
+            if buffer[fin] != ':':
+                raise ValueError(f"JSON inválido cerca de {base + fin}")
+            fin = saltar_espacios(fin + 1)
+            datos, fin = decoder.raw_decode(buffer, fin)
+        except (_Incompleto, json.JSONDecodeError):
+            if not leer_mas():
+                raise ValueError("El archivo JSON está truncado")
+            continue
+
+        base += len(buffer[:fin].encode('utf-8'))
+        buffer = buffer[fin:]
+        yield dict(datos, nombre=nombre), base
+
+def _documentos_jsonl(f, inicio: int) -> Iterator[Tuple[Dict, int]]:
+    """Un clan por línea"""
+    f.seek(inicio)
+    while True:
+        linea = f.readline()
+        if not linea:
+            return
+        if linea.strip():
+            yield json.loads(linea), f.tell()
+
+def _filas_de_documento(doc: Dict, filas: Dict[str, List], guild_id: int):
+    """Repartir un documento de clan del servidor `guild_id` en filas por tabla"""
+    nombre = doc['nombre']
+    filas['clanes'].append((
+        guild_id,
+        nombre,
+        doc.get('creador', doc.get('creador_id')),
+        doc.get('descripcion') or '',
+        doc.get('nivel', 1),
+        doc.get('xp_actual', 0),
+        doc.get('total_miembros', doc.get('total_miembros_actuales', 1)),
+        doc.get('total_miembros_historico', 1),
+        doc['rol_id'],
+        doc['categoria_id'],
+        doc['canal_anuncios_id'],
+        doc['canal_admin_id'],
+        doc['canal_general_id'],
+        doc['invite_code'],
+        doc.get('color_rol'),
+    ))
+
+    miembros = doc.get('miembros')
+    if miembros is None:
+        # Formato heredado: solo se conoce al creador
+        miembros = [{'usuario_id': doc.get('creador', doc.get('creador_id')), 'rol': 'Líder'}]
+    else:
+        filas['recontar'].append((guild_id, nombre))
+
+    for m in miembros:
+        filas['miembros'].append((
+            guild_id, nombre, m['usuario_id'], m.get('rol', m.get('rol_clan', 'Recluta')), 1 if m.get('activo', 1) else 0
+        ))
+
+    for canal in doc.get('canales_extra', []):
+        filas['canales'].append((guild_id, nombre, canal['id'], canal['nombre'], canal['tipo'], canal['id']))
+
+def _escribir_lote(conn, filas: Dict[str, List], archivo: str, posicion: int, total_clanes: int):
+    """Insertar un lote completo y su checkpoint en la misma transacción"""
+    conn.executemany('''
+        INSERT INTO clanes
+        (guild_id, nombre, creador_id, descripcion, nivel, xp_actual, total_miembros_actuales,
+         total_miembros_historico, rol_id, categoria_id, canal_anuncios_id,
+         canal_admin_id, canal_general_id, invite_code, color_rol)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(guild_id, nombre) DO UPDATE SET
+            creador_id = excluded.creador_id,
+            descripcion = excluded.descripcion,
+            nivel = MAX(nivel, excluded.nivel),
+            xp_actual = MAX(xp_actual, excluded.xp_actual),
+            rol_id = excluded.rol_id,
+            categoria_id = excluded.categoria_id,
+            canal_anuncios_id = excluded.canal_anuncios_id,
+            canal_admin_id = excluded.canal_admin_id,
+            canal_general_id = excluded.canal_general_id,
+            invite_code = excluded.invite_code,
+            color_rol = excluded.color_rol
+    ''', filas['clanes'])
+
+    conn.executemany('''
+        INSERT INTO miembros_clan (guild_id, clan_nombre, usuario_id, rol_clan, activo)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(guild_id, clan_nombre, usuario_id) DO UPDATE SET
+            rol_clan = excluded.rol_clan,
+            activo = excluded.activo
+    ''', filas['miembros'])
+
+    conn.executemany('''
+        INSERT INTO canales_clan (guild_id, clan_nombre, canal_id, nombre, tipo)
+        SELECT ?, ?, ?, ?, ?
+        WHERE NOT EXISTS (SELECT 1 FROM canales_clan WHERE canal_id = ?)
+    ''', filas['canales'])
+
+    conn.executemany('''
+        UPDATE clanes
+        SET total_miembros_actuales = (
+            SELECT COUNT(*) FROM miembros_clan
+            WHERE guild_id = clanes.guild_id AND clan_nombre = clanes.nombre AND activo = 1
+        )
+        WHERE guild_id = ? AND nombre = ?
+    ''', filas['recontar'])
+
+    conn.execute('''
+        INSERT INTO importaciones (archivo, posicion, clanes, fecha)
+        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(archivo) DO UPDATE SET
+            posicion = excluded.posicion, clanes = excluded.clanes, fecha = excluded.fecha
+    ''', (archivo, posicion, total_clanes))
+
+def _filas_vacias() -> Dict[str, List]:
+    return {'clanes': [], 'miembros': [], 'canales': [], 'recontar': []}
+
+def importar_json(ruta: str, guild_id: int, tamano_lote: int = 2000, diferir_indices: bool = False,
+                  reiniciar: bool = False) -> Dict:
+    """
+    Importar (o continuar importando) un archivo JSON/JSONL de clanes al servidor `guild_id`.
+
+    diferir_indices: borrar los índices secundarios durante la carga y recrearlos al final.
+    Conviene para cargas grandes con el bot detenido.
+
+    Returns:
+        {'clanes': 1200, 'filas': 45000, 'segundos': 3.2, 'filas_por_segundo': 14000.0, 'reanudado': False}
+    """
+    init_database()
+    archivo = os.path.abspath(ruta)
+
+    with get_db_connection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS importaciones (
+                archivo TEXT PRIMARY KEY,
+                posicion INTEGER NOT NULL,
+                clanes INTEGER NOT NULL,
+                fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        if reiniciar:
+            conn.execute('DELETE FROM importaciones WHERE archivo = ?', (archivo,))
+        row = conn.execute('SELECT posicion, clanes FROM importaciones WHERE archivo = ?', (archivo,)).fetchone()
+
+        if diferir_indices:
+            for indice in INDICES:
+                if indice['ddl'] and indice['nombre'] not in INDICES_NECESARIOS:
+                    conn.execute(f"DROP INDEX IF EXISTS {indice['nombre']}")
+
+    inicio_pos, clanes = (row['posicion'], row['clanes']) if row else (0, 0)
+    if row:
+        logger.info(f"Reanudando importación de {ruta} desde el byte {inicio_pos} ({clanes} clanes ya importados)")
+
+    inicio = time.perf_counter()
+    filas_totales = 0
+    filas = _filas_vacias()
+    en_lote = 0
+
+    with open(ruta, 'rb') as f:
+        lector = _documentos_jsonl if ruta.endswith('.jsonl') else _documentos_objeto
+
+        for doc, posicion in lector(f, inicio_pos):
+            _filas_de_documento(doc, filas, guild_id)
+            en_lote += 1
+            clanes += 1
+
+            if en_lote >= tamano_lote:
+                with get_db_connection() as conn:
+                    _escribir_lote(conn, filas, archivo, posicion, clanes)
+                filas_totales += len(filas['clanes']) + len(filas['miembros']) + len(filas['canales'])
+                transcurrido = time.perf_counter() - inicio
+                logger.info(f"{clanes} clanes importados ({filas_totales / transcurrido:.0f} filas/s)")
+                filas, en_lote = _filas_vacias(), 0
+
+        if en_lote:
+            posicion = f.tell()
+            with get_db_connection() as conn:
+                _escribir_lote(conn, filas, archivo, posicion, clanes)
+            filas_totales += len(filas['clanes']) + len(filas['miembros']) + len(filas['canales'])
+
+    if diferir_indices:
+        inicio_indices = time.perf_counter()
+        with get_db_connection() as conn:
+            asegurar_indices(conn)
+        logger.info(f"Índices recreados en {time.perf_counter() - inicio_indices:.1f}s")
+
+    segundos = time.perf_counter() - inicio
+    resumen = {
+        'clanes': clanes,
+        'filas': filas_totales,
+        'segundos': segundos,
+        'filas_por_segundo': filas_totales / segundos if segundos else 0.0,
+        'reanudado': bool(row)
+    }
+    logger.info(
+        f"Importación terminada: {clanes} clanes, {filas_totales} filas en {segundos:.1f}s "
+        f"({resumen['filas_por_segundo']:.0f} filas/s)"
+    )
+    return resumen
+
+if __name__ == '__main__':
+    argumentos = sys.argv[1:]
+    adoptar = '--adoptar-huerfanos' in argumentos
+    if not adoptar and (not argumentos or argumentos[0].startswith('--')):
+        print(__doc__)
+        sys.exit(1)
+
+    opciones = argumentos if adoptar else argumentos[1:]
+    if '--db' in opciones:
+        database.DATABASE_FILE = opciones[opciones.index('--db') + 1]
+    lote = int(opciones[opciones.index('--lote') + 1]) if '--lote' in opciones else 2000
+
+    guild = opciones[opciones.index('--guild') + 1] if '--guild' in opciones else os.getenv('GUILD_ID')
+    if not guild:
+        logger.error("Indica el servidor de los clanes con --guild ID (o la variable GUILD_ID)")
+        sys.exit(1)
+
+    if adoptar:
+        init_database()
+        database.asignar_guild_a_clanes_huerfanos(int(guild))
+    else:
+        importar_json(
+            argumentos[0],
+            int(guild),
+            tamano_lote=lote,
+            diferir_indices='--diferir-indices' in opciones,
+            reiniciar='--reiniciar' in opciones
+        )
@@ -0,0 +1,298 @@
+"""
+Índices de la base de datos: cada índice se declara junto a la consulta de
+database.py a la que sirve, se crea de forma idempotente al iniciar y se
+puede verificar con EXPLAIN QUERY PLAN.
+
+Uso:
+    python indices.py verificar [ruta_db]
+    python indices.py benchmark [--clanes 10000] [--miembros 1000000]
+"""
+import sys
+import time
+import logging
+import sqlite3
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Orden de roles usado por obtener_miembros_clan. El índice idx_miembros_orden
+# incluye esta misma expresión para que SQLite no tenga que ordenar en memoria.
+ORDEN_ROLES_SQL = """CASE rol_clan
+                        WHEN 'Líder' THEN 1
+                        WHEN 'Co-Líder' THEN 2
+                        WHEN 'Miembro' THEN 3
+                        WHEN 'Recluta' THEN 4
+                    END"""
+
+INDICES = [
+    {
+        'nombre': 'idx_clanes_canal_admin',
+        'ddl': 'ON clanes(canal_admin_id, guild_id, nombre)',
+        'consulta': 'SELECT nombre FROM clanes WHERE canal_admin_id = ? AND guild_id = ?',
+        'funciones': ['obtener_clan_por_canal_admin']
+    },
+    {
+        'nombre': 'idx_clanes_ranking',
+        'ddl': 'ON clanes(nivel DESC, xp_actual DESC)',
+        'consulta': 'SELECT nombre FROM clanes ORDER BY nivel DESC, xp_actual DESC',
+        'funciones': ['obtener_top_clanes']
+    },
+    {
+        # Lo crea la PRIMARY KEY(guild_id, nombre)
+        'nombre': 'sqlite_autoindex_clanes_1',
+        'ddl': None,
+        'consulta': 'SELECT * FROM clanes WHERE guild_id = ? AND nombre = ?',
+        'funciones': ['obtener_clan', 'clan_existe', 'agregar_xp_clan', 'guardar_panel_clan']
+    },
+    {
+        'nombre': 'idx_clanes_guild_ranking',
+        'ddl': 'ON clanes(guild_id, nivel DESC, xp_actual DESC)',
+        'consulta': 'SELECT nombre FROM clanes WHERE guild_id = ? ORDER BY nivel DESC, xp_actual DESC',
+        'funciones': ['obtener_todos_clanes', 'obtener_top_clanes', 'obtener_estado_reconciliacion']
+    },
+    {
+        'nombre': 'idx_miembros_orden',
+        'ddl': f'ON miembros_clan(guild_id, clan_nombre, activo, ({ORDEN_ROLES_SQL}), fecha_union, usuario_id, rol_clan)',
+        'consulta': f'''
+            SELECT usuario_id, rol_clan, fecha_union, activo FROM miembros_clan
+            WHERE guild_id = ? AND clan_nombre = ? AND activo = 1
+            ORDER BY {ORDEN_ROLES_SQL}, fecha_union
+        ''',
+        'funciones': ['obtener_miembros_clan', 'obtener_estado_reconciliacion', 'aplicar_reconciliacion']
+    },
+    {
+        # Lo crea la restricción UNIQUE(guild_id, clan_nombre, usuario_id): a lo sumo una fila por búsqueda
+        'nombre': 'sqlite_autoindex_miembros_clan_1',
+        'ddl': None,
+        'consulta': '''
+            SELECT rol_clan FROM miembros_clan
+            WHERE guild_id = ? AND clan_nombre = ? AND usuario_id = ? AND activo = 1
+        ''',
+        'funciones': ['obtener_rol_miembro', 'es_miembro_clan', 'remover_miembro_clan']
+    },
+    {
+        'nombre': 'idx_miembros_usuario_activo',
+        'ddl': 'ON miembros_clan(usuario_id, activo, fecha_union, guild_id, clan_nombre, rol_clan)',
+        'consulta': '''
+            SELECT guild_id, clan_nombre, rol_clan, fecha_union FROM miembros_clan
+            WHERE usuario_id = ? AND activo = 1 ORDER BY fecha_union
+        ''',
+        'funciones': ['obtener_membresias_usuario', 'remover_usuario_de_clanes']
+    },
+    {
+        'nombre': 'idx_canales_clan_tipo',
+        'ddl': 'ON canales_clan(guild_id, clan_nombre, tipo, canal_id, nombre)',
+        'consulta': 'SELECT COUNT(*) FROM canales_clan WHERE guild_id = ? AND clan_nombre = ? AND tipo = ?',
+        'funciones': ['contar_canales_extra', 'obtener_clan', 'obtener_estado_reconciliacion']
+    },
+    {
+        'nombre': 'idx_canales_canal_id',
+        'ddl': 'ON canales_clan(canal_id, guild_id)',
+        'consulta': 'DELETE FROM canales_clan WHERE guild_id = ? AND canal_id = ?',
+        'funciones': ['aplicar_reconciliacion']
+    },
+    {
+        'nombre': 'idx_invitaciones_pendientes_expiracion',
+        'ddl': "ON invitaciones_pendientes(estado, fecha_expiracion) WHERE estado = 'pendiente'",
+        'consulta': '''
+            SELECT id FROM invitaciones_pendientes
+            WHERE estado = 'pendiente' AND fecha_expiracion <= ?
+            ORDER BY fecha_expiracion
+        ''',
+        'funciones': ['expirar_invitaciones_vencidas', 'obtener_proxima_expiracion']
+    },
+    {
+        'nombre': 'idx_invitaciones_pendientes_clan',
+        'ddl': "ON invitaciones_pendientes(guild_id, clan_nombre, usuario_invitado_id) WHERE estado = 'pendiente'",
+        'consulta': '''
+            SELECT usuario_invitado_id FROM invitaciones_pendientes
+            WHERE estado = 'pendiente' AND guild_id = ? AND clan_nombre = ?
+        ''',
+        'funciones': ['obtener_invitados_pendientes']
+    },
+    {
+        # Borrados en cascada al eliminar un clan
+        'nombre': 'idx_historial_clan',
+        'ddl': 'ON historial_xp(guild_id, clan_nombre)',
+        'consulta': 'DELETE FROM historial_xp WHERE guild_id = ? AND clan_nombre = ?',
+        'funciones': []
+    },
+    {
+        # Lo crea la PRIMARY KEY(guild_id, clan_nombre, dia). obtener_ranking_crecimiento
+        # lo recorre por guild_id
+        'nombre': 'sqlite_autoindex_historial_xp_diario_1',
+        'ddl': None,
+        'consulta': '''
+            SELECT COALESCE(SUM(xp_total), 0) FROM historial_xp_diario
+            WHERE guild_id = ? AND clan_nombre = ? AND dia >= ?
+        ''',
+        'funciones': ['obtener_xp_ganada', 'obtener_serie_xp', 'obtener_ranking_crecimiento', 'agregar_xp_clan']
+    },
+    {
+        # Lo crea la PRIMARY KEY(guild_id, clan_nombre, hora)
+        'nombre': 'sqlite_autoindex_historial_xp_horario_1',
+        'ddl': None,
+        'consulta': '''
+            SELECT hora, xp_total FROM historial_xp_horario
+            WHERE guild_id = ? AND clan_nombre = ? AND hora >= ?
+        ''',
+        'funciones': ['obtener_serie_xp', 'agregar_xp_clan']
+    },
+    {
+        'nombre': 'idx_historial_horario_hora',
+        'ddl': 'ON historial_xp_horario(hora)',
+        'consulta': 'SELECT rowid FROM historial_xp_horario WHERE hora < ? LIMIT 1000',
+        'funciones': ['compactar_historial_xp']
+    },
+]
+
+# Índices de versiones anteriores que quedaron cubiertos por los de arriba
+INDICES_OBSOLETOS = [
+    'idx_miembros_clan',       # prefijo de idx_miembros_orden
+    'idx_miembros_usuario',    # prefijo de idx_miembros_usuario_activo
+    'idx_canales_clan',        # prefijo de idx_canales_clan_tipo
+    'idx_invitaciones_estado', # reemplazado por los índices parciales de pendientes
+    'idx_historial_clan_fecha', # las sumas por periodo se leen de los resúmenes
+]
+
+def asegurar_indices(conn: sqlite3.Connection):
+    """Crear los índices declarados y borrar los obsoletos (idempotente)"""
+    for indice in INDICES:
+        if indice['ddl']:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {indice['nombre']} {indice['ddl']}")
+
+    for nombre in INDICES_OBSOLETOS:
+        conn.execute(f"DROP INDEX IF EXISTS {nombre}")
+
+    # Actualizar estadísticas del planificador solo si hace falta
+    conn.execute('PRAGMA optimize')
+
+def verificar_indices(conn: sqlite3.Connection) -> List[Dict]:
+    """
+    Ejecutar EXPLAIN QUERY PLAN de cada consulta declarada.
+    Devuelve las que no usan su índice: [{'nombre', 'consulta', 'plan'}]
+    """
+    problemas = []
+    for indice in INDICES:
+        parametros = (None,) * indice['consulta'].count('?')
+        plan = [fila[3] for fila in conn.execute(f"EXPLAIN QUERY PLAN {indice['consulta']}", parametros)]
+        if not any(indice['nombre'] in paso for paso in plan):
+            problemas.append({'nombre': indice['nombre'], 'consulta': ' '.join(indice['consulta'].split()), 'plan': plan})
+    return problemas
+
+# ==================== BENCHMARK ====================
+
+def _generar_datos(conn: sqlite3.Connection, n_clanes: int, n_miembros: int):
+    """Llenar la base con n_clanes y n_miembros repartidos de forma sesgada"""
+    conn.executemany('''
+        INSERT INTO clanes (nombre, creador_id, nivel, xp_actual, rol_id, categoria_id,
+                            canal_anuncios_id, canal_admin_id, canal_general_id, invite_code, guild_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        (f"clan{i}", i, 1 + i % 6, (i * 37) % 15000, 10 * i, 10 * i + 1, 10 * i + 2, 10 * i + 3, 10 * i + 4, f"inv{i}",
+         i % 100)
+        for i in range(n_clanes)
+    ))
+
+    roles = ['Líder', 'Co-Líder', 'Miembro', 'Recluta', 'Recluta', 'Recluta']
+    # Distribución sesgada: los clanes con índice bajo concentran más miembros
+    conn.executemany('''
+        INSERT OR IGNORE INTO miembros_clan (guild_id, clan_nombre, usuario_id, rol_clan, activo)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (
+        (c % 100, f"clan{c}", j, roles[j % len(roles)], 0 if j % 10 == 0 else 1)
+        for j, c in ((j, int(n_clanes * (j / n_miembros) ** 2)) for j in range(n_miembros))
+    ))
+
+    conn.executemany('''
+        INSERT INTO canales_clan (guild_id, clan_nombre, canal_id, nombre, tipo) VALUES (?, ?, ?, ?, ?)
+    ''', ((i % n_clanes % 100, f"clan{i % n_clanes}", 10**9 + i, f"canal{i}", 'texto' if i % 3 else 'voz')
+          for i in range(n_clanes * 3)))
+    conn.commit()
+
+def _medir_consultas(conn: sqlite3.Connection, n_clanes: int, repeticiones: int = 2000) -> Dict[str, float]:
+    """Latencia media (µs) de cada consulta declarada con parámetros realistas"""
+    parametros = {
+        'idx_clanes_canal_admin': lambda i: (10 * (i % n_clanes) + 3, i % n_clanes % 100),
+        'idx_clanes_ranking': None,
+        'sqlite_autoindex_clanes_1': lambda i: (i % n_clanes % 100, f"clan{i % n_clanes}"),
+        'idx_clanes_guild_ranking': lambda i: (i % 100,),
+        'idx_miembros_orden': lambda i: (i % 50, f"clan{i % 50}"),
+        'sqlite_autoindex_miembros_clan_1': lambda i: (i % 50, f"clan{i % 50}", i * 97),
+        'idx_miembros_usuario_activo': lambda i: (i * 97,),
+        'idx_canales_clan_tipo': lambda i: (i % n_clanes % 100, f"clan{i % n_clanes}", 'texto'),
+        'idx_invitaciones_pendientes_expiracion': lambda i: ('2000-01-01',),
+        'idx_invitaciones_pendientes_clan': lambda i: (i % n_clanes % 100, f"clan{i % n_clanes}"),
+        'sqlite_autoindex_historial_xp_diario_1': lambda i: (i % n_clanes % 100, f"clan{i % n_clanes}", '2000-01-01'),
+        'sqlite_autoindex_historial_xp_horario_1': lambda i: (i % n_clanes % 100, f"clan{i % n_clanes}", '2000-01-01'),
+        'idx_historial_horario_hora': lambda i: ('2000-01-01',),
+    }
+
+    resultados = {}
+    for indice in INDICES:
+        generador = parametros.get(indice['nombre'])
+        if indice['consulta'].lstrip().upper().startswith('DELETE'):
+            continue
+        veces = 5 if generador is None else repeticiones
+        inicio = time.perf_counter()
+        for i in range(veces):
+            conn.execute(indice['consulta'], generador(i) if generador else ()).fetchall()
+        resultados[indice['nombre']] = (time.perf_counter() - inicio) / veces * 1e6
+    return resultados
+
+def benchmark(n_clanes: int = 10000, n_miembros: int = 1000000):
+    """Comparar la latencia de cada consulta sin y con los índices declarados"""
+    import os
+    import tempfile
+    import database
+
+    directorio = tempfile.mkdtemp()
+    database.DATABASE_FILE = os.path.join(directorio, 'benchmark.db')
+    database.init_database()
+
+    with sqlite3.connect(database.DATABASE_FILE) as conn:
+        for indice in INDICES:
+            if indice['ddl']:
+                conn.execute(f"DROP INDEX IF EXISTS {indice['nombre']}")
+
+        print(f"Generando {n_clanes} clanes y {n_miembros} miembros...")
+        inicio = time.perf_counter()
+        _generar_datos(conn, n_clanes, n_miembros)
+        print(f"Datos generados en {time.perf_counter() - inicio:.1f}s")
+
+        conn.execute('ANALYZE')
+        sin_indices = _medir_consultas(conn, n_clanes, repeticiones=20)
+
+        inicio = time.perf_counter()
+        asegurar_indices(conn)
+        conn.execute('ANALYZE')
+        print(f"Índices creados en {time.perf_counter() - inicio:.1f}s")
+        con_indices = _medir_consultas(conn, n_clanes)
+
+        problemas = verificar_indices(conn)
+
+    print(f"\n{'índice':42} {'sin índice':>12} {'con índice':>12} {'mejora':>8}")
+    for nombre, antes in sin_indices.items():
+        despues = con_indices[nombre]
+        print(f"{nombre:42} {antes:10.1f}µs {despues:10.1f}µs {antes / despues:7.1f}x")
+
+    for p in problemas:
+        print(f"⚠️  {p['nombre']} no se usa: {' / '.join(p['plan'])}")
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    argumentos = sys.argv[1:]
+
+    if argumentos and argumentos[0] == 'benchmark':
+        opciones = dict(zip(argumentos[1::2], argumentos[2::2]))
+        benchmark(int(opciones.get('--clanes', 10000)), int(opciones.get('--miembros', 1000000)))
+    elif argumentos and argumentos[0] == 'verificar':
+        ruta = argumentos[1] if len(argumentos) > 1 else 'clan_data.db'
+        with sqlite3.connect(ruta) as conn:
+            problemas = verificar_indices(conn)
+        for p in problemas:
+            print(f"⚠️  {p['nombre']} no se usa en: {p['consulta']}\n    plan: {' / '.join(p['plan'])}")
+        print("✅ Todos los índices se usan" if not problemas else f"{len(problemas)} índices sin usar")
+        sys.exit(1 if problemas else 0)
+    else:
+        print(__doc__)
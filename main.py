@@ -1,21 +1,39 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
 import os
 import asyncio
 import logging
 from dotenv import load_dotenv
 from datetime import datetime
+from typing import Dict, Optional
+
+# Antes de importar database: DB_SOCKET decide al importar si se usa el servicio de base de datos
+load_dotenv()
+
 from database import (
     init_database, crear_clan, obtener_clan, obtener_todos_clanes,
     clan_existe, obtener_clan_por_canal_admin, agregar_canal_extra,
-    agregar_xp_clan, agregar_miembro_clan, obtener_miembros_clan,
+    agregar_miembro_clan, obtener_miembros_clan,
     obtener_rol_miembro, es_miembro_clan, crear_invitacion,
-    obtener_invitacion, aceptar_invitacion, rechazar_invitacion,
-    contar_canales_extra, limpiar_invitaciones_expiradas, NIVELES_CLAN
+    obtener_invitacion_cacheada, aceptar_invitacion, rechazar_invitacion,
+    contar_canales_extra, guardar_mensaje_invitacion, cargar_indice_membresias,
+    crear_invitaciones, obtener_invitados_pendientes, guardar_mensajes_invitacion,
+    cancelar_invitaciones, obtener_clanes_usuario, obtener_clan_usuario,
+    remover_miembro_clan, remover_usuario_de_clanes, obtener_xp_ganada,
+    compactar_historial_xp, obtener_ranking_crecimiento, cargar_clasificacion,
+    obtener_top_clanes, obtener_posicion_clan, NIVELES_CLAN
 )
-
-load_dotenv()
+from reconciliacion import reconciliar_guild, LimitadorAPI
+from expiracion_invitaciones import ProgramadorExpiraciones
+from panel_clanes import PanelesClanes
+from metricas import medido, registrar_resumen, iniciar_servidor_metricas
+from plazo_interacciones import con_plazo
+import graficos_xp
+import cache_embeds
+import trazas_sql
+import vigilancia_loop
+import reparto_guilds
 
 logging.basicConfig(
     level=logging.INFO,
@@ -30,7 +48,28 @@ intents.guilds = True
 intents.members = True
 intents.dm_messages = True
 
-bot = commands.Bot(command_prefix='!', intents=intents)
+# Un shard por cada ~1000 servidores (lo decide Discord); SHARD_COUNT lo fija a mano.
+# Con varios procesos, cada uno lleva los shards de SHARD_IDS ("0,1") y todos usan el
+# servicio de base de datos (DB_SOCKET, ver servicio_db.py)
+SHARD_IDS = [int(i) for i in os.getenv('SHARD_IDS').split(',')] if os.getenv('SHARD_IDS') else None
+bot = commands.AutoShardedBot(
+    command_prefix='!', intents=intents,
+    shard_count=int(os.getenv('SHARD_COUNT')) if os.getenv('SHARD_COUNT') else None,
+    shard_ids=SHARD_IDS
+)
+# Las tareas globales (migraciones, compactar el historial, sincronizar comandos)
+# corren en un solo proceso: el que lleva el shard 0
+PROCESO_PRINCIPAL = SHARD_IDS is None or 0 in SHARD_IDS
+# Shards de este proceso (None = todos): cada proceso expira las invitaciones de sus servidores
+SHARDS_PROCESO = (SHARD_IDS, bot.shard_count) if SHARD_IDS is not None else None
+
+def obtener_guild_de_clan(clan_info: dict):
+    """Servidor del clan (None si el bot no está en él)"""
+    return bot.get_guild(clan_info['guild_id'])
+
+def clan_en_servidor(clan_nombre: str, guild: discord.Guild) -> bool:
+    """El clan existe en este servidor"""
+    return clan_existe(guild.id, clan_nombre)
 
 # ==================== EVENTOS ====================
 
@@ -39,12 +78,58 @@ async def on_ready():
     logger.info(f'{bot.user} ha iniciado sesión')
     logger.info(f'Bot conectado a {len(bot.guilds)} servidores')
 
-    # Inicializar base de datos
-    init_database()
-    logger.info('Base de datos SQLite inicializada')
+    # Trazas de consultas lentas (opcional)
+    if os.getenv('SQLITE_LENTAS_MS') and not trazas_sql.activo():
+        trazas_sql.activar(float(os.getenv('SQLITE_LENTAS_MS')))
+
+    # Vigilancia de bloqueos del event loop (opcional)
+    if os.getenv('LOOP_BLOQUEO_MS') and not vigilancia_loop.activo():
+        vigilancia_loop.activar(
+            float(os.getenv('LOOP_BLOQUEO_MS')),
+            depurar_asyncio=os.getenv('ASYNCIO_DEBUG', '').lower() in ('1', 'true', 'si', 'sí')
+        )
+
+    if PROCESO_PRINCIPAL:
+        # Inicializar base de datos (en un hilo: las migraciones por lotes pueden tardar)
+        await asyncio.to_thread(init_database)
+        logger.info('Base de datos SQLite inicializada')
+
+    # Cargar índice de membresías y clasificación de clanes en memoria
+    # (con el servicio de base de datos las cachés son las suyas, cargadas al arrancar)
+    if not os.getenv('DB_SOCKET'):
+        await asyncio.to_thread(cargar_indice_membresias)
+        await asyncio.to_thread(cargar_clasificacion)
+
+    # Paneles en vivo de los clanes
+    await paneles_clanes.iniciar()
 
-    # Limpiar invitaciones expiradas
-    limpiar_invitaciones_expiradas()
+    # Usos de las invitaciones de cada servidor, para reconocer las entradas por invitación de clan
+    for guild in bot.guilds:
+        if guild.id not in _usos_atribuidos:
+            asyncio.create_task(cargar_usos_invitaciones(guild))
+
+    # Expirar invitaciones vencidas y programar las pendientes de los servidores de este proceso
+    programador_expiraciones.iniciar()
+
+    # Iniciar reconciliación periódica de miembros
+    if not reconciliar_miembros.is_running():
+        reconciliar_miembros.start()
+
+    # Retención del historial de XP
+    if PROCESO_PRINCIPAL and not compactar_historial.is_running():
+        compactar_historial.start()
+
+    # Métricas: volcado periódico al log y endpoint local opcional
+    if not volcar_metricas.is_running():
+        volcar_metricas.start()
+
+    global servidor_metricas
+    metrics_port = os.getenv('METRICS_PORT')
+    if metrics_port and servidor_metricas is None:
+        servidor_metricas = await iniciar_servidor_metricas(int(metrics_port))
+
+    if not PROCESO_PRINCIPAL:
+        return
 
     try:
         logger.info('Iniciando sincronización de comandos...')
@@ -69,148 +154,367 @@ async def on_ready():
         logger.error(f'❌ Error al sincronizar comandos: {e}')
         logger.exception(e)
 
+# Usos de las invitaciones por servidor {guild_id: {código: usos}}: los ya atribuidos a una
+# entrada y los de la última lectura. La que tiene más usos leídos que atribuidos es con la que entró alguien
+_usos_atribuidos: Dict[int, Dict[str, int]] = {}
+_usos_leidos: Dict[int, Dict[str, int]] = {}
+_locks_invitaciones: Dict[int, asyncio.Lock] = {}
+
+async def _leer_usos_invitaciones(guild: discord.Guild) -> Dict[str, int]:
+    return {invite.code: invite.uses or 0 for invite in await guild.invites()}
+
+async def cargar_usos_invitaciones(guild: discord.Guild):
+    """Guardar los usos actuales de las invitaciones del servidor (al conectar o entrar a él)"""
+    try:
+        leidos = await _leer_usos_invitaciones(guild)
+    except discord.HTTPException as e:
+        logger.warning(f"No se pudieron leer las invitaciones de {guild.name}: {e}")
+        return
+    _usos_leidos[guild.id] = leidos
+    _usos_atribuidos[guild.id] = dict(leidos)
+
+def _atribuir_uso(leidos: Dict[str, int], atribuidos: Dict[str, int]) -> Optional[str]:
+    # Las invitaciones creadas después de la primera lectura empezaron en 0 usos
+    usada = next((codigo for codigo, usos in leidos.items() if usos > atribuidos.get(codigo, 0)), None)
+    if usada:
+        atribuidos[usada] = atribuidos.get(usada, 0) + 1
+    return usada
+
+async def invitacion_usada(guild: discord.Guild) -> Optional[str]:
+    """
+    Código de la invitación con la que entró el último miembro, o None.
+    Discord cuenta el uso antes de avisar la entrada: cada entrada se lleva un
+    uso leído y aún no atribuido, y solo se vuelven a leer las invitaciones
+    cuando no queda ninguno (en un raid, una lectura sirve para muchas entradas).
+    Si entran a la vez por invitaciones distintas, los usos de cada una se
+    reparten bien aunque no se sepa cuál fue de quién.
+    """
+    lock = _locks_invitaciones.setdefault(guild.id, asyncio.Lock())
+    async with lock:
+        atribuidos = _usos_atribuidos.get(guild.id)
+        if atribuidos is None:
+            # Sin lectura anterior no hay con qué comparar: esta sirve para las próximas entradas
+            await cargar_usos_invitaciones(guild)
+            return None
+
+        usada = _atribuir_uso(_usos_leidos[guild.id], atribuidos)
+        if usada:
+            return usada
+
+        leidos = _usos_leidos[guild.id] = await _leer_usos_invitaciones(guild)
+        for codigo in [c for c in atribuidos if c not in leidos]:
+            del atribuidos[codigo]
+        return _atribuir_uso(leidos, atribuidos)
+
 @bot.event
+@medido('evento')
 async def on_member_join(member):
-    """Detectar cuando alguien se une mediante invitación permanente y dar XP"""
+    """Detectar cuando alguien se une mediante invitación permanente de un clan y sumarlo al clan"""
     try:
-        # Obtener las invitaciones actuales
-        invites_after = await member.guild.invites()
-
-        # Buscar en todos los clanes cuál invitación se usó
-        clanes = obtener_todos_clanes()
-
-        for clan_nombre, clan_info in clanes.items():
-            # Verificar si la invitación del clan fue usada
-            invite_code = clan_info.get('invite_code')
-            if not invite_code:
-                continue
-
-            # Buscar la invitación en la lista
-            for invite in invites_after:
-                if invite.code == invite_code:
-                    # Esta es una invitación permanente de un clan
-                    # Agregar el miembro al clan como Recluta por defecto
-                    clan_role = member.guild.get_role(clan_info['rol_id'])
-
-                    if clan_role:
-                        # Asignar rol de Discord
-                        await member.add_roles(clan_role)
-
-                        # Agregar a la base de datos
-                        agregar_miembro_clan(
-                            clan_nombre=clan_nombre,
-                            usuario_id=member.id,
-                            rol='Recluta',
-                            invitado_por=None  # No sabemos quién compartió el link
-                        )
-
-                        # Dar XP al clan (+50 XP por nuevo miembro)
-                        resultado = agregar_xp_clan(
-                            clan_nombre=clan_nombre,
-                            cantidad_xp=50,
-                            razon="Nuevo miembro se unió mediante invitación permanente",
-                            usuario_id=member.id,
-                            origen="invitacion_permanente"
-                        )
-
-                        # Notificar en el canal general
-                        canal_general = member.guild.get_channel(clan_info['canal_general_id'])
-                        if canal_general:
-                            embed = discord.Embed(
-                                title="🎉 ¡Nuevo Miembro!",
-                                description=f"{member.mention} se ha unido al clan mediante la invitación permanente",
-                                color=0x00ff00
-                            )
-                            embed.add_field(name="Rol asignado", value="Recluta", inline=True)
-                            embed.add_field(name="XP ganado", value="+50 XP", inline=True)
-
-                            if resultado and resultado.get('subio_nivel'):
-                                embed.add_field(
-                                    name="🎊 ¡NIVEL SUBIDO!",
-                                    value=f"Nivel {resultado['nivel_anterior']} → {resultado['nivel_nuevo']}\n"
-                                          f"Nuevos límites desbloqueados!",
-                                    inline=False
-                                )
-
-                            await canal_general.send(embed=embed)
-
-                        logger.info(f"Usuario {member.name} se unió al clan {clan_nombre} mediante invitación permanente (+50 XP)")
-                        break
+        invite_code = await invitacion_usada(member.guild)
+        if not invite_code:
+            return
+
+        guild_id = member.guild.id
+        clanes = await reparto_guilds.en_hilo(guild_id, obtener_todos_clanes, guild_id)
+        clan_nombre = next((nombre for nombre, info in clanes.items() if info.get('invite_code') == invite_code), None)
+        if clan_nombre is None:
+            return  # Invitación del servidor que no es de ningún clan
+
+        clan_info = await reparto_guilds.en_hilo(guild_id, obtener_clan, guild_id, clan_nombre)
+        clan_role = member.guild.get_role(clan_info['rol_id']) if clan_info else None
+        if not clan_role:
+            return
+
+        # Asignar rol de Discord
+        await member.add_roles(clan_role)
+
+        # Agregar a la base de datos como Recluta (agregar_miembro_clan suma los +50 XP del nuevo miembro)
+        posicion_anterior = await reparto_guilds.en_hilo(guild_id, obtener_posicion_clan, guild_id, clan_nombre)
+        if not await reparto_guilds.en_hilo(guild_id, agregar_miembro_clan, guild_id, clan_nombre, member.id, 'Recluta'):
+            return
+        graficos_xp.invalidar(guild_id, clan_nombre)
+
+        despues = await reparto_guilds.en_hilo(guild_id, obtener_clan, guild_id, clan_nombre) or clan_info
+        resultado = {
+            'nivel_anterior': clan_info['nivel'],
+            'nivel_nuevo': despues['nivel'],
+            'subio_nivel': despues['nivel'] > clan_info['nivel'],
+            'posicion_anterior': posicion_anterior,
+            'posicion_nueva': await reparto_guilds.en_hilo(guild_id, obtener_posicion_clan, guild_id, clan_nombre)
+        }
+
+        # Notificar en el canal general
+        canal_general = member.guild.get_channel(clan_info['canal_general_id'])
+        if canal_general:
+            embed = discord.Embed(
+                title="🎉 ¡Nuevo Miembro!",
+                description=f"{member.mention} se ha unido al clan mediante la invitación permanente",
+                color=0x00ff00
+            )
+            embed.add_field(name="Rol asignado", value="Recluta", inline=True)
+            embed.add_field(name="XP ganado", value="+50 XP", inline=True)
+
+            if resultado['subio_nivel']:
+                embed.add_field(
+                    name="🎊 ¡NIVEL SUBIDO!",
+                    value=f"Nivel {resultado['nivel_anterior']} → {resultado['nivel_nuevo']}\n"
+                          f"Nuevos límites desbloqueados!",
+                    inline=False
+                )
+
+            await canal_general.send(embed=embed)
+
+        await notificar_cambio_posicion(member.guild, clan_info, clan_nombre, resultado)
+
+        logger.info(f"Usuario {member.name} se unió al clan {clan_nombre} mediante invitación permanente (+50 XP)")
 
     except Exception as e:
         logger.error(f"Error en on_member_join: {e}")
         logger.exception(e)
 
+async def notificar_cambio_posicion(guild: discord.Guild, clan_info: dict, clan_nombre: str, resultado: dict):
+    """Anunciar en el canal de anuncios del clan si subir de nivel lo hizo subir en la clasificación"""
+    if not resultado or not resultado.get('subio_nivel'):
+        return
+
+    anterior, nueva = resultado.get('posicion_anterior'), resultado.get('posicion_nueva')
+    if not anterior or not nueva or nueva >= anterior:
+        return
+
+    canal = guild.get_channel(clan_info['canal_anuncios_id'])
+    if not canal:
+        return
+
+    embed = discord.Embed(
+        title="🏆 ¡Subieron en la clasificación!",
+        description=f"**{clan_nombre}** pasó del puesto #{anterior} al **#{nueva}** "
+                    f"al alcanzar el nivel {resultado['nivel_nuevo']}.",
+        color=0xffd700
+    )
+    try:
+        await canal.send(embed=embed)
+    except discord.HTTPException as e:
+        logger.warning(f"No se pudo anunciar el cambio de posición de {clan_nombre}: {e}")
+
+@bot.event
+@medido('evento')
+async def on_member_remove(member):
+    """Dar de baja de los clanes del servidor a quien sale de él"""
+    try:
+        clanes = await reparto_guilds.en_hilo(member.guild.id, remover_usuario_de_clanes, member.guild.id, member.id)
+        for clan_nombre in clanes:
+            logger.info(f"Usuario {member.name} salió del servidor y fue removido del clan {clan_nombre}")
+    except Exception as e:
+        logger.error(f"Error en on_member_remove: {e}")
+        logger.exception(e)
+
+@bot.event
+@medido('evento')
+async def on_guild_remove(guild):
+    """Soltar el estado por servidor al salir de uno"""
+    logger.info(f"El bot salió del servidor {guild.name} ({guild.id})")
+    reparto_guilds.olvidar(guild.id)
+    _usos_atribuidos.pop(guild.id, None)
+    _usos_leidos.pop(guild.id, None)
+    _locks_invitaciones.pop(guild.id, None)
+
+@bot.event
+@medido('evento')
+async def on_guild_join(guild):
+    """Leer los usos de las invitaciones del servidor nuevo"""
+    await cargar_usos_invitaciones(guild)
+
+# ==================== TAREAS PERIÓDICAS ====================
+
+@tasks.loop(minutes=30)
+async def reconciliar_miembros():
+    """Reconciliar periódicamente roles/canales de Discord con la DB (sin llamadas a la API)"""
+    # Un servidor tras otro: reconciliar_guild cede el loop entre bloques de miembros
+    for guild in list(bot.guilds):
+        try:
+            await reconciliar_guild(guild, aplicar_api=False)
+        except Exception as e:
+            logger.error(f"Error en reconciliación periódica de {guild.name}: {e}")
+            logger.exception(e)
+
+@reconciliar_miembros.before_loop
+async def antes_de_reconciliar():
+    await bot.wait_until_ready()
+
+@tasks.loop(hours=24)
+async def compactar_historial():
+    """Borrar los eventos y resúmenes por hora viejos del historial de XP (en un hilo, por lotes)"""
+    await asyncio.to_thread(compactar_historial_xp)
+
+@compactar_historial.before_loop
+async def antes_de_compactar_historial():
+    await bot.wait_until_ready()
+
+servidor_metricas = None
+
+@tasks.loop(minutes=15)
+async def volcar_metricas():
+    """Escribir en el log el resumen de latencias de comandos y base de datos"""
+    registrar_resumen()
+    if trazas_sql.activo():
+        trazas_sql.registrar_reporte()
+    if vigilancia_loop.activo():
+        vigilancia_loop.registrar_reporte()
+
+@volcar_metricas.before_loop
+async def antes_de_volcar_metricas():
+    await bot.wait_until_ready()
+
 # ==================== VISTAS/UI ====================
 
-class InvitacionView(discord.ui.View):
-    def __init__(self, invitacion_id: int):
-        super().__init__(timeout=None)
-        self.invitacion_id = invitacion_id
+PREFIJO_INVITACION = 'invitacion'
+
+def crear_vista_invitacion(invitacion_id: int, desactivada: bool = False) -> discord.ui.View:
+    """
+    Construir los botones de una invitación con el ID codificado en el custom_id.
+    La vista se detiene antes de enviarse para que discord.py no la guarde en memoria:
+    los clics los atiende despachar_invitacion, incluso después de reiniciar el bot.
+    """
+    view = discord.ui.View(timeout=None)
+    view.add_item(discord.ui.Button(
+        label='✅ Aceptar',
+        style=discord.ButtonStyle.green,
+        custom_id=f'{PREFIJO_INVITACION}:aceptar:{invitacion_id}',
+        disabled=desactivada
+    ))
+    view.add_item(discord.ui.Button(
+        label='❌ Rechazar',
+        style=discord.ButtonStyle.red,
+        custom_id=f'{PREFIJO_INVITACION}:rechazar:{invitacion_id}',
+        disabled=desactivada
+    ))
+    view.stop()
+    return view
+
+@bot.listen('on_interaction')
+async def despachar_invitacion(interaction: discord.Interaction):
+    """Despachador único de los botones de invitación"""
+    if interaction.type != discord.InteractionType.component:
+        return
 
-    @discord.ui.button(label='✅ Aceptar', style=discord.ButtonStyle.green, custom_id='aceptar_invitacion')
-    async def aceptar(self, interaction: discord.Interaction, button: discord.ui.Button):
-        invitacion = obtener_invitacion(self.invitacion_id)
+    custom_id = (interaction.data or {}).get('custom_id', '')
 
-        if not invitacion or invitacion['usuario_invitado_id'] != interaction.user.id:
-            await interaction.response.send_message("❌ Esta invitación no es para ti.", ephemeral=True)
-            return
+    # Botones de invitaciones enviadas antes de codificar el ID en el custom_id
+    if custom_id in ('aceptar_invitacion', 'rechazar_invitacion'):
+        await interaction.response.send_message(
+            "❌ Esta invitación es de una versión anterior del bot. Pide que te inviten de nuevo.",
+            ephemeral=True
+        )
+        return
 
-        if invitacion['estado'] != 'pendiente':
-            await interaction.response.send_message("❌ Esta invitación ya no está disponible.", ephemeral=True)
-            return
+    partes = custom_id.split(':')
+    if len(partes) != 3 or partes[0] != PREFIJO_INVITACION or not partes[2].isdigit():
+        return
 
-        # Aceptar invitación
-        if aceptar_invitacion(self.invitacion_id):
-            clan_info = obtener_clan(invitacion['clan_nombre'])
+    accion, invitacion_id = partes[1], int(partes[2])
+    # Botón en un mensaje directo: sin servidor del que usar la cuota de hilos
+    invitacion = await asyncio.to_thread(obtener_invitacion_cacheada, invitacion_id)
 
-            embed = discord.Embed(
-                title="✅ ¡Te has unido al clan!",
-                description=f"Ahora eres parte de **{invitacion['clan_nombre']}**",
-                color=0x00ff00
-            )
-            embed.add_field(name="Rol asignado", value=invitacion['rol_asignado'])
-            embed.add_field(name="Nivel del clan", value=f"Nivel {clan_info['nivel']}")
+    if not invitacion or invitacion['usuario_invitado_id'] != interaction.user.id:
+        await interaction.response.send_message("❌ Esta invitación no es para ti.", ephemeral=True)
+        return
 
-            # Desactivar botones
-            for item in self.children:
-                item.disabled = True
+    if invitacion['estado'] != 'pendiente':
+        await interaction.response.send_message("❌ Esta invitación ya no está disponible.", ephemeral=True)
+        return
 
-            await interaction.response.edit_message(embed=embed, view=self)
+    if accion == 'aceptar':
+        await aceptar_invitacion_interaccion(interaction, invitacion)
+    elif accion == 'rechazar':
+        await rechazar_invitacion_interaccion(interaction, invitacion)
 
-            # Notificar en el canal del clan si existe
-            try:
-                guild = bot.get_guild(int(os.getenv('GUILD_ID')))
-                canal_general = guild.get_channel(clan_info['canal_general_id'])
-                if canal_general:
-                    await canal_general.send(f"🎉 {interaction.user.mention} se ha unido al clan!")
-            except:
-                pass
-        else:
-            await interaction.response.send_message("❌ Error al aceptar la invitación.", ephemeral=True)
+@medido('boton')
+async def aceptar_invitacion_interaccion(interaction: discord.Interaction, invitacion: dict):
+    guild_id = invitacion['guild_id']
+    if not await reparto_guilds.en_hilo(guild_id, aceptar_invitacion, invitacion['id']):
+        await interaction.response.send_message("❌ Error al aceptar la invitación.", ephemeral=True)
+        return
+
+    clan_info = await reparto_guilds.en_hilo(guild_id, obtener_clan, guild_id, invitacion['clan_nombre'])
 
-    @discord.ui.button(label='❌ Rechazar', style=discord.ButtonStyle.red, custom_id='rechazar_invitacion')
-    async def rechazar(self, interaction: discord.Interaction, button: discord.ui.Button):
-        invitacion = obtener_invitacion(self.invitacion_id)
+    embed = discord.Embed(
+        title="✅ ¡Te has unido al clan!",
+        description=f"Ahora eres parte de **{invitacion['clan_nombre']}**",
+        color=0x00ff00
+    )
+    embed.add_field(name="Rol asignado", value=invitacion['rol_asignado'])
+    if clan_info:
+        embed.add_field(name="Nivel del clan", value=f"Nivel {clan_info['nivel']}")
 
-        if not invitacion or invitacion['usuario_invitado_id'] != interaction.user.id:
-            await interaction.response.send_message("❌ Esta invitación no es para ti.", ephemeral=True)
+    await interaction.response.edit_message(
+        embed=embed,
+        view=crear_vista_invitacion(invitacion['id'], desactivada=True)
+    )
+
+    if clan_info is None:
+        logger.warning(f"No se pudo leer el clan {invitacion['clan_nombre']} tras aceptar la invitación")
+        return
+
+    # Asignar rol y notificar en el canal del clan si existe
+    try:
+        guild = obtener_guild_de_clan(clan_info)
+        if guild is None:
+            logger.warning(f"El bot no está en el servidor del clan {invitacion['clan_nombre']}")
             return
+        member = guild.get_member(interaction.user.id)
+        clan_role = guild.get_role(clan_info['rol_id'])
+        if member and clan_role:
+            await member.add_roles(clan_role)
 
-        if rechazar_invitacion(self.invitacion_id):
-            embed = discord.Embed(
-                title="❌ Invitación rechazada",
-                description=f"Has rechazado la invitación a **{invitacion['clan_nombre']}**",
-                color=0xff0000
-            )
+        canal_general = guild.get_channel(clan_info['canal_general_id'])
+        if canal_general:
+            await canal_general.send(f"🎉 {interaction.user.mention} se ha unido al clan!")
+    except Exception as e:
+        logger.warning(f"No se pudo completar la unión al clan {invitacion['clan_nombre']}: {e}")
 
-            # Desactivar botones
-            for item in self.children:
-                item.disabled = True
+@medido('boton')
+async def rechazar_invitacion_interaccion(interaction: discord.Interaction, invitacion: dict):
+    if not await reparto_guilds.en_hilo(invitacion['guild_id'], rechazar_invitacion, invitacion['id']):
+        await interaction.response.send_message("❌ Error al rechazar la invitación.", ephemeral=True)
+        return
 
-            await interaction.response.edit_message(embed=embed, view=self)
-        else:
-            await interaction.response.send_message("❌ Error al rechazar la invitación.", ephemeral=True)
+    embed = discord.Embed(
+        title="❌ Invitación rechazada",
+        description=f"Has rechazado la invitación a **{invitacion['clan_nombre']}**",
+        color=0xff0000
+    )
+
+    await interaction.response.edit_message(
+        embed=embed,
+        view=crear_vista_invitacion(invitacion['id'], desactivada=True)
+    )
+
+limitador_dm = LimitadorAPI(llamadas_por_segundo=2, rafaga=5)
+
+# Máximo de invitaciones por uso de /invitar_varios
+MAX_INVITACIONES_LOTE = 100
+
+async def desactivar_invitaciones_expiradas(invitaciones):
+    """Editar los DMs de invitaciones expiradas para desactivar sus botones"""
+    for invitacion in invitaciones:
+        if not invitacion['mensaje_dm_id']:
+            continue
+
+        try:
+            usuario = bot.get_user(invitacion['usuario_invitado_id']) or \
+                await bot.fetch_user(invitacion['usuario_invitado_id'])
+            dm = usuario.dm_channel or await usuario.create_dm()
+
+            await limitador_dm.esperar()
+            await dm.get_partial_message(invitacion['mensaje_dm_id']).edit(
+                content=f"⏰ La invitación a **{invitacion['clan_nombre']}** ha expirado.",
+                view=crear_vista_invitacion(invitacion['id'], desactivada=True)
+            )
+        except discord.HTTPException as e:
+            logger.warning(f"No se pudo actualizar el DM de la invitación {invitacion['id']}: {e}")
+
+programador_expiraciones = ProgramadorExpiraciones(desactivar_invitaciones_expiradas, SHARDS_PROCESO)
 
 class ConfirmacionClanView(discord.ui.View):
     def __init__(self, autor_id: int, thread: discord.Thread):
@@ -265,6 +569,7 @@ class ConfirmacionClanView(discord.ui.View):
 # ==================== COMANDOS PÚBLICOS ====================
 
 @bot.tree.command(name='crear_clan', description='Iniciar proceso de creación de un clan')
+@medido('comando')
 async def crear_clan_cmd(interaction: discord.Interaction):
     """Crear un nuevo clan con flujo interactivo en thread privado"""
 
@@ -382,7 +687,7 @@ async def crear_clan_cmd(interaction: discord.Interaction):
                     intentos += 1
                     continue
 
-                if clan_existe(nombre):
+                if await reparto_guilds.en_hilo(guild.id, clan_existe, guild.id, nombre):
                     await thread.send(f"❌ El clan '{nombre}' ya existe. Elige otro nombre:")
                     intentos += 1
                     continue
@@ -529,7 +834,8 @@ async def crear_clan_cmd(interaction: discord.Interaction):
         await autor.add_roles(clan_role)
 
         # Guardar en base de datos
-        crear_clan(
+        await reparto_guilds.en_hilo(
+            guild.id, crear_clan,
             nombre=nombre,
             creador_id=autor.id,
             descripcion=descripcion,
@@ -538,7 +844,8 @@ async def crear_clan_cmd(interaction: discord.Interaction):
             canal_anuncios_id=canal_anuncios.id,
             canal_admin_id=canal_admin.id,
             canal_general_id=canal_general.id,
-            invite_code=invite.code
+            invite_code=invite.code,
+            guild_id=guild.id
         )
 
         # Mensaje en anuncios (solo visible para admins y creador)
@@ -552,11 +859,18 @@ async def crear_clan_cmd(interaction: discord.Interaction):
         # Mensaje en administración
         embed_admin = discord.Embed(
             title="⚙️ Panel de Administración del Clan",
-            description=f"¡Hola {autor.mention}! Tu clan ha sido creado.\n\n**📊 Estado Inicial:**\n• Nivel: 1\n• XP: 0/500\n• Límite de miembros: 10\n• Canales texto extra: 0/3\n• Canales voz extra: 0/2\n\n**Comandos disponibles:**\n`/agregar_canal` - Agregar canal\n`/stats_clan` - Ver estadísticas\n`/invitar_clan` - Invitar miembro\n`/gestionar_miembros` - Ver/gestionar miembros\n`/ver_invitacion` - Ver invitación secreta",
+            description=f"¡Hola {autor.mention}! Tu clan ha sido creado.\n\n**📊 Estado Inicial:**\n• Nivel: 1\n• XP: 0/500\n• Límite de miembros: 10\n• Canales texto extra: 0/3\n• Canales voz extra: 0/2\n\n**Comandos disponibles:**\n`/agregar_canal` - Agregar canal\n`/stats_clan` - Ver estadísticas\n`/invitar_clan` - Invitar miembro\n`/gestionar_miembros` - Ver/gestionar miembros\n`/expulsar_miembro` - Expulsar miembro\n`/ver_invitacion` - Ver invitación secreta",
             color=0x0099ff
         )
         await canal_admin.send(embed=embed_admin)
 
+        # Panel en vivo fijado en administración. El clan ya quedó guardado: si el panel
+        # falla se avisa en el log y el clan sigue creado (/panel_clan lo vuelve a publicar)
+        try:
+            await paneles_clanes.publicar(nombre, canal_admin)
+        except Exception as e:
+            logger.warning(f"No se pudo publicar el panel del clan {nombre}: {e}")
+
         # Respuesta en el thread
         embed_exito = discord.Embed(
             title="✅ ¡Clan Creado Exitosamente!",
@@ -588,10 +902,12 @@ async def crear_clan_cmd(interaction: discord.Interaction):
             )
 
 @bot.tree.command(name='listar_clanes', description='Ver todos los clanes disponibles en el servidor')
+@medido('comando')
+@con_plazo()
 async def listar_clanes(interaction: discord.Interaction):
-    """Listar todos los clanes con información básica"""
+    """Listar todos los clanes del servidor con información básica"""
 
-    clanes = obtener_todos_clanes()
+    clanes = await reparto_guilds.en_hilo(interaction.guild.id, obtener_todos_clanes, interaction.guild.id)
 
     if not clanes:
         embed = discord.Embed(
@@ -628,28 +944,32 @@ async def listar_clanes(interaction: discord.Interaction):
 
     await interaction.response.send_message(embed=embed)
 
-@bot.tree.command(name='info_clan', description='Ver información detallada de un clan')
-@app_commands.describe(nombre='Nombre del clan')
-async def info_clan(interaction: discord.Interaction, nombre: str):
-    """Mostrar información detallada de un clan (SIN invitación)"""
-
-    if not clan_existe(nombre):
-        await interaction.response.send_message(
-            f"❌ El clan '{nombre}' no existe.",
-            ephemeral=True
+def firma_panel_clan(guild: discord.Guild):
+    """Lo que los paneles de clan toman de Discord y del reloj, para validar la caché de embeds"""
+    def firma(contexto: dict):
+        clan_role = guild.get_role(contexto['rol_id'])
+        return (
+            clan_role.color.value if clan_role else None,
+            guild.get_member(contexto['creador']) is not None,
+            datetime.utcnow().date()
         )
-        return
+    return firma
+
+def construir_embed_info_clan(guild: discord.Guild, nombre: str):
+    """Embed de /info_clan y los datos que usa su firma, o None si el clan no existe"""
+    clan_info = obtener_clan(guild.id, nombre)
+    if not clan_info:
+        return None
 
-    clan_info = obtener_clan(nombre)
-    miembros = obtener_miembros_clan(nombre)
+    miembros = obtener_miembros_clan(guild.id, nombre)
     nivel_config = NIVELES_CLAN[clan_info['nivel']]
 
     # Creador
-    creador = interaction.guild.get_member(clan_info['creador'])
+    creador = guild.get_member(clan_info['creador'])
     creador_str = creador.mention if creador else "Desconocido"
 
     # Rol del clan
-    clan_role = interaction.guild.get_role(clan_info['rol_id'])
+    clan_role = guild.get_role(clan_info['rol_id'])
 
     embed = discord.Embed(
         title=f"🏰 {nombre}",
@@ -693,8 +1013,8 @@ async def info_clan(interaction: discord.Interaction, nombre: str):
     )
 
     # Canales
-    canales_texto_usados = contar_canales_extra(nombre, 'texto')
-    canales_voz_usados = contar_canales_extra(nombre, 'voz')
+    canales_texto_usados = contar_canales_extra(guild.id, nombre, 'texto')
+    canales_voz_usados = contar_canales_extra(guild.id, nombre, 'voz')
 
     embed.add_field(
         name="📁 Canales",
@@ -707,8 +1027,88 @@ async def info_clan(interaction: discord.Interaction, nombre: str):
     fecha = datetime.fromisoformat(clan_info['fecha_creacion'])
     embed.set_footer(text=f"Creado el {fecha.strftime('%d/%m/%Y')}")
 
+    return embed, {'rol_id': clan_info['rol_id'], 'creador': clan_info['creador']}
+
+@bot.tree.command(name='info_clan', description='Ver información detallada de un clan')
+@app_commands.describe(nombre='Nombre del clan')
+@medido('comando')
+@con_plazo()
+async def info_clan(interaction: discord.Interaction, nombre: str):
+    """Mostrar información detallada de un clan (SIN invitación)"""
+
+    embed = await reparto_guilds.en_hilo(
+        interaction.guild.id, cache_embeds.obtener,
+        'info', interaction.guild.id, nombre,
+        lambda: construir_embed_info_clan(interaction.guild, nombre),
+        firma_panel_clan(interaction.guild)
+    )
+
+    if embed is None:
+        await interaction.response.send_message(
+            f"❌ El clan '{nombre}' no existe.",
+            ephemeral=True
+        )
+        return
+
     await interaction.response.send_message(embed=embed)
 
+def crear_embed_invitacion(invitador: discord.abc.User, clan: str, clan_info: dict, rol: str) -> discord.Embed:
+    """Embed del DM de invitación a un clan"""
+    embed = discord.Embed(
+        title="🏰 Invitación a Clan",
+        description=f"{invitador.mention} te ha invitado a unirte al clan **{clan}**",
+        color=0x00ff00
+    )
+
+    embed.add_field(
+        name="📋 Información del Clan",
+        value=f"**Nivel:** {clan_info['nivel']} ({'⭐' * clan_info['nivel']})\n"
+              f"**Miembros:** {clan_info['total_miembros']}/{clan_info['limite_miembros']}\n"
+              f"**Descripción:** {clan_info['descripcion'] or 'Sin descripción'}",
+        inline=False
+    )
+
+    embed.add_field(
+        name="🎭 Rol que recibirás",
+        value=rol,
+        inline=True
+    )
+
+    embed.add_field(
+        name="⏰ Expiración",
+        value="48 horas",
+        inline=True
+    )
+
+    return embed
+
+async def enviar_dms_invitacion(envios: list, embed: discord.Embed,
+                                max_concurrentes: int = 5) -> dict:
+    """
+    Enviar DMs de invitación en paralelo con concurrencia acotada y respetando limitador_dm.
+    envios: [(discord.Member, invitacion_id)]
+
+    Returns:
+        {'enviados': [(member, invitacion_id, mensaje_id)], 'dm_cerrados': [member], 'errores': [member]}
+    """
+    semaforo = asyncio.Semaphore(max_concurrentes)
+    resultado = {'enviados': [], 'dm_cerrados': [], 'errores': []}
+
+    async def enviar(member, invitacion_id):
+        async with semaforo:
+            await limitador_dm.esperar()
+            try:
+                mensaje = await member.send(embed=embed, view=crear_vista_invitacion(invitacion_id))
+                resultado['enviados'].append((member, invitacion_id, mensaje.id))
+            except discord.Forbidden:
+                resultado['dm_cerrados'].append((member, invitacion_id))
+            except discord.HTTPException as e:
+                logger.warning(f"Error al enviar invitación a {member.name}: {e}")
+                resultado['errores'].append((member, invitacion_id))
+
+    await asyncio.gather(*(enviar(member, invitacion_id) for member, invitacion_id in envios))
+    return resultado
+
 @bot.tree.command(name='invitar_clan', description='Invitar a alguien a tu clan')
 @app_commands.describe(
     usuario='Usuario a invitar',
@@ -719,11 +1119,14 @@ async def info_clan(interaction: discord.Interaction, nombre: str):
     app_commands.Choice(name='Recluta', value='Recluta'),
     app_commands.Choice(name='Miembro', value='Miembro'),
 ])
+@medido('comando')
+@con_plazo(efimero=True)
 async def invitar_clan(interaction: discord.Interaction, usuario: discord.Member, clan: str, rol: app_commands.Choice[str]):
     """Invitar a un usuario al clan mediante DM"""
+    guild_id = interaction.guild.id
 
     # Validaciones
-    if not clan_existe(clan):
+    if not await reparto_guilds.en_hilo(guild_id, clan_en_servidor, clan, interaction.guild):
         await interaction.response.send_message(
             f"❌ El clan '{clan}' no existe.",
             ephemeral=True
@@ -731,7 +1134,7 @@ async def invitar_clan(interaction: discord.Interaction, usuario: discord.Member
         return
 
     # Verificar que quien invita es Líder o Co-Líder
-    rol_invitador = obtener_rol_miembro(clan, interaction.user.id)
+    rol_invitador = await reparto_guilds.en_hilo(guild_id, obtener_rol_miembro, guild_id, clan, interaction.user.id)
     if rol_invitador not in ['Líder', 'Co-Líder']:
         await interaction.response.send_message(
             "❌ Solo Líderes y Co-Líderes pueden invitar miembros.",
@@ -740,7 +1143,7 @@ async def invitar_clan(interaction: discord.Interaction, usuario: discord.Member
         return
 
     # Verificar que el usuario no esté en el clan
-    if es_miembro_clan(clan, usuario.id):
+    if await reparto_guilds.en_hilo(guild_id, es_miembro_clan, guild_id, clan, usuario.id):
         await interaction.response.send_message(
             f"❌ {usuario.mention} ya es miembro del clan.",
             ephemeral=True
@@ -748,7 +1151,7 @@ async def invitar_clan(interaction: discord.Interaction, usuario: discord.Member
         return
 
     # Verificar límite de miembros
-    clan_info = obtener_clan(clan)
+    clan_info = await reparto_guilds.en_hilo(guild_id, obtener_clan, guild_id, clan)
     if clan_info['total_miembros'] >= clan_info['limite_miembros']:
         await interaction.response.send_message(
             f"❌ El clan ha alcanzado su límite de {clan_info['limite_miembros']} miembros.\n"
@@ -760,7 +1163,9 @@ async def invitar_clan(interaction: discord.Interaction, usuario: discord.Member
     await interaction.response.defer(ephemeral=True)
 
     # Crear invitación en DB
-    invitacion_id = crear_invitacion(
+    invitacion = await reparto_guilds.en_hilo(
+        guild_id, crear_invitacion,
+        guild_id=guild_id,
         clan_nombre=clan,
         usuario_invitado_id=usuario.id,
         usuario_que_invita_id=interaction.user.id,
@@ -768,54 +1173,175 @@ async def invitar_clan(interaction: discord.Interaction, usuario: discord.Member
         horas_expiracion=48
     )
 
-    if not invitacion_id:
+    if not invitacion:
         await interaction.followup.send(
             "❌ Error al crear la invitación.",
             ephemeral=True
         )
         return
 
+    invitacion_id, fecha_expiracion = invitacion
+
     # Enviar DM al usuario
     try:
-        embed = discord.Embed(
-            title="🏰 Invitación a Clan",
-            description=f"{interaction.user.mention} te ha invitado a unirte al clan **{clan}**",
-            color=0x00ff00
+        embed = crear_embed_invitacion(interaction.user, clan, clan_info, rol.value)
+
+        mensaje_dm = await usuario.send(embed=embed, view=crear_vista_invitacion(invitacion_id))
+
+        await reparto_guilds.en_hilo(guild_id, guardar_mensaje_invitacion, invitacion_id, mensaje_dm.id)
+        programador_expiraciones.programar(invitacion_id, fecha_expiracion)
+
+        await interaction.followup.send(
+            f"✅ Invitación enviada a {usuario.mention}",
+            ephemeral=True
         )
 
-        embed.add_field(
-            name="📋 Información del Clan",
-            value=f"**Nivel:** {clan_info['nivel']} ({'⭐' * clan_info['nivel']})\n"
-                  f"**Miembros:** {clan_info['total_miembros']}/{clan_info['limite_miembros']}\n"
-                  f"**Descripción:** {clan_info['descripcion'] or 'Sin descripción'}",
-            inline=False
+    except discord.Forbidden:
+        await interaction.followup.send(
+            f"❌ No pude enviar DM a {usuario.mention}. Sus DMs están cerrados.",
+            ephemeral=True
         )
 
-        embed.add_field(
-            name="🎭 Rol que recibirás",
-            value=rol.value,
-            inline=True
+@bot.tree.command(name='invitar_varios', description='Invitar a varios usuarios a tu clan a la vez')
+@app_commands.describe(
+    clan='Nombre del clan',
+    rol='Rol que tendrán en el clan',
+    rol_discord='Invitar a todos los que tengan este rol del servidor',
+    usuarios='Menciones o IDs de usuarios separados por espacios'
+)
+@app_commands.choices(rol=[
+    app_commands.Choice(name='Recluta', value='Recluta'),
+    app_commands.Choice(name='Miembro', value='Miembro'),
+])
+@medido('comando')
+@con_plazo(efimero=True)
+async def invitar_varios(interaction: discord.Interaction, clan: str, rol: app_commands.Choice[str],
+                         rol_discord: discord.Role = None, usuarios: str = None):
+    """Invitar a muchos usuarios al clan mediante DM"""
+    guild_id = interaction.guild.id
+
+    clan_info = await reparto_guilds.en_hilo(guild_id, obtener_clan, guild_id, clan)
+    if not clan_info:
+        await interaction.response.send_message(
+            f"❌ El clan '{clan}' no existe.",
+            ephemeral=True
         )
+        return
 
-        embed.add_field(
-            name="⏰ Expiración",
-            value="48 horas",
-            inline=True
+    # Verificar que quien invita es Líder o Co-Líder
+    rol_invitador = await reparto_guilds.en_hilo(guild_id, obtener_rol_miembro, guild_id, clan, interaction.user.id)
+    if rol_invitador not in ['Líder', 'Co-Líder']:
+        await interaction.response.send_message(
+            "❌ Solo Líderes y Co-Líderes pueden invitar miembros.",
+            ephemeral=True
         )
+        return
 
-        view = InvitacionView(invitacion_id)
-        await usuario.send(embed=embed, view=view)
+    if not rol_discord and not usuarios:
+        await interaction.response.send_message(
+            "❌ Indica un rol del servidor o una lista de usuarios.",
+            ephemeral=True
+        )
+        return
+
+    await interaction.response.defer(ephemeral=True)
 
+    # Reunir candidatos
+    candidatos = {}
+    if rol_discord:
+        for member in rol_discord.members:
+            candidatos[member.id] = member
+    if usuarios:
+        for token in usuarios.replace(',', ' ').split():
+            usuario_id = token.strip('<@!>')
+            if usuario_id.isdigit():
+                member = interaction.guild.get_member(int(usuario_id))
+                if member:
+                    candidatos[member.id] = member
+
+    # Descartar bots, miembros actuales e invitaciones ya pendientes (en un solo viaje al hilo)
+    def descartar(candidatos: dict) -> list:
+        pendientes = obtener_invitados_pendientes(guild_id, clan)
+        return [
+            m for uid, m in candidatos.items()
+            if not m.bot and clan not in obtener_clanes_usuario(guild_id, uid) and uid not in pendientes
+        ]
+
+    candidatos = await reparto_guilds.en_hilo(guild_id, descartar, candidatos)
+
+    cupo = clan_info['limite_miembros'] - clan_info['total_miembros']
+    if cupo <= 0:
         await interaction.followup.send(
-            f"✅ Invitación enviada a {usuario.mention}",
+            f"❌ El clan ha alcanzado su límite de {clan_info['limite_miembros']} miembros.",
             ephemeral=True
         )
+        return
 
-    except discord.Forbidden:
+    omitidos_por_cupo = max(len(candidatos) - cupo, 0)
+    candidatos = candidatos[:min(cupo, MAX_INVITACIONES_LOTE)]
+
+    if not candidatos:
         await interaction.followup.send(
-            f"❌ No pude enviar DM a {usuario.mention}. Sus DMs están cerrados.",
+            "❌ No hay usuarios para invitar (ya son miembros o tienen una invitación pendiente).",
+            ephemeral=True
+        )
+        return
+
+    # Crear todas las invitaciones en una transacción
+    invitaciones, fecha_expiracion = await reparto_guilds.en_hilo(
+        guild_id, crear_invitaciones,
+        guild_id=guild_id,
+        clan_nombre=clan,
+        usuarios_invitados=[m.id for m in candidatos],
+        usuario_que_invita_id=interaction.user.id,
+        rol_asignado=rol.value,
+        horas_expiracion=48
+    )
+
+    if not invitaciones:
+        await interaction.followup.send(
+            "❌ Error al crear las invitaciones.",
             ephemeral=True
         )
+        return
+
+    embed = crear_embed_invitacion(interaction.user, clan, clan_info, rol.value)
+    resultado = await enviar_dms_invitacion(
+        [(m, invitaciones[m.id]) for m in candidatos if m.id in invitaciones],
+        embed
+    )
+
+    # Registrar mensajes enviados y cancelar las invitaciones que no llegaron
+    await reparto_guilds.en_hilo(
+        guild_id, guardar_mensajes_invitacion, [(inv_id, msg_id) for _, inv_id, msg_id in resultado['enviados']]
+    )
+    await reparto_guilds.en_hilo(
+        guild_id, cancelar_invitaciones, [inv_id for _, inv_id in resultado['dm_cerrados'] + resultado['errores']]
+    )
+
+    for _, invitacion_id, _ in resultado['enviados']:
+        programador_expiraciones.programar(invitacion_id, fecha_expiracion)
+
+    embed_resumen = discord.Embed(
+        title="📨 Invitaciones enviadas",
+        description=f"Clan **{clan}** · Rol {rol.value}",
+        color=0x00ff00
+    )
+    embed_resumen.add_field(name="✅ Enviadas", value=str(len(resultado['enviados'])), inline=True)
+    embed_resumen.add_field(name="🔒 DMs cerrados", value=str(len(resultado['dm_cerrados'])), inline=True)
+    embed_resumen.add_field(name="⚠️ Errores", value=str(len(resultado['errores'])), inline=True)
+
+    if resultado['dm_cerrados']:
+        embed_resumen.add_field(
+            name="Sin DM",
+            value=' '.join(m.mention for m, _ in resultado['dm_cerrados'][:30]),
+            inline=False
+        )
+
+    if omitidos_por_cupo:
+        embed_resumen.set_footer(text=f"{omitidos_por_cupo} usuarios omitidos por el límite de miembros")
+
+    await interaction.followup.send(embed=embed_resumen, ephemeral=True)
 
 # ==================== COMANDOS DE ADMINISTRACIÓN DEL CLAN ====================
 
@@ -828,11 +1354,14 @@ async def invitar_clan(interaction: discord.Interaction, usuario: discord.Member
     app_commands.Choice(name='💬 Texto', value='texto'),
     app_commands.Choice(name='🔊 Voz', value='voz'),
 ])
+@medido('comando')
+@con_plazo()
 async def agregar_canal(interaction: discord.Interaction, tipo: app_commands.Choice[str], nombre: str):
     """Agregar un canal de texto o voz al clan"""
+    guild_id = interaction.guild.id
 
     # Verificar que se use en un canal de administración
-    clan_nombre = obtener_clan_por_canal_admin(interaction.channel.id)
+    clan_nombre = await reparto_guilds.en_hilo(guild_id, obtener_clan_por_canal_admin, guild_id, interaction.channel.id)
 
     if not clan_nombre:
         await interaction.response.send_message(
@@ -842,7 +1371,7 @@ async def agregar_canal(interaction: discord.Interaction, tipo: app_commands.Cho
         return
 
     # Verificar permisos
-    rol_usuario = obtener_rol_miembro(clan_nombre, interaction.user.id)
+    rol_usuario = await reparto_guilds.en_hilo(guild_id, obtener_rol_miembro, guild_id, clan_nombre, interaction.user.id)
     if rol_usuario not in ['Líder', 'Co-Líder'] and not interaction.user.guild_permissions.administrator:
         await interaction.response.send_message(
             "❌ Solo Líderes, Co-Líderes o Administradores pueden agregar canales.",
@@ -851,8 +1380,8 @@ async def agregar_canal(interaction: discord.Interaction, tipo: app_commands.Cho
         return
 
     # Verificar límite de canales según nivel
-    clan_info = obtener_clan(clan_nombre)
-    canales_usados = contar_canales_extra(clan_nombre, tipo.value)
+    clan_info = await reparto_guilds.en_hilo(guild_id, obtener_clan, guild_id, clan_nombre)
+    canales_usados = await reparto_guilds.en_hilo(guild_id, contar_canales_extra, guild_id, clan_nombre, tipo.value)
 
     limite = clan_info[f'limite_canales_{tipo.value}']
 
@@ -894,7 +1423,7 @@ async def agregar_canal(interaction: discord.Interaction, tipo: app_commands.Cho
             )
 
         # Guardar en DB
-        agregar_canal_extra(clan_nombre, nuevo_canal.id, nombre, tipo.value)
+        await reparto_guilds.en_hilo(guild_id, agregar_canal_extra, guild_id, clan_nombre, nuevo_canal.id, nombre, tipo.value)
 
         await interaction.followup.send(
             f"✅ Canal {tipo.name} **{nombre}** creado: {nuevo_canal.mention if tipo.value == 'texto' else nuevo_canal.name}\n"
@@ -907,21 +1436,12 @@ async def agregar_canal(interaction: discord.Interaction, tipo: app_commands.Cho
             f"❌ Error al crear el canal: {str(e)}"
         )
 
-@bot.tree.command(name='stats_clan', description='Ver estadísticas del clan')
-async def stats_clan(interaction: discord.Interaction):
-    """Ver estadísticas y progreso del clan"""
-
-    # Verificar que se use en un canal del clan
-    clan_nombre = obtener_clan_por_canal_admin(interaction.channel.id)
-
-    if not clan_nombre:
-        await interaction.response.send_message(
-            "❌ Este comando solo se puede usar en canales del clan.",
-            ephemeral=True
-        )
-        return
+def construir_embed_stats_clan(guild_id: int, clan_nombre: str):
+    """Embed de /stats_clan (su firma solo depende del día), o None si el clan no existe"""
+    clan_info = obtener_clan(guild_id, clan_nombre)
+    if not clan_info:
+        return None
 
-    clan_info = obtener_clan(clan_nombre)
     nivel_config = NIVELES_CLAN[clan_info['nivel']]
 
     embed = discord.Embed(
@@ -957,9 +1477,16 @@ async def stats_clan(interaction: discord.Interaction):
         inline=True
     )
 
+    # Actividad reciente
+    embed.add_field(
+        name="📈 XP últimos 7 días",
+        value=f"{obtener_xp_ganada(guild_id, clan_nombre, 7)} XP",
+        inline=True
+    )
+
     # Canales
-    canales_texto = contar_canales_extra(clan_nombre, 'texto')
-    canales_voz = contar_canales_extra(clan_nombre, 'voz')
+    canales_texto = contar_canales_extra(guild_id, clan_nombre, 'texto')
+    canales_voz = contar_canales_extra(guild_id, clan_nombre, 'voz')
 
     embed.add_field(
         name="📁 Canales",
@@ -979,14 +1506,212 @@ async def stats_clan(interaction: discord.Interaction):
             inline=False
         )
 
+    return embed, {}
+
+@bot.tree.command(name='stats_clan', description='Ver estadísticas del clan')
+@medido('comando')
+@con_plazo()
+async def stats_clan(interaction: discord.Interaction):
+    """Ver estadísticas y progreso del clan"""
+    guild_id = interaction.guild.id
+
+    # Verificar que se use en un canal del clan, o resolver el clan del usuario
+    clan_nombre = await reparto_guilds.en_hilo(guild_id, obtener_clan_por_canal_admin, guild_id, interaction.channel.id) \
+        or await reparto_guilds.en_hilo(guild_id, obtener_clan_usuario, guild_id, interaction.user.id)
+
+    if not clan_nombre:
+        await interaction.response.send_message(
+            "❌ Este comando solo se puede usar en canales del clan o siendo miembro de un clan.",
+            ephemeral=True
+        )
+        return
+
+    embed = await reparto_guilds.en_hilo(
+        guild_id, cache_embeds.obtener,
+        'stats', guild_id, clan_nombre,
+        lambda: construir_embed_stats_clan(guild_id, clan_nombre),
+        lambda contexto: datetime.utcnow().date()
+    )
+
+    await interaction.response.send_message(embed=embed)
+
+def construir_panel_clan(guild_id: int, clan_nombre: str):
+    """Embed del panel en vivo: las estadísticas del clan (desde la caché de embeds) con la hora de actualización"""
+    embed = cache_embeds.obtener(
+        'stats', guild_id, clan_nombre,
+        lambda: construir_embed_stats_clan(guild_id, clan_nombre),
+        lambda contexto: datetime.utcnow().date()
+    )
+    if embed is None:
+        return None
+
+    embed.title = f"📌 Panel de {clan_nombre}"
+    embed.set_footer(text=f"Se actualiza solo · Última actualización: {datetime.now().strftime('%d/%m/%Y %H:%M')}")
+    return embed
+
+paneles_clanes = PanelesClanes(bot.get_channel, construir_panel_clan)
+
+@bot.tree.command(name='panel_clan', description='Publicar el panel en vivo del clan en este canal')
+@medido('comando')
+@con_plazo(efimero=True)
+async def panel_clan(interaction: discord.Interaction):
+    """Publicar (o volver a publicar) el panel fijado que se actualiza solo"""
+    guild_id = interaction.guild.id
+
+    clan_nombre = await reparto_guilds.en_hilo(guild_id, obtener_clan_por_canal_admin, guild_id, interaction.channel.id)
+
+    if not clan_nombre:
+        await interaction.response.send_message(
+            "❌ Este comando solo se puede usar en el canal de administración.",
+            ephemeral=True
+        )
+        return
+
+    rol_usuario = await reparto_guilds.en_hilo(guild_id, obtener_rol_miembro, guild_id, clan_nombre, interaction.user.id)
+    if rol_usuario not in ['Líder', 'Co-Líder'] and not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message(
+            "❌ Solo Líder, Co-Líder o Administradores pueden publicar el panel.",
+            ephemeral=True
+        )
+        return
+
+    await interaction.response.defer(ephemeral=True)
+    mensaje = await paneles_clanes.publicar(clan_nombre, interaction.channel)
+
+    await interaction.followup.send(
+        "✅ Panel publicado y fijado. Se actualizará solo con la XP, los miembros y los canales del clan."
+        if mensaje else "❌ No se pudo publicar el panel.",
+        ephemeral=True
+    )
+
+NOMBRES_PERIODO = {'dia': 'últimas 24 horas', 'semana': 'últimos 7 días', 'mes': 'últimos 30 días'}
+
+@bot.tree.command(name='xp_historial', description='Ver la XP ganada por un clan en el tiempo')
+@app_commands.describe(
+    periodo='Periodo a mostrar',
+    clan='Nombre del clan (opcional si eres miembro de uno)'
+)
+@app_commands.choices(periodo=[
+    app_commands.Choice(name='Últimas 24 horas', value='dia'),
+    app_commands.Choice(name='Últimos 7 días', value='semana'),
+    app_commands.Choice(name='Últimos 30 días', value='mes'),
+])
+@medido('comando')
+@con_plazo()
+async def xp_historial(interaction: discord.Interaction, periodo: app_commands.Choice[str], clan: str = None):
+    """Gráfico de XP por hora o por día de un clan"""
+    guild_id = interaction.guild.id
+
+    clan_nombre = clan or await reparto_guilds.en_hilo(guild_id, obtener_clan_por_canal_admin, guild_id, interaction.channel.id) \
+        or await reparto_guilds.en_hilo(guild_id, obtener_clan_usuario, guild_id, interaction.user.id)
+
+    if not clan_nombre or not await reparto_guilds.en_hilo(guild_id, clan_en_servidor, clan_nombre, interaction.guild):
+        await interaction.response.send_message(
+            "❌ Indica un clan existente o usa el comando siendo miembro de un clan.",
+            ephemeral=True
+        )
+        return
+
+    grafico = await reparto_guilds.en_hilo(guild_id, graficos_xp.grafico_xp, guild_id, clan_nombre, periodo.value)
+    serie = grafico['serie']
+
+    embed = discord.Embed(
+        title=f"📈 XP de {clan_nombre}",
+        description=f"**{NOMBRES_PERIODO[periodo.value]}:** {grafico['total']} XP\n"
+                    f"`{grafico['sparkline']}`",
+        color=0x0099ff
+    )
+    if serie:
+        embed.add_field(name="Desde", value=serie[0][0], inline=True)
+        embed.add_field(name="Máximo por bucket", value=f"{grafico['maximo']} XP", inline=True)
+        embed.add_field(
+            name="Promedio",
+            value=f"{grafico['total'] / len(serie):.0f} XP por {'hora' if periodo.value == 'dia' else 'día'}",
+            inline=True
+        )
+
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name='ranking', description='Ver la clasificación de clanes por nivel y XP')
+@medido('comando')
+@con_plazo()
+async def ranking(interaction: discord.Interaction):
+    """Top 10 de clanes y la posición del clan del usuario"""
+    guild_id = interaction.guild.id
+
+    top = await reparto_guilds.en_hilo(guild_id, obtener_top_clanes, 10, guild_id)
+
+    if not top:
+        await interaction.response.send_message(
+            "📭 Todavía no hay clanes en la clasificación.",
+            ephemeral=True
+        )
+        return
+
+    medallas = ['🥇', '🥈', '🥉']
+    lineas = []
+    for c in top:
+        puesto = medallas[c['posicion'] - 1] if c['posicion'] <= 3 else f"**{c['posicion']}.**"
+        lineas.append(f"{puesto} {c['nombre']} — Nivel {c['nivel']} ({c['xp']} XP)")
+
+    embed = discord.Embed(
+        title="🏆 Clasificación de clanes",
+        description='\n'.join(lineas),
+        color=0xffd700
+    )
+
+    clan_usuario = await reparto_guilds.en_hilo(guild_id, obtener_clan_usuario, guild_id, interaction.user.id)
+    if clan_usuario and all(c['nombre'] != clan_usuario for c in top):
+        posicion = await reparto_guilds.en_hilo(guild_id, obtener_posicion_clan, guild_id, clan_usuario)
+        if posicion:
+            embed.add_field(name="Tu clan", value=f"**{clan_usuario}** está en el puesto #{posicion}", inline=False)
+
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name='ranking_crecimiento', description='Clanes que más XP ganaron recientemente')
+@app_commands.describe(periodo='Periodo a comparar')
+@app_commands.choices(periodo=[
+    app_commands.Choice(name='Hoy', value=0),
+    app_commands.Choice(name='Últimos 7 días', value=7),
+    app_commands.Choice(name='Últimos 30 días', value=30),
+])
+@medido('comando')
+@con_plazo()
+async def ranking_crecimiento(interaction: discord.Interaction, periodo: app_commands.Choice[int]):
+    """Top 10 de clanes por XP ganada en el periodo"""
+    guild_id = interaction.guild.id
+
+    ranking = await reparto_guilds.en_hilo(guild_id, obtener_ranking_crecimiento, guild_id, periodo.value, limite=10)
+
+    if not ranking:
+        await interaction.response.send_message(
+            "📭 Ningún clan ganó XP en este periodo.",
+            ephemeral=True
+        )
+        return
+
+    medallas = ['🥇', '🥈', '🥉']
+    lineas = [
+        f"{medallas[i] if i < 3 else f'**{i + 1}.**'} {nombre} — +{xp} XP"
+        for i, (nombre, xp) in enumerate(ranking)
+    ]
+
+    embed = discord.Embed(
+        title=f"🚀 Crecimiento de clanes ({periodo.name.lower()})",
+        description='\n'.join(lineas),
+        color=0x00ff00
+    )
     await interaction.response.send_message(embed=embed)
 
 @bot.tree.command(name='gestionar_miembros', description='Ver y gestionar miembros del clan')
+@medido('comando')
+@con_plazo()
 async def gestionar_miembros(interaction: discord.Interaction):
     """Ver lista de miembros del clan con sus roles"""
+    guild_id = interaction.guild.id
 
     # Verificar que se use en canal de admin
-    clan_nombre = obtener_clan_por_canal_admin(interaction.channel.id)
+    clan_nombre = await reparto_guilds.en_hilo(guild_id, obtener_clan_por_canal_admin, guild_id, interaction.channel.id)
 
     if not clan_nombre:
         await interaction.response.send_message(
@@ -996,7 +1721,7 @@ async def gestionar_miembros(interaction: discord.Interaction):
         return
 
     # Verificar permisos
-    rol_usuario = obtener_rol_miembro(clan_nombre, interaction.user.id)
+    rol_usuario = await reparto_guilds.en_hilo(guild_id, obtener_rol_miembro, guild_id, clan_nombre, interaction.user.id)
     if rol_usuario not in ['Líder', 'Co-Líder'] and not interaction.user.guild_permissions.administrator:
         await interaction.response.send_message(
             "❌ Solo Líderes y Co-Líderes pueden gestionar miembros.",
@@ -1004,7 +1729,7 @@ async def gestionar_miembros(interaction: discord.Interaction):
         )
         return
 
-    miembros = obtener_miembros_clan(clan_nombre)
+    miembros = await reparto_guilds.en_hilo(guild_id, obtener_miembros_clan, guild_id, clan_nombre)
 
     if not miembros:
         await interaction.response.send_message(
@@ -1038,12 +1763,179 @@ async def gestionar_miembros(interaction: discord.Interaction):
 
     await interaction.response.send_message(embed=embed)
 
+@bot.tree.command(name='expulsar_miembro', description='Expulsar a un miembro del clan')
+@app_commands.describe(usuario='Miembro a expulsar')
+@medido('comando')
+@con_plazo()
+async def expulsar_miembro(interaction: discord.Interaction, usuario: discord.Member):
+    """Expulsar a un miembro del clan y quitarle el rol"""
+    guild_id = interaction.guild.id
+
+    # Verificar que se use en canal de admin
+    clan_nombre = await reparto_guilds.en_hilo(guild_id, obtener_clan_por_canal_admin, guild_id, interaction.channel.id)
+
+    if not clan_nombre:
+        await interaction.response.send_message(
+            "❌ Este comando solo se puede usar en el canal de administración.",
+            ephemeral=True
+        )
+        return
+
+    # Verificar permisos
+    rol_usuario = await reparto_guilds.en_hilo(guild_id, obtener_rol_miembro, guild_id, clan_nombre, interaction.user.id)
+    if rol_usuario not in ['Líder', 'Co-Líder'] and not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message(
+            "❌ Solo Líderes y Co-Líderes pueden expulsar miembros.",
+            ephemeral=True
+        )
+        return
+
+    rol_objetivo = await reparto_guilds.en_hilo(guild_id, obtener_rol_miembro, guild_id, clan_nombre, usuario.id)
+    if not rol_objetivo:
+        await interaction.response.send_message(
+            f"❌ {usuario.mention} no es miembro del clan.",
+            ephemeral=True
+        )
+        return
+
+    # Nadie expulsa al Líder, y un Co-Líder no expulsa a otro Co-Líder
+    if rol_objetivo == 'Líder' or (rol_objetivo == 'Co-Líder' and rol_usuario == 'Co-Líder'):
+        await interaction.response.send_message(
+            f"❌ No puedes expulsar a un {rol_objetivo}.",
+            ephemeral=True
+        )
+        return
+
+    if not await reparto_guilds.en_hilo(guild_id, remover_miembro_clan, guild_id, clan_nombre, usuario.id):
+        await interaction.response.send_message(
+            "❌ Error al expulsar al miembro.",
+            ephemeral=True
+        )
+        return
+
+    clan_info = await reparto_guilds.en_hilo(guild_id, obtener_clan, guild_id, clan_nombre)
+    clan_role = interaction.guild.get_role(clan_info['rol_id'])
+    if clan_role:
+        try:
+            await usuario.remove_roles(clan_role)
+        except discord.Forbidden:
+            logger.warning(f"No se pudo quitar el rol del clan {clan_nombre} a {usuario.name}")
+
+    await interaction.response.send_message(
+        f"✅ {usuario.mention} fue expulsado del clan.\n"
+        f"Miembros: {clan_info['total_miembros']}/{clan_info['limite_miembros']}"
+    )
+
+@bot.tree.command(name='salir_clan', description='Salir de un clan')
+@app_commands.describe(clan='Nombre del clan (opcional si solo estás en uno)')
+@medido('comando')
+@con_plazo()
+async def salir_clan(interaction: discord.Interaction, clan: str = None):
+    """Salir voluntariamente de un clan"""
+    guild_id = interaction.guild.id
+
+    clan_nombre = clan or await reparto_guilds.en_hilo(guild_id, obtener_clan_usuario, guild_id, interaction.user.id)
+
+    if not clan_nombre or not await reparto_guilds.en_hilo(guild_id, es_miembro_clan, guild_id, clan_nombre, interaction.user.id):
+        await interaction.response.send_message(
+            "❌ No eres miembro de ese clan. Indica el nombre del clan.",
+            ephemeral=True
+        )
+        return
+
+    if await reparto_guilds.en_hilo(guild_id, obtener_rol_miembro, guild_id, clan_nombre, interaction.user.id) == 'Líder':
+        await interaction.response.send_message(
+            "❌ El Líder no puede abandonar su clan.",
+            ephemeral=True
+        )
+        return
+
+    if not await reparto_guilds.en_hilo(guild_id, remover_miembro_clan, guild_id, clan_nombre, interaction.user.id):
+        await interaction.response.send_message(
+            "❌ Error al salir del clan.",
+            ephemeral=True
+        )
+        return
+
+    clan_info = await reparto_guilds.en_hilo(guild_id, obtener_clan, guild_id, clan_nombre)
+    clan_role = interaction.guild.get_role(clan_info['rol_id']) if interaction.guild else None
+    if clan_role:
+        try:
+            await interaction.user.remove_roles(clan_role)
+        except discord.Forbidden:
+            logger.warning(f"No se pudo quitar el rol del clan {clan_nombre} a {interaction.user.name}")
+
+    await interaction.response.send_message(
+        f"✅ Has salido del clan **{clan_nombre}**.",
+        ephemeral=True
+    )
+
+@bot.tree.command(name='reconciliar_clanes', description='Sincronizar roles, canales y miembros de los clanes con Discord')
+@medido('comando')
+async def reconciliar_clanes(interaction: discord.Interaction):
+    """Reconciliación completa del servidor (solo administradores)"""
+
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message(
+            "❌ Solo los Administradores del servidor pueden usar este comando.",
+            ephemeral=True
+        )
+        return
+
+    await interaction.response.defer(ephemeral=True)
+
+    reporte = await reconciliar_guild(interaction.guild, aplicar_api=True)
+
+    if not reporte:
+        await interaction.followup.send(
+            "❌ No se pudo completar la reconciliación (¿miembros del servidor aún sin cargar?).",
+            ephemeral=True
+        )
+        return
+
+    embed = discord.Embed(
+        title="🔄 Reconciliación completada",
+        description=f"{reporte['clanes']} clanes, {reporte['miembros_revisados']} miembros revisados",
+        color=0x00ff00
+    )
+    embed.add_field(
+        name="👥 Membresías",
+        value=f"Bajas: {reporte['bajas']}\nAltas: {reporte['altas']}",
+        inline=True
+    )
+    embed.add_field(
+        name="📁 Canales",
+        value=f"Eliminados: {reporte['canales_eliminados']}\nRegistrados: {reporte['canales_registrados']}",
+        inline=True
+    )
+    embed.add_field(
+        name="🎭 Roles",
+        value=f"Recreados: {reporte['roles_recreados']}",
+        inline=True
+    )
+
+    if reporte['roles_faltantes'] or reporte['canales_faltantes']:
+        pendientes = [f"Rol de **{n}**" for n in reporte['roles_faltantes']]
+        pendientes += [f"Canal {c} de **{n}**" for n, c in reporte['canales_faltantes']]
+        embed.add_field(
+            name="⚠️ Requieren revisión manual",
+            value='\n'.join(pendientes[:15]),
+            inline=False
+        )
+
+    embed.set_footer(text=f"Duración: {reporte['duracion']:.1f}s ({reporte['tiempo_cpu']:.2f}s CPU)")
+
+    await interaction.followup.send(embed=embed, ephemeral=True)
+
 @bot.tree.command(name='ver_invitacion', description='Ver la invitación secreta del clan')
+@medido('comando')
+@con_plazo(efimero=True)
 async def ver_invitacion(interaction: discord.Interaction):
     """Mostrar la invitación permanente del clan (solo para Líder y admins)"""
+    guild_id = interaction.guild.id
 
     # Verificar que se use en canal de admin
-    clan_nombre = obtener_clan_por_canal_admin(interaction.channel.id)
+    clan_nombre = await reparto_guilds.en_hilo(guild_id, obtener_clan_por_canal_admin, guild_id, interaction.channel.id)
 
     if not clan_nombre:
         await interaction.response.send_message(
@@ -1053,7 +1945,7 @@ async def ver_invitacion(interaction: discord.Interaction):
         return
 
     # Verificar permisos (solo Líder o Admin servidor)
-    rol_usuario = obtener_rol_miembro(clan_nombre, interaction.user.id)
+    rol_usuario = await reparto_guilds.en_hilo(guild_id, obtener_rol_miembro, guild_id, clan_nombre, interaction.user.id)
     if rol_usuario != 'Líder' and not interaction.user.guild_permissions.administrator:
         await interaction.response.send_message(
             "❌ Solo el Líder del clan o Administradores del servidor pueden ver la invitación.",
@@ -1061,7 +1953,7 @@ async def ver_invitacion(interaction: discord.Interaction):
         )
         return
 
-    clan_info = obtener_clan(clan_nombre)
+    clan_info = await reparto_guilds.en_hilo(guild_id, obtener_clan, guild_id, clan_nombre)
 
     embed = discord.Embed(
         title="🔐 Invitación Secreta del Clan",
@@ -0,0 +1,219 @@
+"""
+Métricas de latencia en proceso: histogramas, conteos y errores por operación.
+Pensado para dejarse activo en producción (un lock y unas sumas por llamada).
+"""
+import asyncio
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Límites superiores de los buckets en milisegundos (el último es +Inf)
+BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf')]
+
+class Histograma:
+    """Histograma de buckets fijos con conteo, suma y errores"""
+
+    __slots__ = ('buckets', 'total', 'suma_ms', 'errores', 'maximo_ms')
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS_MS)
+        self.total = 0
+        self.suma_ms = 0.0
+        self.errores = 0
+        self.maximo_ms = 0.0
+
+    def registrar(self, duracion_ms: float, error: bool = False):
+        self.buckets[bisect_left(BUCKETS_MS, duracion_ms)] += 1
+        self.total += 1
+        self.suma_ms += duracion_ms
+        if duracion_ms > self.maximo_ms:
+            self.maximo_ms = duracion_ms
+        if error:
+            self.errores += 1
+
+    def percentil(self, p: float) -> float:
+        """Estimar el percentil p (0-100) como el límite superior de su bucket"""
+        if not self.total:
+            return 0.0
+
+        objetivo = self.total * p / 100
+        acumulado = 0
+        for limite, cantidad in zip(BUCKETS_MS, self.buckets):
+            acumulado += cantidad
+            if acumulado >= objetivo:
+                return min(limite, self.maximo_ms)
+        return self.maximo_ms
+
+_histogramas: Dict[str, Histograma] = {}
+_contadores: Dict[str, int] = {}
+_lock = threading.Lock()
+
+def registrar(nombre: str, duracion_ms: float, error: bool = False):
+    """Registrar una medición en el histograma `nombre`"""
+    with _lock:
+        histograma = _histogramas.get(nombre)
+        if histograma is None:
+            histograma = _histogramas[nombre] = Histograma()
+        histograma.registrar(duracion_ms, error)
+
+def contar(nombre: str, cantidad: int = 1):
+    """Incrementar un contador simple"""
+    with _lock:
+        _contadores[nombre] = _contadores.get(nombre, 0) + cantidad
+
+def percentil(nombre: str, p: float, minimo: int = 1) -> Optional[float]:
+    """Percentil p del histograma `nombre`, o None si tiene menos de `minimo` mediciones"""
+    with _lock:
+        histograma = _histogramas.get(nombre)
+        if histograma is None or histograma.total < minimo:
+            return None
+        return histograma.percentil(p)
+
+# Estado de la llamada medida en curso ([error]); lo fija medido y lo marca marcar_error
+_llamada_en_curso: contextvars.ContextVar[Optional[List[bool]]] = contextvars.ContextVar(
+    'metricas_llamada_en_curso', default=None
+)
+
+def marcar_error():
+    """
+    Contar como error la llamada medida en curso aunque termine sin excepción: las
+    funciones de database.py atrapan sus errores y devuelven None/False/{}, así que
+    get_db_connection marca aquí las transacciones que deshace.
+    """
+    estado = _llamada_en_curso.get()
+    if estado is not None:
+        estado[0] = True
+
+def medido(prefijo: str, nombre: Optional[str] = None):
+    """
+    Decorador que mide duración y errores de una función (síncrona o async).
+    La métrica se llama '<prefijo>.<nombre de la función>'. Es error si la función
+    lanza una excepción o si algo llama a marcar_error() mientras corre.
+    """
+    def decorador(func):
+        metrica = f"{prefijo}.{nombre or func.__name__}"
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def envoltura_async(*args, **kwargs):
+                inicio = time.perf_counter()
+                estado = [False]
+                token = _llamada_en_curso.set(estado)
+                try:
+                    return await func(*args, **kwargs)
+                except BaseException:
+                    estado[0] = True
+                    raise
+                finally:
+                    _llamada_en_curso.reset(token)
+                    registrar(metrica, (time.perf_counter() - inicio) * 1000, estado[0])
+            return envoltura_async
+
+        @functools.wraps(func)
+        def envoltura(*args, **kwargs):
+            inicio = time.perf_counter()
+            estado = [False]
+            token = _llamada_en_curso.set(estado)
+            try:
+                return func(*args, **kwargs)
+            except BaseException:
+                estado[0] = True
+                raise
+            finally:
+                _llamada_en_curso.reset(token)
+                registrar(metrica, (time.perf_counter() - inicio) * 1000, estado[0])
+        return envoltura
+
+    return decorador
+
+def instantanea() -> Dict[str, Dict]:
+    """Resumen de todas las métricas: {nombre: {total, errores, p50, p95, p99, media, max}}"""
+    with _lock:
+        resumen = {}
+        for nombre, h in _histogramas.items():
+            resumen[nombre] = {
+                'total': h.total,
+                'errores': h.errores,
+                'p50': h.percentil(50),
+                'p95': h.percentil(95),
+                'p99': h.percentil(99),
+                'media': h.suma_ms / h.total if h.total else 0.0,
+                'max': h.maximo_ms
+            }
+        for nombre, valor in _contadores.items():
+            resumen[nombre] = {'total': valor}
+        return resumen
+
+def registrar_resumen(nivel: int = logging.INFO):
+    """Volcar el resumen de métricas al log, de la operación más lenta (p95) a la más rápida"""
+    resumen = instantanea()
+    histogramas = sorted(
+        ((n, m) for n, m in resumen.items() if 'p95' in m),
+        key=lambda item: item[1]['p95'],
+        reverse=True
+    )
+
+    for nombre, m in histogramas:
+        logger.log(
+            nivel,
+            f"{nombre}: n={m['total']} err={m['errores']} "
+            f"p50={m['p50']:.1f}ms p95={m['p95']:.1f}ms p99={m['p99']:.1f}ms max={m['max']:.1f}ms"
+        )
+    for nombre, m in resumen.items():
+        if 'p95' not in m:
+            logger.log(nivel, f"{nombre}: {m['total']}")
+
+def _nombre_prometheus(nombre: str) -> str:
+    return 'clanbot_' + ''.join(c if c.isalnum() else '_' for c in nombre)
+
+def formato_prometheus() -> str:
+    """Exportar las métricas en formato de texto de Prometheus"""
+    lineas: List[str] = []
+    with _lock:
+        for nombre, h in sorted(_histogramas.items()):
+            metrica = _nombre_prometheus(nombre) + '_ms'
+            lineas.append(f"# TYPE {metrica} histogram")
+            acumulado = 0
+            for limite, cantidad in zip(BUCKETS_MS, h.buckets):
+                acumulado += cantidad
+                le = '+Inf' if limite == float('inf') else f"{limite:g}"
+                lineas.append(f'{metrica}_bucket{{le="{le}"}} {acumulado}')
+            lineas.append(f"{metrica}_sum {h.suma_ms:.3f}")
+            lineas.append(f"{metrica}_count {h.total}")
+            lineas.append(f"{_nombre_prometheus(nombre)}_errores_total {h.errores}")
+
+        for nombre, valor in sorted(_contadores.items()):
+            metrica = _nombre_prometheus(nombre) + '_total'
+            lineas.append(f"# TYPE {metrica} counter")
+            lineas.append(f"{metrica} {valor}")
+
+    return '\n'.join(lineas) + '\n'
+
+async def iniciar_servidor_metricas(puerto: int, host: str = '127.0.0.1') -> asyncio.AbstractServer:
+    """Servir /metrics en texto plano de Prometheus (solo escucha en local por defecto)"""
+
+    async def atender(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await reader.readline()
+            cuerpo = formato_prometheus().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(cuerpo)}\r\n".encode()
+                + b"Connection: close\r\n\r\n"
+                + cuerpo
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    servidor = await asyncio.start_server(atender, host, puerto)
+    logger.info(f"Métricas disponibles en http://{host}:{puerto}/metrics")
+    return servidor
@@ -0,0 +1,475 @@
+"""
+Migraciones versionadas del esquema (PRAGMA user_version en SQLite).
+
+Cada migración tiene un número y se aplica una sola vez, en orden. Las que
+reescriben muchas filas se definen por lotes: cada lote va en su propia
+transacción corta y entre lotes se cede el lock de SQLite, así el bot puede
+seguir escribiendo mientras migra. Los lotes deben ser idempotentes: si el
+proceso se corta, la migración se repite desde el principio.
+
+Las migraciones 1 a 7 ponen al día archivos SQLite creados con esquemas
+anteriores; una base nueva (SQLite o PostgreSQL) nace con el esquema actual
+y empieza en la última versión. La 8 (clanes por servidor) y la 9 (sus resúmenes de
+XP) reconstruyen las tablas y corren también en PostgreSQL.
+
+database.init_database aplica las migraciones antes de crear el esquema
+actual: cada migración crea las tablas que introduce con el esquema de su
+versión y nunca encuentra tablas más nuevas que ella.
+
+En SQLite las migraciones corren con las claves foráneas desactivadas, como
+pide el procedimiento de reconstrucción de tablas de SQLite: una tabla nueva
+puede referenciar columnas que la migración todavía no creó.
+"""
+import time
+import logging
+import sqlite3
+from contextlib import AbstractContextManager, contextmanager
+from typing import Callable, List, Optional
+
+from almacenamiento import Almacen
+
+logger = logging.getLogger(__name__)
+
+TAMANO_LOTE = 500
+PAUSA_ENTRE_LOTES = 0.01  # segundos
+
+class Migracion:
+    """
+    Una migración del esquema.
+
+    aplicar(conn): cambios rápidos (DDL) dentro de una transacción.
+    lote(conn, desde, tamano) -> Optional[int]: procesa hasta `tamano` filas con clave > desde
+    y devuelve la última clave procesada, o None cuando no queda nada.
+    finalizar(conn): después de los lotes, en la misma transacción que fija la versión
+    (p. ej. copiar lo escrito mientras corrían los lotes y cambiar las tablas).
+    """
+
+    def __init__(self, version: int, descripcion: str,
+                 aplicar: Callable[[sqlite3.Connection], None] = None,
+                 lote: Callable[[sqlite3.Connection, int, int], Optional[int]] = None,
+                 finalizar: Callable[[sqlite3.Connection], None] = None):
+        self.version = version
+        self.descripcion = descripcion
+        self.aplicar = aplicar
+        self.lote = lote
+        self.finalizar = finalizar
+
+# ==================== MIGRACIONES ====================
+
+def _columnas(conn: sqlite3.Connection, tabla: str) -> set:
+    return {fila[1] for fila in conn.execute(f"PRAGMA table_info({tabla})")}
+
+def _v1_esquema_v2(conn: sqlite3.Connection):
+    """Bases creadas con database_old.py: las columnas del esquema v2 en clanes y sus tablas nuevas"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS miembros_clan (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            clan_nombre TEXT NOT NULL,
+            usuario_id INTEGER NOT NULL,
+            rol_clan TEXT DEFAULT 'Recluta',
+            fecha_union TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            activo INTEGER DEFAULT 1,
+            FOREIGN KEY (clan_nombre) REFERENCES clanes(nombre) ON DELETE CASCADE,
+            UNIQUE(clan_nombre, usuario_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS invitaciones_pendientes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            clan_nombre TEXT NOT NULL,
+            usuario_invitado_id INTEGER NOT NULL,
+            usuario_que_invita_id INTEGER NOT NULL,
+            rol_asignado TEXT DEFAULT 'Recluta',
+            mensaje_dm_id INTEGER,
+            fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            fecha_expiracion TIMESTAMP NOT NULL,
+            estado TEXT DEFAULT 'pendiente',
+            FOREIGN KEY (clan_nombre) REFERENCES clanes(nombre) ON DELETE CASCADE
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS historial_xp (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            clan_nombre TEXT NOT NULL,
+            cantidad_xp INTEGER NOT NULL,
+            razon TEXT NOT NULL,
+            origen TEXT DEFAULT 'sistema',
+            fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            usuario_id INTEGER,
+            FOREIGN KEY (clan_nombre) REFERENCES clanes(nombre) ON DELETE CASCADE
+        )
+    ''')
+
+    existentes = _columnas(conn, 'clanes')
+    nuevas = {
+        'descripcion': "TEXT DEFAULT ''",
+        'nivel': 'INTEGER DEFAULT 1',
+        'xp_actual': 'INTEGER DEFAULT 0',
+        'total_miembros_actuales': 'INTEGER DEFAULT 1',
+        'total_miembros_historico': 'INTEGER DEFAULT 1',
+        'color_rol': 'TEXT DEFAULT NULL',
+    }
+    for columna, definicion in nuevas.items():
+        if columna not in existentes:
+            conn.execute(f"ALTER TABLE clanes ADD COLUMN {columna} {definicion}")
+
+def _v2_lideres_en_miembros(conn: sqlite3.Connection, desde: int, tamano: int) -> Optional[int]:
+    """Registrar al creador de cada clan como Líder si no figura en miembros_clan"""
+    filas = conn.execute('''
+        SELECT rowid, nombre, creador_id FROM clanes
+        WHERE rowid > ? ORDER BY rowid LIMIT ?
+    ''', (desde, tamano)).fetchall()
+    if not filas:
+        return None
+
+    conn.executemany('''
+        INSERT OR IGNORE INTO miembros_clan (clan_nombre, usuario_id, rol_clan)
+        VALUES (?, ?, 'Líder')
+    ''', [(f[1], f[2]) for f in filas])
+    return filas[-1][0]
+
+def _v3_recalcular_contadores(conn: sqlite3.Connection, desde: int, tamano: int) -> Optional[int]:
+    """Recalcular total_miembros_actuales a partir de miembros_clan"""
+    filas = conn.execute('''
+        SELECT rowid FROM clanes WHERE rowid > ? ORDER BY rowid LIMIT ?
+    ''', (desde, tamano)).fetchall()
+    if not filas:
+        return None
+
+    conn.execute('''
+        UPDATE clanes
+        SET total_miembros_actuales = (
+            SELECT COUNT(*) FROM miembros_clan
+            WHERE clan_nombre = clanes.nombre AND activo = 1
+        )
+        WHERE rowid > ? AND rowid <= ?
+    ''', (desde, filas[-1][0]))
+    return filas[-1][0]
+
+def _v4_auto_vacuum_incremental(conn: sqlite3.Connection):
+    """Activar auto_vacuum incremental (requiere un VACUUM completo una sola vez)"""
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+
+def _v5_crear_resumenes_xp(conn: sqlite3.Connection):
+    """
+    Tablas de resúmenes de XP por hora y por día, y preparar su recálculo a partir de los eventos
+    que quedan. La retención borra días completos, así que los días con eventos no tienen resumen previo.
+    """
+    for tabla, columna in (('historial_xp_diario', 'dia'), ('historial_xp_horario', 'hora')):
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {tabla} (
+                clan_nombre TEXT NOT NULL,
+                {columna} TEXT NOT NULL,
+                xp_total INTEGER NOT NULL DEFAULT 0,
+                eventos INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (clan_nombre, {columna}),
+                FOREIGN KEY (clan_nombre) REFERENCES clanes(nombre) ON DELETE CASCADE
+            )
+        ''')
+    conn.execute('DELETE FROM historial_xp_horario')
+    conn.execute('''
+        DELETE FROM historial_xp_diario
+        WHERE dia >= (SELECT date(MIN(fecha)) FROM historial_xp)
+    ''')
+
+def _v5_resumir_historial_xp(conn: sqlite3.Connection, desde: int, tamano: int) -> Optional[int]:
+    """Acumular los eventos de historial_xp en los resúmenes por hora y por día"""
+    row = conn.execute('''
+        SELECT MAX(id) FROM (SELECT id FROM historial_xp WHERE id > ? ORDER BY id LIMIT ?)
+    ''', (desde, tamano)).fetchone()
+    if row[0] is None:
+        return None
+
+    for tabla, columna, expresion in (
+        ('historial_xp_horario', 'hora', "strftime('%Y-%m-%d %H:00:00', fecha)"),
+        ('historial_xp_diario', 'dia', 'date(fecha)'),
+    ):
+        conn.execute(f'''
+            INSERT INTO {tabla} (clan_nombre, {columna}, xp_total, eventos)
+            SELECT clan_nombre, {expresion}, SUM(cantidad_xp), COUNT(*)
+            FROM historial_xp WHERE id > ? AND id <= ?
+            GROUP BY clan_nombre, {expresion}
+            ON CONFLICT(clan_nombre, {columna}) DO UPDATE SET
+                xp_total = xp_total + excluded.xp_total,
+                eventos = eventos + excluded.eventos
+        ''', (desde, row[0]))
+    return row[0]
+
+def _v6_panel_en_clanes(conn: sqlite3.Connection):
+    """Mensaje del panel en vivo de cada clan"""
+    if 'panel_mensaje_id' not in _columnas(conn, 'clanes'):
+        conn.execute("ALTER TABLE clanes ADD COLUMN panel_mensaje_id INTEGER DEFAULT NULL")
+
+def _v7_guild_en_clanes(conn: sqlite3.Connection):
+    """Servidor de cada clan (0 = sin asignar: se adopta con importador_json.py --adoptar-huerfanos)"""
+    if 'guild_id' not in _columnas(conn, 'clanes'):
+        conn.execute("ALTER TABLE clanes ADD COLUMN guild_id INTEGER NOT NULL DEFAULT 0")
+
+# Esquema de la migración 8: el nombre de un clan es único dentro de su servidor.
+# {sufijo} es '_v8' mientras se copian los datos; al final las tablas se renombran
+_REFERENCIA_V8 = '''FOREIGN KEY (guild_id, clan_nombre) REFERENCES clanes{sufijo}(guild_id, nombre)
+                ON DELETE CASCADE ON UPDATE CASCADE'''
+_TABLAS_V8 = {
+    'clanes': '''
+        nombre TEXT NOT NULL,
+        creador_id INTEGER NOT NULL,
+        descripcion TEXT DEFAULT '',
+        nivel INTEGER DEFAULT 1,
+        xp_actual INTEGER DEFAULT 0,
+        fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        total_miembros_actuales INTEGER DEFAULT 1,
+        total_miembros_historico INTEGER DEFAULT 1,
+        rol_id INTEGER NOT NULL,
+        categoria_id INTEGER NOT NULL,
+        canal_anuncios_id INTEGER NOT NULL,
+        canal_admin_id INTEGER NOT NULL,
+        canal_general_id INTEGER NOT NULL,
+        invite_code TEXT NOT NULL,
+        color_rol TEXT DEFAULT NULL,
+        panel_mensaje_id INTEGER DEFAULT NULL,
+        guild_id INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (guild_id, nombre)
+    ''',
+    'miembros_clan': f'''
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        guild_id INTEGER NOT NULL DEFAULT 0,
+        clan_nombre TEXT NOT NULL,
+        usuario_id INTEGER NOT NULL,
+        rol_clan TEXT DEFAULT 'Recluta',
+        fecha_union TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        activo INTEGER DEFAULT 1,
+        {_REFERENCIA_V8},
+        UNIQUE(guild_id, clan_nombre, usuario_id)
+    ''',
+    'invitaciones_pendientes': f'''
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        guild_id INTEGER NOT NULL DEFAULT 0,
+        clan_nombre TEXT NOT NULL,
+        usuario_invitado_id INTEGER NOT NULL,
+        usuario_que_invita_id INTEGER NOT NULL,
+        rol_asignado TEXT DEFAULT 'Recluta',
+        mensaje_dm_id INTEGER,
+        fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        fecha_expiracion TIMESTAMP NOT NULL,
+        estado TEXT DEFAULT 'pendiente',
+        {_REFERENCIA_V8}
+    ''',
+    'historial_xp': f'''
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        guild_id INTEGER NOT NULL DEFAULT 0,
+        clan_nombre TEXT NOT NULL,
+        cantidad_xp INTEGER NOT NULL,
+        razon TEXT NOT NULL,
+        origen TEXT DEFAULT 'sistema',
+        fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        usuario_id INTEGER,
+        {_REFERENCIA_V8}
+    ''',
+    'canales_clan': f'''
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        guild_id INTEGER NOT NULL DEFAULT 0,
+        clan_nombre TEXT NOT NULL,
+        canal_id INTEGER NOT NULL,
+        nombre TEXT NOT NULL,
+        tipo TEXT NOT NULL,
+        fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        {_REFERENCIA_V8}
+    ''',
+}
+# Columnas que se copian de la tabla vieja (guild_id sale del clan)
+_COLUMNAS_V8 = {
+    'clanes': [
+        'nombre', 'creador_id', 'descripcion', 'nivel', 'xp_actual', 'fecha_creacion',
+        'total_miembros_actuales', 'total_miembros_historico', 'rol_id', 'categoria_id',
+        'canal_anuncios_id', 'canal_admin_id', 'canal_general_id', 'invite_code', 'color_rol',
+        'panel_mensaje_id', 'guild_id'
+    ],
+    'miembros_clan': ['id', 'clan_nombre', 'usuario_id', 'rol_clan', 'fecha_union', 'activo'],
+    'invitaciones_pendientes': [
+        'id', 'clan_nombre', 'usuario_invitado_id', 'usuario_que_invita_id', 'rol_asignado',
+        'mensaje_dm_id', 'fecha_creacion', 'fecha_expiracion', 'estado'
+    ],
+    'historial_xp': ['id', 'clan_nombre', 'cantidad_xp', 'razon', 'origen', 'fecha', 'usuario_id'],
+    'canales_clan': ['id', 'clan_nombre', 'canal_id', 'nombre', 'tipo', 'fecha_creacion'],
+}
+_HIJAS_V8 = [t for t in _TABLAS_V8 if t != 'clanes']
+
+def _v8_copiar(conn: sqlite3.Connection, tabla: str, condicion: str = '', parametros: tuple = ()):
+    """Copiar filas de `tabla` a su versión _v8 con el guild_id de su clan (las huérfanas no se copian)"""
+    columnas = _COLUMNAS_V8[tabla]
+    conn.execute(f'''
+        INSERT INTO {tabla}_v8 (guild_id, {', '.join(columnas)})
+        SELECT c.guild_id, {', '.join('t.' + columna for columna in columnas)}
+        FROM {tabla} t JOIN clanes c ON c.nombre = t.clan_nombre
+        {condicion}
+    ''', parametros)
+
+def _v8_crear_tablas(conn: sqlite3.Connection):
+    """Tablas _v8 con la clave (guild_id, nombre) y copia de clanes (tabla chica)"""
+    for tabla in reversed(list(_TABLAS_V8)):
+        conn.execute(f"DROP TABLE IF EXISTS {tabla}_v8")
+    for tabla, columnas in _TABLAS_V8.items():
+        conn.execute(f"CREATE TABLE {tabla}_v8 ({columnas.format(sufijo='_v8')})")
+
+    columnas = ', '.join(_COLUMNAS_V8['clanes'])
+    conn.execute(f"INSERT INTO clanes_v8 ({columnas}) SELECT {columnas} FROM clanes")
+
+def _v8_copiar_historial(conn: sqlite3.Connection, desde: int, tamano: int) -> Optional[int]:
+    """Copiar historial_xp (la tabla grande) por lotes de ids"""
+    row = conn.execute('''
+        SELECT MAX(id) FROM (SELECT id FROM historial_xp WHERE id > ? ORDER BY id LIMIT ?) lote
+    ''', (desde, tamano)).fetchone()
+    if row[0] is None:
+        return None
+
+    _v8_copiar(conn, 'historial_xp', 'WHERE t.id > ? AND t.id <= ?', (desde, row[0]))
+    return row[0]
+
+def _v8_cambiar_tablas(conn: sqlite3.Connection):
+    """
+    Copiar lo que queda (lo escrito durante los lotes y las tablas chicas) y poner
+    las tablas _v8 en lugar de las viejas, todo en una transacción
+    """
+    columnas = _COLUMNAS_V8['clanes']
+    conn.execute(f'''
+        INSERT INTO clanes_v8 ({', '.join(columnas)})
+        SELECT {', '.join(columnas)} FROM clanes WHERE true
+        ON CONFLICT(guild_id, nombre) DO UPDATE SET
+            {', '.join(f'{c} = excluded.{c}' for c in columnas if c not in ('guild_id', 'nombre'))}
+    ''')
+
+    ultimo = conn.execute('SELECT MAX(id) FROM historial_xp_v8').fetchone()[0] or 0
+    _v8_copiar(conn, 'historial_xp', 'WHERE t.id > ?', (ultimo,))
+    for tabla in _HIJAS_V8:
+        if tabla != 'historial_xp':
+            _v8_copiar(conn, tabla)
+
+    if not isinstance(conn, sqlite3.Connection):
+        # En SQLite insertar ids explícitos ya adelanta sqlite_sequence; en PostgreSQL no
+        for tabla in ('miembros_clan', 'invitaciones_pendientes', 'historial_xp', 'canales_clan'):
+            conn.execute(f'''
+                SELECT setval(pg_get_serial_sequence('{tabla}_v8', 'id'), COALESCE(MAX(id), 0) + 1, false)
+                FROM {tabla}_v8
+            ''')
+
+    for tabla in _HIJAS_V8:
+        conn.execute(f"DROP TABLE {tabla}")
+    if isinstance(conn, sqlite3.Connection):
+        conn.execute("DROP TABLE clanes")
+    else:
+        # Los resúmenes de XP todavía referencian la tabla vieja: CASCADE quita esas claves
+        # foráneas (la migración 9 reconstruye los resúmenes)
+        conn.execute("DROP TABLE clanes CASCADE")
+    # Renombrar clanes_v8 también reescribe las referencias de las tablas hijas
+    for tabla in _TABLAS_V8:
+        conn.execute(f"ALTER TABLE {tabla}_v8 RENAME TO {tabla}")
+
+def _tiene_columna(conn: sqlite3.Connection, tabla: str, columna: str) -> bool:
+    if isinstance(conn, sqlite3.Connection):
+        return columna in _columnas(conn, tabla)
+    return conn.execute('''
+        SELECT 1 FROM information_schema.columns WHERE table_name = ? AND column_name = ?
+    ''', (tabla, columna)).fetchone() is not None
+
+def _v9_resumenes_por_servidor(conn: sqlite3.Connection):
+    """Resúmenes de XP con la clave (guild_id, clan_nombre, dia|hora), con el guild_id de su clan"""
+    for tabla, columna in (('historial_xp_diario', 'dia'), ('historial_xp_horario', 'hora')):
+        if _tiene_columna(conn, tabla, 'guild_id'):
+            continue   # ya tiene la clave por servidor
+        conn.execute(f"DROP TABLE IF EXISTS {tabla}_v9")
+        conn.execute(f'''
+            CREATE TABLE {tabla}_v9 (
+                guild_id INTEGER NOT NULL DEFAULT 0,
+                clan_nombre TEXT NOT NULL,
+                {columna} TEXT NOT NULL,
+                xp_total INTEGER NOT NULL DEFAULT 0,
+                eventos INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (guild_id, clan_nombre, {columna}),
+                FOREIGN KEY (guild_id, clan_nombre) REFERENCES clanes(guild_id, nombre)
+                    ON DELETE CASCADE ON UPDATE CASCADE
+            )
+        ''')
+        # Recién aplicada la 8 ningún nombre de clan se repite: cada fila tiene un solo servidor
+        conn.execute(f'''
+            INSERT INTO {tabla}_v9 (guild_id, clan_nombre, {columna}, xp_total, eventos)
+            SELECT c.guild_id, t.clan_nombre, t.{columna}, t.xp_total, t.eventos
+            FROM {tabla} t JOIN clanes c ON c.nombre = t.clan_nombre
+        ''')
+        conn.execute(f"DROP TABLE {tabla}")
+        conn.execute(f"ALTER TABLE {tabla}_v9 RENAME TO {tabla}")
+
+MIGRACIONES: List[Migracion] = [
+    Migracion(1, 'esquema v2', aplicar=_v1_esquema_v2),
+    Migracion(2, 'creadores como Líder en miembros_clan', lote=_v2_lideres_en_miembros),
+    Migracion(3, 'recalcular total_miembros_actuales', lote=_v3_recalcular_contadores),
+    Migracion(4, 'auto_vacuum incremental', aplicar=_v4_auto_vacuum_incremental),
+    Migracion(5, 'resúmenes de XP por hora y por día', aplicar=_v5_crear_resumenes_xp,
+              lote=_v5_resumir_historial_xp),
+    Migracion(6, 'panel en vivo de los clanes', aplicar=_v6_panel_en_clanes),
+    Migracion(7, 'servidor de cada clan', aplicar=_v7_guild_en_clanes),
+    Migracion(8, 'clanes por servidor', aplicar=_v8_crear_tablas, lote=_v8_copiar_historial,
+              finalizar=_v8_cambiar_tablas),
+    Migracion(9, 'resúmenes de XP por servidor', aplicar=_v9_resumenes_por_servidor),
+]
+
+# ==================== MOTOR ====================
+
+@contextmanager
+def _conexion_migracion(conexion: Callable[[], AbstractContextManager], almacen: Almacen):
+    with conexion() as conn:
+        if almacen.nombre == 'sqlite':
+            # Sin efecto dentro de una transacción: se fija antes de la primera sentencia
+            conn.execute('PRAGMA foreign_keys = OFF')
+        yield conn
+
+def aplicar_migraciones(conexion: Callable[[], AbstractContextManager], almacen: Almacen,
+                        tamano_lote: int = TAMANO_LOTE,
+                        pausa: float = PAUSA_ENTRE_LOTES) -> int:
+    """
+    Aplicar en orden las migraciones pendientes.
+    `conexion` es un context manager que abre, confirma y cierra una conexión
+    (database.get_db_connection); `almacen` guarda la versión (PRAGMA user_version
+    en SQLite). Devuelve la versión final del esquema.
+    """
+    with conexion() as conn:
+        version = almacen.version_esquema(conn, MIGRACIONES[-1].version)
+
+    pendientes = [m for m in MIGRACIONES if m.version > version]
+    if not pendientes:
+        return version
+
+    logger.info(f"Esquema en versión {version}, aplicando {len(pendientes)} migraciones")
+
+    for migracion in pendientes:
+        inicio = time.perf_counter()
+        lotes = 0
+
+        if migracion.aplicar:
+            with _conexion_migracion(conexion, almacen) as conn:
+                migracion.aplicar(conn)
+
+        if migracion.lote:
+            desde = 0
+            while True:
+                with _conexion_migracion(conexion, almacen) as conn:
+                    desde = migracion.lote(conn, desde, tamano_lote)
+                if desde is None:
+                    break
+                lotes += 1
+                # Soltar el lock entre lotes para no bloquear al bot
+                time.sleep(pausa)
+
+        with _conexion_migracion(conexion, almacen) as conn:
+            if migracion.finalizar:
+                migracion.finalizar(conn)
+            almacen.fijar_version_esquema(conn, migracion.version)
+
+        logger.info(
+            f"Migración {migracion.version} ({migracion.descripcion}) aplicada en "
+            f"{(time.perf_counter() - inicio) * 1000:.0f}ms" + (f", {lotes} lotes" if lotes else "")
+        )
+        version = migracion.version
+
+    return version
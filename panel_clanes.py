@@ -0,0 +1,159 @@
+"""
+Panel en vivo de cada clan: un mensaje fijado en su canal de administración
+que se edita solo cuando cambian la XP, los miembros o los canales del clan.
+
+Los cambios llegan por database.al_cambiar_clan y se agrupan: el primer cambio
+programa una edición ESPERA_AGRUPAR segundos después (para juntar ráfagas) y
+nunca se edita el mismo panel más de una vez cada INTERVALO_MINIMO segundos.
+Cien eventos de XP seguidos terminan en una sola edición con el estado final.
+Las ediciones pasan primero por el limitador del servidor del clan y luego por
+uno común para no acercarse al límite global de la API: un servidor con muchos
+clanes activos no acapara el cupo común y los paneles de los demás siguen al día.
+"""
+import time
+import asyncio
+import logging
+from typing import Callable, Dict, Optional, Tuple
+
+import discord
+
+from database import ClaveClan, al_cambiar_clan, guardar_panel_clan, obtener_paneles_clanes
+from metricas import contar
+from reconciliacion import LimitadorAPI
+import reparto_guilds
+
+logger = logging.getLogger(__name__)
+
+ESPERA_AGRUPAR = 2.0      # segundos desde el primer cambio hasta la edición
+INTERVALO_MINIMO = 15.0   # segundos entre dos ediciones del mismo panel
+
+class PanelesClanes:
+    """
+    Paneles {(guild_id, clan_nombre): (canal_id, mensaje_id)} y las ediciones pendientes.
+    `obtener_canal(canal_id)` busca el canal en la caché (bot.get_channel, de cualquier servidor).
+    `construir(guild_id, clan_nombre)` arma el embed (sin tocar Discord) o devuelve None.
+    """
+
+    def __init__(self, obtener_canal: Callable[[int], Optional[discord.abc.GuildChannel]],
+                 construir: Callable[[int, str], Optional[discord.Embed]],
+                 intervalo_minimo: float = INTERVALO_MINIMO):
+        self.obtener_canal = obtener_canal
+        self.construir = construir
+        self.intervalo_minimo = intervalo_minimo
+        self._paneles: Dict[ClaveClan, Tuple[int, int]] = {}
+        self._programados: Dict[ClaveClan, asyncio.Task] = {}
+        self._ultima_edicion: Dict[ClaveClan, float] = {}
+        self._limitador = LimitadorAPI(llamadas_por_segundo=20, rafaga=20)
+        self._limitadores_guild: Dict[int, LimitadorAPI] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def iniciar(self):
+        """Cargar los paneles guardados y escuchar los cambios de la base"""
+        if self._loop is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._paneles = await asyncio.to_thread(obtener_paneles_clanes)
+        al_cambiar_clan(self._al_cambiar)
+        logger.info(f"Paneles de clan cargados: {len(self._paneles)}")
+
+    def detener(self):
+        for tarea in self._programados.values():
+            tarea.cancel()
+        self._programados.clear()
+
+    def _al_cambiar(self, clave: Optional[ClaveClan]):
+        # Puede llegar desde un hilo (asyncio.to_thread): pasar al loop
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.marcar, clave)
+
+    def marcar(self, clave: Optional[ClaveClan]):
+        """Programar la actualización del panel del clan (guild_id, clan_nombre) (None = todos los paneles)"""
+        claves = list(self._paneles) if clave is None else [clave]
+        for clave in claves:
+            if clave not in self._paneles or clave in self._programados:
+                continue  # Sin panel, o ya hay una edición pendiente que verá este cambio
+
+            espera = max(
+                ESPERA_AGRUPAR,
+                self._ultima_edicion.get(clave, 0.0) + self.intervalo_minimo - time.monotonic()
+            )
+            self._programados[clave] = asyncio.create_task(self._actualizar_despues(clave, espera))
+
+    async def _actualizar_despues(self, clave: ClaveClan, espera: float):
+        try:
+            await asyncio.sleep(espera)
+        finally:
+            # Los cambios que lleguen desde aquí programan la siguiente edición
+            self._programados.pop(clave, None)
+
+        try:
+            await self._editar(clave)
+        except Exception as e:
+            logger.error(f"Error al actualizar el panel del clan {clave[1]}: {e}")
+
+    async def _esperar_turno(self, guild_id: int):
+        limitador = self._limitadores_guild.get(guild_id)
+        if limitador is None:
+            limitador = self._limitadores_guild[guild_id] = LimitadorAPI(llamadas_por_segundo=2, rafaga=5)
+        await limitador.esperar()
+        await self._limitador.esperar()
+
+    async def _editar(self, clave: ClaveClan):
+        panel = self._paneles.get(clave)
+        if not panel:
+            return
+
+        canal = self.obtener_canal(panel[0])
+        if canal is None:
+            # Servidor aún no disponible en su shard (o canal borrado): se reintenta con el próximo cambio
+            return
+        guild_id, clan_nombre = clave
+        embed = await reparto_guilds.en_hilo(guild_id, self.construir, guild_id, clan_nombre)
+        if embed is None:
+            await self.quitar(clave)
+            return
+
+        await self._esperar_turno(guild_id)
+        self._ultima_edicion[clave] = time.monotonic()
+        try:
+            await canal.get_partial_message(panel[1]).edit(embed=embed)
+            contar('paneles.ediciones')
+        except discord.NotFound:
+            logger.warning(f"El panel del clan {clan_nombre} fue borrado; se deja de actualizar")
+            await self.quitar(clave)
+
+    async def publicar(self, clan_nombre: str, canal: discord.TextChannel) -> Optional[discord.Message]:
+        """Enviar y fijar un panel nuevo del clan del servidor de `canal` (reemplaza al anterior si había)"""
+        guild_id = canal.guild.id
+        clave = (guild_id, clan_nombre)
+        embed = await reparto_guilds.en_hilo(guild_id, self.construir, guild_id, clan_nombre)
+        if embed is None:
+            return None
+
+        anterior = self._paneles.get(clave)
+        mensaje = await canal.send(embed=embed)
+        try:
+            await mensaje.pin(reason=f"Panel del clan {clan_nombre}")
+        except discord.HTTPException as e:
+            logger.warning(f"No se pudo fijar el panel del clan {clan_nombre}: {e}")
+
+        await reparto_guilds.en_hilo(guild_id, guardar_panel_clan, guild_id, clan_nombre, mensaje.id)
+        self._paneles[clave] = (canal.id, mensaje.id)
+        self._ultima_edicion[clave] = time.monotonic()
+
+        if anterior and anterior[1] != mensaje.id:
+            viejo = self.obtener_canal(anterior[0])
+            if viejo is not None:
+                try:
+                    await viejo.get_partial_message(anterior[1]).delete()
+                except discord.HTTPException:
+                    pass
+        return mensaje
+
+    async def quitar(self, clave: ClaveClan):
+        """Dejar de actualizar el panel del clan (guild_id, clan_nombre)"""
+        if self._paneles.pop(clave, None) is not None:
+            await reparto_guilds.en_hilo(clave[0], guardar_panel_clan, *clave, None)
+        tarea = self._programados.pop(clave, None)
+        if tarea:
+            tarea.cancel()
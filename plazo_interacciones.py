@@ -0,0 +1,144 @@
+"""
+Plazo de respuesta de las interacciones: Discord da 3 segundos para responder
+(o diferir) un comando; pasado ese tiempo el usuario ve "la interacción falló".
+
+El decorador con_plazo difiere la respuesta por el comando cuando se acerca el
+límite, sin cambiar el handler:
+
+- Al empezar, si el comando suele tardar más que el presupuesto (p95 histórico
+  de 'comando.<comando>', que registra @medido) o la interacción ya llegó
+  tarde, difiere de inmediato.
+  Es el único caso que ayuda cuando el handler bloquea el loop con consultas
+  síncronas: un temporizador no llegaría a correr.
+- Si no, un temporizador difiere al cumplirse el presupuesto mientras el
+  handler espera algo (la API de Discord, un hilo, etc.).
+
+interaction.response se reemplaza por un intermediario: si la interacción ya se
+difirió, send_message se convierte en followup.send, y defer no hace nada.
+
+Se registran 'plazo.<comando>' (ms hasta la primera respuesta) y los contadores
+'plazo.diferido.<comando>' y 'plazo.vencido.<comando>', que indican qué comandos
+conviene optimizar.
+"""
+import time
+import asyncio
+import functools
+import logging
+from typing import Optional
+
+import discord
+
+from metricas import registrar, contar, percentil
+
+logger = logging.getLogger(__name__)
+
+PLAZO_DISCORD = 3.0
+PRESUPUESTO = 2.0          # diferir al llegar aquí, con margen para el viaje a la API
+MUESTRAS_HISTORIAL = 20    # mediciones mínimas antes de confiar en el p95 del comando
+
+def _transcurrido(interaction: discord.Interaction) -> float:
+    """Segundos desde que Discord creó la interacción (0 si el reloj local no es confiable)"""
+    segundos = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+    return segundos if 0 <= segundos < PLAZO_DISCORD * 2 else 0.0
+
+class RespuestaConPlazo:
+    """Envuelve InteractionResponse para que el diferido automático sea transparente"""
+
+    def __init__(self, interaction: discord.Interaction, respuesta: discord.InteractionResponse,
+                 comando: str, efimero: bool, inicio: float):
+        self._interaction = interaction
+        self._respuesta = respuesta
+        self._comando = comando
+        self._efimero = efimero
+        self._inicio = inicio
+        self._lock = asyncio.Lock()
+        self.diferido_automatico = False
+
+    def __getattr__(self, nombre):
+        return getattr(self._respuesta, nombre)
+
+    def is_done(self) -> bool:
+        return self._respuesta.is_done()
+
+    def _registrar_respuesta(self):
+        segundos = time.monotonic() - self._inicio
+        registrar(f"plazo.{self._comando}", segundos * 1000)
+        if segundos >= PLAZO_DISCORD:
+            contar(f"plazo.vencido.{self._comando}")
+            logger.warning(f"/{self._comando} respondió a los {segundos:.1f}s: la interacción ya había vencido")
+
+    async def diferir_automatico(self, motivo: str):
+        async with self._lock:
+            if self._respuesta.is_done():
+                return
+            await self._respuesta.defer(ephemeral=self._efimero, thinking=True)
+            self.diferido_automatico = True
+        self._registrar_respuesta()
+        contar(f"plazo.diferido.{self._comando}")
+        logger.debug(f"/{self._comando} diferido automáticamente ({motivo})")
+
+    async def defer(self, **kwargs):
+        async with self._lock:
+            if self._respuesta.is_done():
+                return
+            await self._respuesta.defer(**kwargs)
+        self._registrar_respuesta()
+
+    async def send_message(self, content: Optional[str] = None, **kwargs):
+        async with self._lock:
+            if not self._respuesta.is_done():
+                await self._respuesta.send_message(content, **kwargs)
+                self._registrar_respuesta()
+                return
+
+        # Ya diferido: la respuesta sale como seguimiento
+        kwargs.pop('delete_after', None)
+        efimero = kwargs.get('ephemeral', False)
+        if self.diferido_automatico and efimero and not self._efimero:
+            # El "pensando..." público se borra para que el mensaje efímero no quede a la vista de todos
+            try:
+                await self._interaction.delete_original_response()
+            except discord.HTTPException:
+                pass
+        if content is not None:
+            kwargs['content'] = content
+        await self._interaction.followup.send(**kwargs)
+
+def con_plazo(efimero: bool = False, presupuesto: float = PRESUPUESTO):
+    """
+    Decorador para comandos de barra: difiere la respuesta si el comando no
+    va a responder dentro de `presupuesto` segundos.
+
+    Args:
+        efimero: si el diferido automático debe ser efímero (la respuesta final lo hereda)
+    """
+    def decorador(func):
+        comando = func.__name__
+
+        @functools.wraps(func)
+        async def envoltura(interaction: discord.Interaction, *args, **kwargs):
+            inicio = time.monotonic() - _transcurrido(interaction)
+            respuesta = RespuestaConPlazo(interaction, interaction.response, comando, efimero, inicio)
+            interaction._cs_response = respuesta
+
+            # Diferir ya si el historial dice que no llega a tiempo
+            p95 = percentil(f"comando.{comando}", 95, minimo=MUESTRAS_HISTORIAL)
+            restante = presupuesto - (time.monotonic() - inicio)
+            if restante <= 0:
+                await respuesta.diferir_automatico('llegó tarde')
+            elif p95 is not None and p95 / 1000 >= restante:
+                await respuesta.diferir_automatico(f"p95 histórico {p95:.0f}ms")
+
+            async def temporizador():
+                await asyncio.sleep(max(0.0, presupuesto - (time.monotonic() - inicio)))
+                await respuesta.diferir_automatico('temporizador')
+
+            tarea = asyncio.create_task(temporizador())
+            try:
+                return await func(interaction, *args, **kwargs)
+            finally:
+                tarea.cancel()
+
+        return envoltura
+
+    return decorador
@@ -0,0 +1,681 @@
+#!/usr/bin/env python3
+"""
+Pruebas de carga sin Discord: ejecuta los handlers de main.py en proceso contra
+un servidor falso (guild, miembros, canales, roles) y una API REST simulada con
+latencia configurable e inyección de 429.
+
+Escenarios:
+    raid          n usuarios entran a la vez con invitaciones permanentes de clanes (on_member_join);
+                  al final se comprueba que todos quedaron en su clan con la XP correspondiente
+    creacion      n usuarios crean un clan a la vez (/crear_clan completo, con mensajes y botones)
+    invitaciones  los líderes invitan a n usuarios con /invitar_clan y todos aceptan desde el DM
+    admin         ráfaga de /stats_clan, /gestionar_miembros, /ranking, /expulsar_miembro y /reconciliar_clanes
+
+Se informa throughput, percentiles de latencia por operación, llamadas a la API,
+429 recibidos y el retraso máximo del event loop.
+
+Uso:
+    python prueba_carga.py [raid|creacion|invitaciones|admin|todos] [--n 200] [--latencia 40] [--prob-429 0.02]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import tempfile
+import itertools
+from typing import Dict, List, Optional
+
+import discord
+from discord import app_commands
+
+logger = logging.getLogger(__name__)
+
+_ids = itertools.count(10**17)
+
+def _nuevo_id() -> int:
+    return next(_ids)
+
+# ==================== API REST SIMULADA ====================
+
+class RespuestaHTTPFalsa:
+    """Lo mínimo que discord.HTTPException lee de una respuesta"""
+
+    def __init__(self, status: int, reason: str):
+        self.status = status
+        self.reason = reason
+
+class APIFalsa:
+    """
+    Cada llamada espera una latencia aleatoria. Con probabilidad prob_429 la ruta
+    responde 429: se espera retry_after y se reintenta, como hace discord.py.
+    """
+
+    def __init__(self, latencia_ms: float = 40.0, variacion: float = 0.5,
+                 prob_429: float = 0.02, retry_after: float = 0.5, prob_dm_cerrado: float = 0.05):
+        self.latencia_ms = latencia_ms
+        self.variacion = variacion
+        self.prob_429 = prob_429
+        self.retry_after = retry_after
+        self.prob_dm_cerrado = prob_dm_cerrado
+        self.llamadas: Dict[str, int] = {}
+        self.rate_limits = 0
+
+    async def llamar(self, ruta: str):
+        self.llamadas[ruta] = self.llamadas.get(ruta, 0) + 1
+        while random.random() < self.prob_429:
+            self.rate_limits += 1
+            await asyncio.sleep(self.retry_after)
+        factor = 1 + random.uniform(-self.variacion, self.variacion)
+        await asyncio.sleep(self.latencia_ms * factor / 1000)
+
+# ==================== MODELO FALSO ====================
+
+class MensajeFalso:
+    def __init__(self, canal, autor=None, content: str = None, embed=None, view=None):
+        self.id = _nuevo_id()
+        self.channel = canal
+        self.author = autor
+        self.content = content
+        self.embed = embed
+        self.view = view
+        self.pinned = False
+
+    async def pin(self, reason: str = None):
+        await self.channel.guild.api.llamar('PUT /channels/{id}/pins/{id}')
+        self.pinned = True
+
+class RolFalso:
+    def __init__(self, guild: 'GuildFalso', nombre: str, administrador: bool = False):
+        self.id = _nuevo_id()
+        self.guild = guild
+        self.name = nombre
+        self.permissions = discord.Permissions(administrator=administrador)
+        self.color = discord.Color.default()
+
+    @property
+    def mention(self) -> str:
+        return f'<@&{self.id}>'
+
+    @property
+    def members(self) -> List['MiembroFalso']:
+        return [m for m in self.guild.members if self.id in m._roles]
+
+    def __hash__(self):
+        return hash(self.id)
+
+class MiembroFalso:
+    def __init__(self, guild: 'GuildFalso', nombre: str, administrador: bool = False):
+        self.id = _nuevo_id()
+        self.guild = guild
+        self.name = nombre
+        self.bot = False
+        self._roles: List[int] = []
+        self.guild_permissions = discord.Permissions(administrator=administrador)
+        self.dm_channel = None
+
+    @property
+    def mention(self) -> str:
+        return f'<@{self.id}>'
+
+    def __hash__(self):
+        return hash(self.id)
+
+    async def add_roles(self, *roles, reason: str = None):
+        await self.guild.api.llamar('PUT /members/{id}/roles/{id}')
+        for rol in roles:
+            if rol.id not in self._roles:
+                self._roles.append(rol.id)
+
+    async def remove_roles(self, *roles, reason: str = None):
+        await self.guild.api.llamar('DELETE /members/{id}/roles/{id}')
+        for rol in roles:
+            if rol.id in self._roles:
+                self._roles.remove(rol.id)
+
+    async def send(self, content: str = None, embed=None, view=None):
+        await self.guild.api.llamar('POST /users/@me/channels')
+        if random.random() < self.guild.api.prob_dm_cerrado:
+            raise discord.Forbidden(RespuestaHTTPFalsa(403, 'Forbidden'), 'Cannot send messages to this user')
+        await self.guild.api.llamar('POST /channels/{id}/messages')
+        mensaje = MensajeFalso(None, content=content, embed=embed, view=view)
+        self.guild.dms.setdefault(self.id, []).append(mensaje)
+        return mensaje
+
+class CanalFalso(discord.TextChannel):
+    """Pasa los isinstance(..., discord.TextChannel) de main.py"""
+
+    def __init__(self, guild: 'GuildFalso', nombre: str, categoria: Optional['CategoriaFalsa'] = None):
+        self.id = _nuevo_id()
+        self.guild = guild
+        self.name = nombre
+        self.category_id = categoria.id if categoria else None
+        self.mensajes: List[MensajeFalso] = []
+
+    async def send(self, content: str = None, embed=None, view=None):
+        await self.guild.api.llamar('POST /channels/{id}/messages')
+        mensaje = MensajeFalso(self, content=content, embed=embed, view=view)
+        self.mensajes.append(mensaje)
+        return mensaje
+
+    async def create_thread(self, name: str, type=None, invitable: bool = True, auto_archive_duration: int = 60):
+        await self.guild.api.llamar('POST /channels/{id}/threads')
+        return HiloFalso(self.guild, name)
+
+    async def create_invite(self, max_age: int = 0, max_uses: int = 0, unique: bool = True):
+        await self.guild.api.llamar('POST /channels/{id}/invites')
+        invitacion = InvitacionDiscordFalsa()
+        self.guild.invitaciones.append(invitacion)
+        return invitacion
+
+class CategoriaFalsa(discord.CategoryChannel):
+    def __init__(self, guild: 'GuildFalso', nombre: str):
+        self.id = _nuevo_id()
+        self.guild = guild
+        self.name = nombre
+        self._canales: List[CanalFalso] = []
+
+    @property
+    def channels(self) -> List[CanalFalso]:
+        return list(self._canales)
+
+    async def create_text_channel(self, name: str, overwrites=None):
+        await self.guild.api.llamar('POST /guilds/{id}/channels')
+        canal = CanalFalso(self.guild, name, self)
+        self._canales.append(canal)
+        self.guild._registrar_canal(canal)
+        return canal
+
+class HiloFalso(CanalFalso):
+    """
+    Hilo privado de /crear_clan. Cuando el bot hace una pregunta, el guion del
+    usuario responde en cuanto main.py está esperando el mensaje.
+    """
+
+    def __init__(self, guild: 'GuildFalso', nombre: str):
+        super().__init__(guild, nombre)
+        self.autor: Optional[MiembroFalso] = None
+        self.guion: List[str] = []
+
+    async def add_user(self, usuario):
+        await self.guild.api.llamar('PUT /channels/{id}/thread-members/{id}')
+        self.autor = usuario
+
+    async def remove_user(self, usuario):
+        await self.guild.api.llamar('DELETE /channels/{id}/thread-members/{id}')
+
+    async def send(self, content: str = None, embed=None, view=None):
+        mensaje = await super().send(content, embed=embed, view=view)
+        if view is not None and view.children:
+            # Confirmar con el primer botón (✅ Confirmar)
+            asyncio.create_task(view.children[0].callback(InteraccionFalsa(self.guild, self.autor, self)))
+        elif embed is not None and self.guion and embed.title and ('Creación de Clan' in embed.title or 'Paso' in embed.title):
+            asyncio.create_task(responder_cuando_espere(self.guild.bot, MensajeFalso(self, self.autor, self.guion.pop(0))))
+        return mensaje
+
+class InvitacionDiscordFalsa:
+    def __init__(self):
+        self.code = f"{_nuevo_id():x}"
+        self.uses = 0
+        self.url = f"https://discord.gg/{self.code}"
+
+class GuildFalso:
+    def __init__(self, bot, api: APIFalsa, nombre: str = 'Servidor de prueba'):
+        self.id = _nuevo_id()
+        self.bot = bot
+        self.api = api
+        self.name = nombre
+        self.chunked = True
+        self.members: List[MiembroFalso] = []
+        self.channels: List = []
+        self.invitaciones: List[InvitacionDiscordFalsa] = []
+        self.dms: Dict[int, List[MensajeFalso]] = {}
+        self._miembros: Dict[int, MiembroFalso] = {}
+        self._roles: Dict[int, RolFalso] = {}
+        self._canales: Dict[int, object] = {}
+
+        self.default_role = self._nuevo_rol('@everyone')
+        self._nuevo_rol('Admin', administrador=True)
+        self.me = self.agregar_miembro('ClanBot')
+        self.canal_gestion = CanalFalso(self, 'gestion-clanes')
+        self._registrar_canal(self.canal_gestion)
+
+    @property
+    def roles(self) -> List[RolFalso]:
+        return list(self._roles.values())
+
+    def _nuevo_rol(self, nombre: str, administrador: bool = False) -> RolFalso:
+        rol = RolFalso(self, nombre, administrador)
+        self._roles[rol.id] = rol
+        return rol
+
+    def _registrar_canal(self, canal):
+        self.channels.append(canal)
+        self._canales[canal.id] = canal
+
+    def agregar_miembro(self, nombre: str, administrador: bool = False) -> MiembroFalso:
+        member = MiembroFalso(self, nombre, administrador)
+        self.members.append(member)
+        self._miembros[member.id] = member
+        return member
+
+    def get_member(self, usuario_id: int) -> Optional[MiembroFalso]:
+        return self._miembros.get(usuario_id)
+
+    def get_role(self, rol_id: int) -> Optional[RolFalso]:
+        return self._roles.get(rol_id)
+
+    def get_channel(self, canal_id: int):
+        return self._canales.get(canal_id)
+
+    async def invites(self) -> List[InvitacionDiscordFalsa]:
+        await self.api.llamar('GET /guilds/{id}/invites')
+        return list(self.invitaciones)
+
+    async def create_role(self, name: str, mentionable: bool = False, hoist: bool = False, **kwargs) -> RolFalso:
+        await self.api.llamar('POST /guilds/{id}/roles')
+        return self._nuevo_rol(name)
+
+    async def create_category(self, name: str, overwrites=None) -> CategoriaFalsa:
+        await self.api.llamar('POST /guilds/{id}/channels')
+        categoria = CategoriaFalsa(self, name)
+        self._registrar_canal(categoria)
+        return categoria
+
+class RespuestaInteraccionFalsa:
+    def __init__(self, interaccion: 'InteraccionFalsa'):
+        self.interaccion = interaccion
+        self._hecho = False
+
+    def is_done(self) -> bool:
+        return self._hecho
+
+    async def _responder(self, ruta: str):
+        if self._hecho:
+            raise discord.InteractionResponded(self.interaccion)
+        self._hecho = True
+        await self.interaccion.guild.api.llamar(ruta)
+        self.interaccion.respondida_en = time.perf_counter()
+
+    async def defer(self, ephemeral: bool = False, thinking: bool = False):
+        await self._responder('POST /interactions/{id}/callback defer')
+
+    async def send_message(self, content: str = None, embed=None, ephemeral: bool = False, view=None):
+        await self._responder('POST /interactions/{id}/callback message')
+
+    async def edit_message(self, content: str = None, embed=None, view=None):
+        await self._responder('POST /interactions/{id}/callback update')
+
+class SeguimientoFalso:
+    def __init__(self, interaccion: 'InteraccionFalsa'):
+        self.interaccion = interaccion
+
+    async def send(self, content: str = None, embed=None, ephemeral: bool = False, view=None):
+        await self.interaccion.guild.api.llamar('POST /webhooks/{id}/{token}')
+        return MensajeFalso(self.interaccion.channel, content=content, embed=embed)
+
+class InteraccionFalsa:
+    def __init__(self, guild: GuildFalso, usuario: MiembroFalso, canal=None,
+                 tipo: discord.InteractionType = discord.InteractionType.application_command,
+                 datos: Dict = None):
+        self.id = _nuevo_id()
+        self.guild = guild
+        self.user = usuario
+        self.channel = canal
+        self.type = tipo
+        self.data = datos or {}
+        # con_plazo mide el plazo de 3 s desde aquí
+        self.created_at = discord.utils.utcnow()
+        self.creada_en = time.perf_counter()
+        self.respondida_en: Optional[float] = None
+        self._cs_response = RespuestaInteraccionFalsa(self)
+        self.followup = SeguimientoFalso(self)
+
+    @property
+    def response(self):
+        # Como en discord.py: con_plazo reemplaza la respuesta asignando _cs_response
+        return self._cs_response
+
+async def responder_cuando_espere(bot, mensaje: MensajeFalso, limite: float = 30.0):
+    """
+    Entregar un mensaje del usuario al bot.wait_for que lo está esperando
+    (sin pasar por on_message, que intentaría procesar comandos de prefijo).
+    """
+    fin = time.monotonic() + limite
+    while time.monotonic() < fin:
+        for futuro, check in list(bot._listeners.get('message', [])):
+            if not futuro.done() and check(mensaje):
+                futuro.set_result(mensaje)
+                bot._listeners['message'].remove((futuro, check))
+                return
+        await asyncio.sleep(0.005)
+    logger.warning(f"Nadie esperó el mensaje '{mensaje.content}' en {mensaje.channel.name}")
+
+# ==================== MEDICIÓN ====================
+
+class MonitorLag:
+    """Mide cuánto se atrasa un sleep corto: el tiempo que el loop estuvo bloqueado"""
+
+    def __init__(self, intervalo: float = 0.01):
+        self.intervalo = intervalo
+        self.muestras: List[float] = []
+        self._tarea: Optional[asyncio.Task] = None
+
+    async def _loop(self):
+        while True:
+            inicio = time.perf_counter()
+            await asyncio.sleep(self.intervalo)
+            self.muestras.append((time.perf_counter() - inicio - self.intervalo) * 1000)
+
+    def iniciar(self):
+        self._tarea = asyncio.create_task(self._loop())
+
+    def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+
+class ContadorErrores(logging.Handler):
+    """Cuenta los logger.error de los handlers (atrapan sus propias excepciones)"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.total = 0
+        self.ejemplos: List[str] = []
+
+    def emit(self, record: logging.LogRecord):
+        self.total += 1
+        if len(self.ejemplos) < 5:
+            self.ejemplos.append(record.getMessage()[:200])
+
+def percentil(valores: List[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+async def _medir(latencias: Dict[str, List[float]], nombre: str, coro):
+    inicio = time.perf_counter()
+    try:
+        await coro
+    finally:
+        latencias.setdefault(nombre, []).append((time.perf_counter() - inicio) * 1000)
+
+# ==================== ESCENARIOS ====================
+
+def _clan_de_prueba(guild: GuildFalso, nombre: str, lider: MiembroFalso) -> Dict:
+    """Crear un clan directamente (sin pasar por /crear_clan) con su rol, canales e invitación"""
+    import database
+
+    rol = guild._nuevo_rol(f"Clan-{nombre}")
+    categoria = CategoriaFalsa(guild, nombre)
+    guild._registrar_canal(categoria)
+    canales = {}
+    for tipo in ('anuncios', 'admin', 'general'):
+        canal = CanalFalso(guild, f"{tipo}-{nombre}", categoria)
+        categoria._canales.append(canal)
+        guild._registrar_canal(canal)
+        canales[tipo] = canal
+    invitacion = InvitacionDiscordFalsa()
+    guild.invitaciones.append(invitacion)
+    lider._roles.append(rol.id)
+
+    database.crear_clan(
+        guild.id, nombre, lider.id, 'Clan de prueba', rol.id, categoria.id,
+        canales['anuncios'].id, canales['admin'].id, canales['general'].id, invitacion.code
+    )
+    return {'nombre': nombre, 'lider': lider, 'rol': rol, 'canales': canales, 'invitacion': invitacion}
+
+async def escenario_raid(main, guild: GuildFalso, n: int, latencias: Dict[str, List[float]]):
+    """n usuarios entran a la vez usando invitaciones permanentes de clanes"""
+    clanes = [_clan_de_prueba(guild, f"raid{i}", guild.agregar_miembro(f"lider_raid{i}")) for i in range(max(1, n // 20))]
+    nuevos = [guild.agregar_miembro(f"raider{i}") for i in range(n)]
+    # Lo que hace on_ready al conectar: los usos de partida de cada invitación
+    await main.cargar_usos_invitaciones(guild)
+
+    async def entrar(i: int, member: MiembroFalso):
+        # Discord cuenta el uso de la invitación antes de avisar la entrada
+        clanes[i % len(clanes)]['invitacion'].uses += 1
+        await _medir(latencias, 'on_member_join', main.on_member_join(member))
+
+    await asyncio.gather(*(entrar(i, m) for i, m in enumerate(nuevos)))
+    _verificar_raid(guild, clanes, nuevos)
+    return len(nuevos)
+
+def _verificar_raid(guild: GuildFalso, clanes: List[Dict], nuevos: List[MiembroFalso]):
+    """
+    Cada entrada debe dejar al usuario en el clan de su invitación con +50 XP para el clan;
+    si no, el throughput medido sería el de un handler que no hace nada.
+    Dos entradas simultáneas por invitaciones distintas pueden intercambiarse
+    (ver main.invitacion_usada): se comprueban los totales por clan.
+    """
+    import database
+
+    esperados = {clan['nombre']: 0 for clan in clanes}
+    for i in range(len(nuevos)):
+        esperados[clanes[i % len(clanes)]['nombre']] += 1
+
+    unidos = set()
+    for clan in clanes:
+        miembros = {m['usuario_id'] for m in database.obtener_miembros_clan(guild.id, clan['nombre'])} - {clan['lider'].id}
+        unidos |= miembros
+        xp = database.obtener_clan(guild.id, clan['nombre'])['xp_actual']
+        assert len(miembros) == esperados[clan['nombre']], \
+            f"raid: {clan['nombre']} tiene {len(miembros)} miembros nuevos, se esperaban {esperados[clan['nombre']]}"
+        assert xp == 50 * esperados[clan['nombre']], \
+            f"raid: {clan['nombre']} tiene {xp} XP, se esperaban {50 * esperados[clan['nombre']]}"
+        assert all(clan['rol'].id in m._roles for m in nuevos if m.id in miembros), \
+            f"raid: hay miembros de {clan['nombre']} sin el rol del clan"
+
+    faltan = len({m.id for m in nuevos} - unidos)
+    assert not faltan, f"raid: {faltan} usuarios entraron por una invitación de clan y no quedaron en ninguno"
+
+async def escenario_creacion(main, guild: GuildFalso, n: int, latencias: Dict[str, List[float]]):
+    """n usuarios completan /crear_clan a la vez (hilo, nombre, descripción y confirmación)"""
+    os.environ['CLAN_MANAGEMENT_CHANNEL_ID'] = str(guild.canal_gestion.id)
+    sufijo = _nuevo_id() % 100000
+
+    async def crear(i: int):
+        autor = guild.agregar_miembro(f"fundador{i}")
+        interaccion = InteraccionFalsa(guild, autor, guild.canal_gestion)
+        hilo_original = guild.canal_gestion.create_thread
+
+        async def crear_hilo(*args, **kwargs):
+            hilo = await hilo_original(*args, **kwargs)
+            hilo.guion = [f"Clan{sufijo}_{i}", 'Clan creado por la prueba de carga']
+            return hilo
+
+        # Cada flujo recibe su propio hilo con su guion
+        interaccion.channel = _CanalGestionConGuion(guild.canal_gestion, crear_hilo)
+        await _medir(latencias, 'crear_clan', main.crear_clan_cmd.callback(interaccion))
+
+    await asyncio.gather(*(crear(i) for i in range(n)))
+    return n
+
+class _CanalGestionConGuion(CanalFalso):
+    """El canal de gestión, pero con create_thread que carga el guion del usuario"""
+
+    def __init__(self, canal: CanalFalso, crear_hilo):
+        self.id = canal.id
+        self.guild = canal.guild
+        self.name = canal.name
+        self.category_id = None
+        self.mensajes = canal.mensajes
+        self._crear_hilo = crear_hilo
+
+    async def create_thread(self, *args, **kwargs):
+        return await self._crear_hilo(*args, **kwargs)
+
+async def escenario_invitaciones(main, guild: GuildFalso, n: int, latencias: Dict[str, List[float]]):
+    """Los líderes invitan a n usuarios con /invitar_clan y cada uno acepta desde su DM"""
+    import database
+
+    clanes = [_clan_de_prueba(guild, f"inv{i}", guild.agregar_miembro(f"lider_inv{i}")) for i in range(max(1, n // 8))]
+    # Subir los clanes al nivel máximo para que el límite de miembros no corte la prueba
+    for clan in clanes:
+        database.agregar_xp_clan(guild.id, clan['nombre'], 15000, 'prueba de carga')
+
+    invitados = [guild.agregar_miembro(f"invitado{i}") for i in range(n)]
+    rol = app_commands.Choice(name='Recluta', value='Recluta')
+
+    async def invitar(i: int, member: MiembroFalso):
+        clan = clanes[i % len(clanes)]
+        interaccion = InteraccionFalsa(guild, clan['lider'], clan['canales']['admin'])
+        await _medir(latencias, 'invitar_clan', main.invitar_clan.callback(interaccion, member, clan['nombre'], rol))
+
+    await asyncio.gather(*(invitar(i, m) for i, m in enumerate(invitados)))
+
+    async def aceptar(member: MiembroFalso):
+        for mensaje in guild.dms.get(member.id, []):
+            boton = mensaje.view.children[0] if mensaje.view else None
+            if boton is None or not boton.custom_id.startswith(f"{main.PREFIJO_INVITACION}:aceptar:"):
+                continue
+            interaccion = InteraccionFalsa(
+                guild, member, None, discord.InteractionType.component, {'custom_id': boton.custom_id}
+            )
+            await _medir(latencias, 'aceptar_invitacion', main.despachar_invitacion(interaccion))
+
+    await asyncio.gather(*(aceptar(m) for m in invitados))
+    return n * 2
+
+async def escenario_admin(main, guild: GuildFalso, n: int, latencias: Dict[str, List[float]]):
+    """Ráfaga de comandos de administración sobre clanes con miembros"""
+    import database
+
+    clanes = [_clan_de_prueba(guild, f"adm{i}", guild.agregar_miembro(f"lider_adm{i}")) for i in range(max(1, n // 10))]
+    for clan in clanes:
+        for j in range(8):
+            member = guild.agregar_miembro(f"{clan['nombre']}_m{j}")
+            member._roles.append(clan['rol'].id)
+            database.agregar_miembro_clan(guild.id, clan['nombre'], member.id)
+            clan.setdefault('miembros', []).append(member)
+    admin = guild.agregar_miembro('admin', administrador=True)
+    periodo = app_commands.Choice(name='Últimos 7 días', value='semana')
+
+    async def rafaga(i: int):
+        clan = clanes[i % len(clanes)]
+        canal_admin = clan['canales']['admin']
+        lider = clan['lider']
+        comandos = [
+            ('stats_clan', main.stats_clan.callback(InteraccionFalsa(guild, lider, canal_admin))),
+            ('gestionar_miembros', main.gestionar_miembros.callback(InteraccionFalsa(guild, lider, canal_admin))),
+            ('ranking', main.ranking.callback(InteraccionFalsa(guild, lider, canal_admin))),
+            ('xp_historial', main.xp_historial.callback(InteraccionFalsa(guild, lider, canal_admin), periodo, clan['nombre'])),
+        ]
+        if clan['miembros']:
+            expulsado = clan['miembros'].pop()
+            comandos.append((
+                'expulsar_miembro',
+                main.expulsar_miembro.callback(InteraccionFalsa(guild, lider, canal_admin), expulsado)
+            ))
+        for nombre, coro in comandos:
+            await _medir(latencias, nombre, coro)
+
+    await asyncio.gather(*(rafaga(i) for i in range(n)))
+    await _medir(latencias, 'reconciliar_clanes', main.reconciliar_clanes.callback(InteraccionFalsa(guild, admin)))
+    return n * 5 + 1
+
+ESCENARIOS = {
+    'raid': escenario_raid,
+    'creacion': escenario_creacion,
+    'invitaciones': escenario_invitaciones,
+    'admin': escenario_admin,
+}
+
+# ==================== EJECUCIÓN ====================
+
+async def ejecutar(escenarios: List[str], n: int = 200, latencia_ms: float = 40.0,
+                   prob_429: float = 0.02) -> Dict[str, Dict]:
+    """
+    Ejecutar los escenarios sobre una base de datos temporal.
+
+    Returns:
+        {escenario: {'operaciones', 'segundos', 'por_segundo', 'latencias': {op: {p50, p95, p99, max}},
+                     'lag_max_ms', 'lag_p99_ms', 'llamadas_api', 'rate_limits', 'errores'}}
+    """
+    import database
+
+    database.DATABASE_FILE = os.path.join(tempfile.mkdtemp(), 'carga.db')
+    database.init_database()
+    database.cargar_indice_membresias()
+    database.cargar_clasificacion()
+
+    import main
+
+    await main.bot._async_setup_hook()
+    resultados = {}
+
+    for nombre in escenarios:
+        api = APIFalsa(latencia_ms=latencia_ms, prob_429=prob_429)
+        guild = GuildFalso(main.bot, api)
+        # obtener_guild_de_clan() busca el servidor en la caché del bot
+        main.bot._connection._guilds[guild.id] = guild
+
+        errores = ContadorErrores()
+        logging.getLogger().addHandler(errores)
+        monitor = MonitorLag()
+        monitor.iniciar()
+        latencias: Dict[str, List[float]] = {}
+
+        inicio = time.perf_counter()
+        operaciones = await ESCENARIOS[nombre](main, guild, n, latencias)
+        segundos = time.perf_counter() - inicio
+
+        monitor.detener()
+        logging.getLogger().removeHandler(errores)
+        del main.bot._connection._guilds[guild.id]
+
+        resultados[nombre] = {
+            'operaciones': operaciones,
+            'segundos': segundos,
+            'por_segundo': operaciones / segundos if segundos else 0.0,
+            'latencias': {
+                op: {
+                    'n': len(valores),
+                    'p50': percentil(valores, 50),
+                    'p95': percentil(valores, 95),
+                    'p99': percentil(valores, 99),
+                    'max': max(valores)
+                }
+                for op, valores in latencias.items()
+            },
+            'lag_max_ms': max(monitor.muestras, default=0.0),
+            'lag_p99_ms': percentil(monitor.muestras, 99),
+            'llamadas_api': sum(api.llamadas.values()),
+            'rate_limits': api.rate_limits,
+            'errores': errores.total,
+            'ejemplos_errores': errores.ejemplos
+        }
+
+    return resultados
+
+def imprimir_resultados(resultados: Dict[str, Dict]):
+    for nombre, r in resultados.items():
+        print(f"\n=== {nombre}: {r['operaciones']} operaciones en {r['segundos']:.1f}s ({r['por_segundo']:.1f}/s) ===")
+        print(f"API: {r['llamadas_api']} llamadas, {r['rate_limits']} respuestas 429 · "
+              f"lag del loop: p99 {r['lag_p99_ms']:.1f}ms, máx {r['lag_max_ms']:.1f}ms · errores: {r['errores']}")
+        print(f"{'operación':22} {'n':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+        for op, l in r['latencias'].items():
+            print(f"{op:22} {l['n']:6} {l['p50']:7.0f}ms {l['p95']:7.0f}ms {l['p99']:7.0f}ms {l['max']:7.0f}ms")
+        for ejemplo in r['ejemplos_errores']:
+            print(f"  ⚠️  {ejemplo}")
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    argumentos = sys.argv[1:]
+    seleccion = argumentos[0] if argumentos and not argumentos[0].startswith('--') else 'todos'
+
+    def opcion(nombre: str, defecto):
+        return argumentos[argumentos.index(nombre) + 1] if nombre in argumentos else defecto
+
+    if seleccion != 'todos' and seleccion not in ESCENARIOS:
+        print(__doc__)
+        sys.exit(1)
+
+    resultados = asyncio.run(ejecutar(
+        list(ESCENARIOS) if seleccion == 'todos' else [seleccion],
+        n=int(opcion('--n', 200)),
+        latencia_ms=float(opcion('--latencia', 40)),
+        prob_429=float(opcion('--prob-429', 0.02))
+    ))
+    imprimir_resultados(resultados)
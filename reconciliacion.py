@@ -0,0 +1,214 @@
+"""
+Reconciliación entre el estado de Discord (roles, categorías, canales, miembros)
+y las tablas clanes / canales_clan / miembros_clan
+"""
+import asyncio
+import time
+import logging
+from typing import Dict, Optional
+
+import discord
+
+from database import obtener_estado_reconciliacion, aplicar_reconciliacion
+import reparto_guilds
+
+logger = logging.getLogger(__name__)
+
+# Miembros procesados entre cada cesión del event loop
+TAMANO_BLOQUE_MIEMBROS = 5000
+
+class LimitadorAPI:
+    """Limitador token-bucket para espaciar llamadas a la API de Discord"""
+
+    def __init__(self, llamadas_por_segundo: float = 5.0, rafaga: int = 5):
+        self.intervalo = 1.0 / llamadas_por_segundo
+        self.rafaga = rafaga
+        self.tokens = float(rafaga)
+        self.ultimo = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def esperar(self):
+        """Esperar hasta que haya un token disponible"""
+        async with self._lock:
+            while True:
+                ahora = time.monotonic()
+                self.tokens = min(self.rafaga, self.tokens + (ahora - self.ultimo) / self.intervalo)
+                self.ultimo = ahora
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) * self.intervalo)
+
+async def _recrear_rol_clan(guild: discord.Guild, clan_nombre: str, clan: Dict,
+                            miembros_db: set, canales_extra: set,
+                            limitador: LimitadorAPI) -> Optional[discord.Role]:
+    """Recrear el rol de un clan borrado y restaurar permisos y miembros"""
+    await limitador.esperar()
+    clan_role = await guild.create_role(
+        name=f"Clan-{clan_nombre}",
+        mentionable=True,
+        hoist=True
+    )
+
+    # Permisos de lectura en la categoría y sus canales
+    categoria = guild.get_channel(clan['categoria_id'])
+    if categoria:
+        await limitador.esperar()
+        await categoria.set_permissions(clan_role, read_messages=True)
+
+    for canal_id in {clan['canal_general_id']} | canales_extra:
+        canal = guild.get_channel(canal_id)
+        if canal:
+            await limitador.esperar()
+            await canal.set_permissions(clan_role, read_messages=True)
+
+    canal_anuncios = guild.get_channel(clan['canal_anuncios_id'])
+    if canal_anuncios:
+        await limitador.esperar()
+        await canal_anuncios.set_permissions(clan_role, read_messages=True, send_messages=False)
+
+    for usuario_id in miembros_db:
+        member = guild.get_member(usuario_id)
+        if member:
+            await limitador.esperar()
+            try:
+                await member.add_roles(clan_role, reason="Reconciliación de clan")
+            except discord.HTTPException as e:
+                logger.warning(f"No se pudo reasignar el rol de {clan_nombre} a {usuario_id}: {e}")
+
+    return clan_role
+
+async def reconciliar_guild(guild: discord.Guild, aplicar_api: bool = True,
+                            limitador: LimitadorAPI = None) -> Optional[Dict]:
+    """
+    Comparar el estado del servidor (caché del gateway) con la base de datos y corregir diferencias.
+    El rol del clan es la fuente de verdad para la membresía.
+
+    Returns:
+        {
+            'clanes': 12,
+            'miembros_revisados': 100000,
+            'bajas': 3,
+            'altas': 1,
+            'canales_eliminados': 0,
+            'canales_registrados': 2,
+            'roles_recreados': 0,
+            'roles_faltantes': [],
+            'canales_faltantes': [],
+            'tiempo_cpu': 0.42,
+            'duracion': 1.3
+        }
+    """
+    # Sin la lista completa de miembros en caché se darían de baja miembros reales
+    if not guild.chunked:
+        logger.warning(f"Reconciliación omitida: miembros de {guild.name} sin cachear")
+        return None
+
+    inicio = time.monotonic()
+    cpu_inicio = time.process_time()
+    limitador = limitador or LimitadorAPI()
+
+    estado = await reparto_guilds.en_hilo(guild.id, obtener_estado_reconciliacion, guild.id)
+    if estado is None:
+        return None
+
+    clanes = estado['clanes']
+    rol_a_clan = {c['rol_id']: nombre for nombre, c in clanes.items()}
+    con_rol = {nombre: set() for nombre in clanes}
+
+    # Una sola pasada por los miembros, cediendo el loop entre bloques.
+    # Member._roles es la lista de IDs sin resolver: evita construir objetos Role por miembro.
+    miembros = list(guild.members)
+    for i in range(0, len(miembros), TAMANO_BLOQUE_MIEMBROS):
+        for member in miembros[i:i + TAMANO_BLOQUE_MIEMBROS]:
+            for rol_id in member._roles:
+                clan_nombre = rol_a_clan.get(rol_id)
+                if clan_nombre is not None:
+                    con_rol[clan_nombre].add(member.id)
+        await asyncio.sleep(0)
+
+    # Roles borrados en Discord
+    roles_faltantes = [n for n, c in clanes.items() if guild.get_role(c['rol_id']) is None]
+    roles_actualizados = {}
+    for clan_nombre in roles_faltantes:
+        if not aplicar_api:
+            continue
+        try:
+            clan_role = await _recrear_rol_clan(
+                guild, clan_nombre, clanes[clan_nombre],
+                estado['miembros'].get(clan_nombre, set()),
+                estado['canales_extra'].get(clan_nombre, set()),
+                limitador
+            )
+            roles_actualizados[clan_nombre] = clan_role.id
+        except discord.HTTPException as e:
+            logger.error(f"Error al recrear rol del clan {clan_nombre}: {e}")
+
+    # Diferencias de membresía (no se tocan clanes cuyo rol falta)
+    bajas, altas = [], []
+    for clan_nombre, usuarios_con_rol in con_rol.items():
+        if clan_nombre in roles_faltantes:
+            continue
+        en_db = estado['miembros'].get(clan_nombre, set())
+        bajas.extend((clan_nombre, u) for u in en_db - usuarios_con_rol)
+        altas.extend((clan_nombre, u) for u in usuarios_con_rol - en_db)
+
+    # Diferencias de canales
+    ids_guild = {c.id for c in guild.channels}
+    canales_registrados = set()
+    canales_faltantes = []
+    for extras in estado['canales_extra'].values():
+        canales_registrados |= extras
+
+    canales_eliminados = sorted(canales_registrados - ids_guild)
+    canales_nuevos = []
+    for clan_nombre, clan in clanes.items():
+        for canal_id in clan['canales_base'] | {clan['categoria_id']}:
+            if canal_id not in ids_guild:
+                canales_faltantes.append((clan_nombre, canal_id))
+
+        categoria = guild.get_channel(clan['categoria_id'])
+        if not isinstance(categoria, discord.CategoryChannel):
+            continue
+
+        # Canales creados a mano dentro de la categoría del clan
+        for canal in categoria.channels:
+            if canal.id in clan['canales_base'] or canal.id in canales_registrados:
+                continue
+            if isinstance(canal, discord.VoiceChannel):
+                canales_nuevos.append((clan_nombre, canal.id, canal.name, 'voz'))
+            elif isinstance(canal, discord.TextChannel):
+                canales_nuevos.append((clan_nombre, canal.id, canal.name, 'texto'))
+
+    if bajas or altas or canales_eliminados or canales_nuevos or roles_actualizados:
+        ok = await reparto_guilds.en_hilo(
+            guild.id, aplicar_reconciliacion, guild.id, bajas, altas, canales_eliminados, canales_nuevos,
+            roles_actualizados
+        )
+        if not ok:
+            return None
+
+    reporte = {
+        'clanes': len(clanes),
+        'miembros_revisados': len(miembros),
+        'bajas': len(bajas),
+        'altas': len(altas),
+        'canales_eliminados': len(canales_eliminados),
+        'canales_registrados': len(canales_nuevos),
+        'roles_recreados': len(roles_actualizados),
+        'roles_faltantes': [n for n in roles_faltantes if n not in roles_actualizados],
+        'canales_faltantes': canales_faltantes,
+        'tiempo_cpu': time.process_time() - cpu_inicio,
+        'duracion': time.monotonic() - inicio
+    }
+
+    logger.info(
+        f"Reconciliación de {guild.name}: {reporte['clanes']} clanes, "
+        f"{reporte['miembros_revisados']} miembros, -{reporte['bajas']} +{reporte['altas']} membresías, "
+        f"-{reporte['canales_eliminados']} +{reporte['canales_registrados']} canales, "
+        f"{reporte['roles_recreados']} roles recreados ({reporte['tiempo_cpu']:.2f}s CPU)"
+    )
+
+    return reporte
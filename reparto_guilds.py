@@ -0,0 +1,50 @@
+"""
+Reparto de los hilos de la base de datos entre servidores.
+
+Las consultas síncronas de database.py que el bot saca del loop corren en el
+pool de hilos por defecto de asyncio (asyncio.to_thread), uno solo para todos
+los servidores y shards. Sin límite, un servidor grande (la reconciliación de
+100k miembros, la ola de bajas tras un raid) puede ocupar todos los hilos y
+dejar esperando a los demás.
+
+en_hilo() admite a lo sumo CUPO_POR_GUILD llamadas simultáneas por servidor:
+lo que exceda espera su turno en la cola de ese servidor, sin quitar hilos al
+resto. Se registran 'guild.espera' (ms esperando cupo) y 'guild.esperas'.
+"""
+import os
+import time
+import asyncio
+from typing import Callable, Dict
+
+from metricas import registrar, contar
+
+# Con el pool por defecto (min(32, cpus + 4) hilos) quedan hilos libres para otros servidores
+CUPO_POR_GUILD = int(os.getenv('HILOS_POR_GUILD', 2))
+
+_semaforos: Dict[int, asyncio.Semaphore] = {}
+
+def _semaforo(guild_id: int) -> asyncio.Semaphore:
+    semaforo = _semaforos.get(guild_id)
+    if semaforo is None:
+        semaforo = _semaforos[guild_id] = asyncio.Semaphore(CUPO_POR_GUILD)
+    return semaforo
+
+async def en_hilo(guild_id: int, funcion: Callable, /, *args, **kwargs):
+    """
+    asyncio.to_thread(funcion, ...) dentro del cupo de hilos del servidor `guild_id`
+    (solo posicionales: `funcion` puede recibir su propio guild_id= por nombre)
+    """
+    semaforo = _semaforo(guild_id)
+    esperando = semaforo.locked()
+    inicio = time.monotonic()
+    async with semaforo:
+        if esperando:
+            contar('guild.esperas')
+            registrar('guild.espera', (time.monotonic() - inicio) * 1000)
+        return await asyncio.to_thread(funcion, *args, **kwargs)
+
+def olvidar(guild_id: int):
+    """Soltar el semáforo de un servidor del que salió el bot"""
+    semaforo = _semaforos.get(guild_id)
+    if semaforo is not None and not semaforo.locked():
+        del _semaforos[guild_id]
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Servicio local de base de datos para correr el bot en varios procesos (shards).
+
+Con varios procesos abriendo clan_data.db por su cuenta, cada escritura pelea
+por el lock de SQLite y espera el timeout de los demás. Este proceso es el
+único que abre la base:
+
+- Las escrituras (database.ESCRITURAS) van a un solo hilo escritor. Las que
+  llegan mientras se confirma un lote se agrupan en la siguiente transacción
+  (database.lote_escrituras): un commit para muchas escrituras, y ningún
+  "database is locked" entre procesos.
+- Las exclusivas (database.EXCLUSIVAS: migraciones, compactar el historial,
+  recargar cachés, reconciliación) corren en el mismo hilo, cada una sola.
+  Las largas (database.POR_LOTES: compactar, reconciliación) van lote a lote:
+  tras cada lote vuelven al final de la cola, y las escrituras que llegaron
+  mientras tanto se aplican antes del lote siguiente.
+- Las lecturas (database.LECTURAS) corren en un pool de hilos y responden
+  desde las cachés en memoria del servicio (índice de membresías,
+  clasificación, invitaciones) cuando las hay.
+- Cada cambio de clan se difunde a los procesos suscritos, que invalidan sus
+  cachés locales (embeds, paneles).
+
+Los procesos del bot se conectan definiendo DB_SOCKET con la ruta del socket
+(ver cliente_db.py).
+
+Uso:
+    python servicio_db.py [--socket clan_db.sock] [--db clan_data.db] [--hilos-lectura 4]
+"""
+import os
+import sys
+import time
+import queue
+import signal
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Generator, Optional, Set, Tuple
+
+# El servicio es quien abre la base: database.py no debe convertirse en cliente de sí mismo
+RUTA_SOCKET = os.environ.pop('DB_SOCKET', 'clan_db.sock')
+
+import database
+from cliente_db import codificar, recibir_async
+from metricas import registrar, contar, registrar_resumen
+
+logger = logging.getLogger(__name__)
+
+TAMANO_MAXIMO_LOTE = 64
+HILOS_LECTURA = 4
+MAXIMO_AVISOS_PENDIENTES = 10000   # por suscriptor; si se llena se le avisa "todo cambió"
+INTERVALO_RESUMEN = 300
+
+_FIN = object()
+
+class _PorLotes:
+    """Exclusiva de database.POR_LOTES a medio aplicar"""
+    __slots__ = ('nombre', 'pasos', 'futuro')
+
+    def __init__(self, nombre: str, pasos: Generator, futuro: asyncio.Future):
+        self.nombre = nombre
+        self.pasos = pasos
+        self.futuro = futuro
+
+class ServicioDB:
+    """Servidor del socket, hilo escritor y pool de lectura"""
+
+    def __init__(self, ruta_socket: str, hilos_lectura: int = HILOS_LECTURA):
+        self.ruta_socket = ruta_socket
+        self._escrituras: 'queue.Queue' = queue.Queue()
+        self._lecturas = ThreadPoolExecutor(hilos_lectura, thread_name_prefix='servicio-db-lectura')
+        self._escritor = threading.Thread(target=self._escribir, name='servicio-db-escritor', daemon=True)
+        self._suscriptores: Set[asyncio.Queue] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def iniciar(self) -> asyncio.AbstractServer:
+        self._loop = asyncio.get_running_loop()
+        self._escritor.start()
+
+        # Esquema, migraciones y cachés en memoria, antes de aceptar conexiones
+        for nombre in ('init_database', 'cargar_indice_membresias', 'cargar_clasificacion'):
+            estado, valor = await self._escribir_async(nombre, (), {})
+            if estado == 'error':
+                raise RuntimeError(f"{nombre}: {valor}")
+        database.al_cambiar_clan(self._al_cambiar)
+
+        if os.path.exists(self.ruta_socket):
+            os.remove(self.ruta_socket)
+        servidor = await asyncio.start_unix_server(self._atender, path=self.ruta_socket)
+        os.chmod(self.ruta_socket, 0o600)
+        return servidor
+
+    def detener(self):
+        """Terminar el lote en curso y soltar los hilos"""
+        self._escrituras.put(_FIN)
+        self._escritor.join()
+        self._lecturas.shutdown(wait=True)
+
+    # ---- Llamadas ----
+
+    @staticmethod
+    def _llamar(nombre: str, args: tuple, kwargs: dict) -> Tuple[str, Any]:
+        try:
+            return 'ok', getattr(database, nombre)(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Error en {nombre}: {e}")
+            return 'error', f"{type(e).__name__}: {e}"
+
+    async def _escribir_async(self, nombre: str, args: tuple, kwargs: dict) -> Tuple[str, Any]:
+        futuro = self._loop.create_future()
+        self._escrituras.put((nombre, args, kwargs, futuro))
+        return await futuro
+
+    def _responder(self, futuro: asyncio.Future, respuesta: Tuple[str, Any]):
+        def fijar():
+            if not futuro.done():
+                futuro.set_result(respuesta)
+        self._loop.call_soon_threadsafe(fijar)
+
+    def _escribir(self):
+        """Hilo escritor: agrupa en un lote lo que esté en cola, hasta una exclusiva"""
+        pendiente = None
+        while True:
+            pedido = pendiente if pendiente is not None else self._escrituras.get()
+            pendiente = None
+            if pedido is _FIN:
+                return
+
+            if isinstance(pedido, _PorLotes):
+                self._avanzar(pedido)
+                continue
+            if pedido[0] in database.POR_LOTES:
+                nombre, args, kwargs, futuro = pedido
+                try:
+                    pasos = database.POR_LOTES[nombre](*args, **kwargs)
+                except TypeError as e:
+                    self._responder(futuro, ('error', f"TypeError: {e}"))
+                    continue
+                self._avanzar(_PorLotes(nombre, pasos, futuro))
+                continue
+            if pedido[0] in database.EXCLUSIVAS:
+                self._responder(pedido[3], self._llamar(*pedido[:3]))
+                continue
+
+            lote = [pedido]
+            while len(lote) < TAMANO_MAXIMO_LOTE:
+                try:
+                    siguiente = self._escrituras.get_nowait()
+                except queue.Empty:
+                    break
+                if siguiente is _FIN or isinstance(siguiente, _PorLotes) or siguiente[0] in database.EXCLUSIVAS:
+                    pendiente = siguiente
+                    break
+                lote.append(siguiente)
+            self._ejecutar_lote(lote)
+
+    def _avanzar(self, trabajo: _PorLotes):
+        """Aplicar un lote de la exclusiva y devolverla al final de la cola (sin la pausa entre lotes)"""
+        inicio = time.perf_counter()
+        try:
+            next(trabajo.pasos)
+        except StopIteration as fin:
+            self._responder(trabajo.futuro, ('ok', fin.value))
+        except Exception as e:
+            logger.error(f"Error en {trabajo.nombre}: {e}")
+            self._responder(trabajo.futuro, ('error', f"{type(e).__name__}: {e}"))
+        else:
+            self._escrituras.put(trabajo)
+        registrar(f"servicio_db.lote.{trabajo.nombre}", (time.perf_counter() - inicio) * 1000)
+
+    def _ejecutar_lote(self, lote: list):
+        inicio = time.perf_counter()
+        try:
+            with database.lote_escrituras():
+                respuestas = [self._llamar(*pedido[:3]) for pedido in lote]
+        except Exception as e:
+            # Se deshizo el lote entero (p. ej. falló el commit): cada escritura se repite sola.
+            # Las cachés no cambiaron: sus efectos en memoria esperaban al commit
+            logger.warning(f"Falló un lote de {len(lote)} escrituras ({e}); se repiten una por una")
+            contar('servicio_db.lotes_fallidos')
+            respuestas = [self._llamar(*pedido[:3]) for pedido in lote]
+
+        registrar('servicio_db.lote', (time.perf_counter() - inicio) * 1000)
+        contar('servicio_db.lotes')
+        contar('servicio_db.escrituras', len(lote))
+        for pedido, respuesta in zip(lote, respuestas):
+            self._responder(pedido[3], respuesta)
+
+    # ---- Socket ----
+
+    async def _atender(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                mensaje = await recibir_async(reader)
+                if mensaje[0] == 'suscribir':
+                    await self._enviar_cambios(writer)
+                    return
+
+                _, nombre, args, kwargs = mensaje
+                inicio = time.perf_counter()
+                if nombre in database.ESCRITURAS or nombre in database.EXCLUSIVAS:
+                    respuesta = await self._escribir_async(nombre, args, kwargs)
+                elif nombre in database.LECTURAS:
+                    respuesta = await self._loop.run_in_executor(self._lecturas, self._llamar, nombre, args, kwargs)
+                else:
+                    respuesta = ('error', f"función desconocida: {nombre}")
+                registrar(f"servicio_db.{nombre}", (time.perf_counter() - inicio) * 1000, respuesta[0] == 'error')
+
+                writer.write(codificar(respuesta))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # Cierre del servicio con conexiones abiertas (las suscripciones siempre lo están)
+            pass
+        finally:
+            writer.close()
+
+    def _al_cambiar(self, clave: Optional[Tuple[int, str]]):
+        # Llega desde el hilo escritor
+        self._loop.call_soon_threadsafe(self._difundir, clave)
+
+    def _difundir(self, clave: Optional[Tuple[int, str]]):
+        for avisos in self._suscriptores:
+            if avisos.qsize() >= MAXIMO_AVISOS_PENDIENTES:
+                # Suscriptor atrasado: se reemplaza todo lo pendiente por un solo "cambiaron todos"
+                while not avisos.empty():
+                    avisos.get_nowait()
+                aviso = None
+            else:
+                aviso = clave
+            avisos.put_nowait(aviso)
+
+    async def _enviar_cambios(self, writer: asyncio.StreamWriter):
+        avisos: asyncio.Queue = asyncio.Queue()
+        self._suscriptores.add(avisos)
+        try:
+            while True:
+                writer.write(codificar(await avisos.get()))
+                await writer.drain()
+        finally:
+            self._suscriptores.discard(avisos)
+
+async def servir(ruta_socket: str = RUTA_SOCKET, hilos_lectura: int = HILOS_LECTURA):
+    """Atender el socket hasta recibir SIGTERM o SIGINT"""
+    servicio = ServicioDB(ruta_socket, hilos_lectura)
+    servidor = await servicio.iniciar()
+    logger.info(f"Servicio de base de datos escuchando en {ruta_socket} ({database.DATABASE_FILE})")
+
+    detener = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for senal in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(senal, detener.set)
+
+    async def resumir():
+        while True:
+            await asyncio.sleep(INTERVALO_RESUMEN)
+            registrar_resumen()
+
+    tarea_resumen = asyncio.create_task(resumir())
+    try:
+        await detener.wait()
+    finally:
+        tarea_resumen.cancel()
+        servidor.close()
+        await asyncio.to_thread(servicio.detener)
+        if os.path.exists(ruta_socket):
+            os.remove(ruta_socket)
+        logger.info("Servicio de base de datos detenido")
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='[%(asctime)s] [%(levelname)-8s] %(name)s: %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+    argumentos = sys.argv[1:]
+
+    if '--help' in argumentos or '-h' in argumentos:
+        print(__doc__)
+        sys.exit(0)
+
+    def opcion(nombre: str, defecto=None):
+        return argumentos[argumentos.index(nombre) + 1] if nombre in argumentos else defecto
+
+    database.DATABASE_FILE = opcion('--db', database.DATABASE_FILE)
+    asyncio.run(servir(opcion('--socket', RUTA_SOCKET), int(opcion('--hilos-lectura', HILOS_LECTURA))))
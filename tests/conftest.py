@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Los módulos del bot están en la raíz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# El motor se elige al importar database.py: las pruebas usan siempre SQLite en archivos temporales
+os.environ.pop('DATABASE_URL', None)
+os.environ.pop('DB_SOCKET', None)
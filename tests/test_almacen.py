@@ -0,0 +1,45 @@
+"""
+Pruebas del almacenamiento sobre SQLite: los grupos de conformidad_almacen.py, los
+planes de las consultas declaradas en indices.py y una carrera corta de XP de
+benchmark_db.py (--estres-xp). Los scripts siguen siendo la forma de correrlos contra
+PostgreSQL o con datasets grandes.
+
+    python -m pytest -q tests
+"""
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+import benchmark_db
+import conformidad_almacen
+import database
+from indices import verificar_indices
+
+@pytest.fixture(scope='module')
+def conformidad(tmp_path_factory):
+    """Resultados de todos los grupos, corridos una vez y en orden sobre la misma base"""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(database, 'DATABASE_FILE', str(tmp_path_factory.mktemp('conformidad') / 'conformidad.db'))
+        yield {r['grupo']: r for r in conformidad_almacen.ejecutar()}
+
+@pytest.mark.parametrize('grupo', list(conformidad_almacen.GRUPOS))
+def test_conformidad(conformidad, grupo):
+    resultado = conformidad.get(grupo)
+    assert resultado is not None, "no corrió: falló el grupo esquema"
+    assert resultado['ok'], resultado['detalle']
+
+def test_consultas_usan_sus_indices(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DATABASE_FILE', str(tmp_path / 'indices.db'))
+    database.init_database()
+    with closing(sqlite3.connect(database.DATABASE_FILE)) as conn:
+        problemas = verificar_indices(conn)
+    assert problemas == [], [f"{p['nombre']}: {' / '.join(p['plan'])}" for p in problemas]
+
+def test_estres_xp_sin_actualizaciones_perdidas(monkeypatch):
+    # benchmark_db apunta database.DATABASE_FILE a sus copias temporales
+    monkeypatch.setattr(database, 'DATABASE_FILE', database.DATABASE_FILE)
+    reporte = benchmark_db.ejecutar(n_clanes=50, n_miembros=300, n_historial=500, repeticiones=400,
+                                    n_guilds=2, estres_xp=[1, 8])
+    assert set(reporte['resultados']['estres_xp']) == {'1', '8'}
+    assert benchmark_db.perdidas_estres_xp(reporte) == 0, reporte['resultados']['estres_xp']
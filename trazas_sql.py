@@ -0,0 +1,175 @@
+"""
+Registro opcional de consultas SQL lentas con su plan de ejecución.
+
+Se activa llamando a activar(umbral_ms); el bot lo hace si está definida la
+variable de entorno SQLITE_LENTAS_MS. Cada sentencia que supera el umbral se
+agrupa por su texto, se guarda quién la ejecutó y, la primera vez, su
+EXPLAIN QUERY PLAN.
+"""
+import os
+import sys
+import time
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+# Clase de conexión que usa database.get_db_connection
+clase_conexion = sqlite3.Connection
+
+_umbral_ms: Optional[float] = None
+_consultas: Dict[str, Dict] = {}
+_lock = threading.Lock()
+
+def _normalizar(sql: str) -> str:
+    return ' '.join(sql.split())
+
+def _analizar_plan(plan: List[str]) -> Dict[str, bool]:
+    """Detectar recorridos completos de tabla y ordenamientos en B-tree temporal"""
+    scan_completo = any(
+        p.startswith('SCAN ') and 'USING' not in p and 'CONSTANT ROW' not in p
+        for p in plan
+    )
+    orden_temporal = any('USE TEMP B-TREE' in p for p in plan)
+    return {'scan_completo': scan_completo, 'orden_temporal': orden_temporal}
+
+def _registrar(conexion: 'ConexionTrazada', sql: str, parametros, duracion_ms: float, llamador: str):
+    clave = _normalizar(sql)
+
+    with _lock:
+        entrada = _consultas.get(clave)
+        nueva = entrada is None
+        if nueva:
+            entrada = _consultas[clave] = {
+                'sql': clave,
+                'veces': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'llamadores': set(),
+                'ejemplo': None,
+                'plan': [],
+                'scan_completo': False,
+                'orden_temporal': False
+            }
+        entrada['veces'] += 1
+        entrada['total_ms'] += duracion_ms
+        entrada['max_ms'] = max(entrada['max_ms'], duracion_ms)
+        entrada['llamadores'].add(llamador)
+        entrada['ejemplo'] = _normalizar(conexion.ultima_sentencia or clave)
+
+    if not nueva or clave.split(' ', 1)[0].upper() not in ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH'):
+        return
+
+    # Capturar el plan una sola vez por sentencia, sin pasar por el cursor trazado
+    try:
+        cursor = sqlite3.Cursor(conexion)
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", parametros)
+        plan = [fila[3] for fila in cursor.fetchall()]
+        cursor.close()
+    except sqlite3.Error as e:
+        plan = [f"(no disponible: {e})"]
+
+    with _lock:
+        entrada['plan'] = plan
+        entrada.update(_analizar_plan(plan))
+
+    logger.warning(
+        f"Consulta lenta ({duracion_ms:.1f}ms) en {llamador}: {clave[:200]} | plan: {' / '.join(plan)}"
+    )
+
+class CursorTrazado(sqlite3.Cursor):
+    """Cursor que mide execute/executemany y registra las sentencias lentas"""
+
+    def execute(self, sql, parametros=()):
+        inicio = time.perf_counter()
+        resultado = super().execute(sql, parametros)
+        duracion_ms = (time.perf_counter() - inicio) * 1000
+        if _umbral_ms is not None and duracion_ms >= _umbral_ms:
+            _registrar(self.connection, sql, parametros, duracion_ms, _llamador())
+        return resultado
+
+    def executemany(self, sql, secuencia):
+        inicio = time.perf_counter()
+        resultado = super().executemany(sql, secuencia)
+        duracion_ms = (time.perf_counter() - inicio) * 1000
+        if _umbral_ms is not None and duracion_ms >= _umbral_ms:
+            _registrar(self.connection, sql, (), duracion_ms, _llamador())
+        return resultado
+
+class ConexionTrazada(sqlite3.Connection):
+    """Conexión que entrega cursores trazados y guarda la última sentencia expandida"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ultima_sentencia: Optional[str] = None
+        # SQLite pasa la sentencia con los parámetros ya sustituidos
+        self.set_trace_callback(self._al_ejecutar)
+
+    def _al_ejecutar(self, sentencia: str):
+        self.ultima_sentencia = sentencia
+
+    def cursor(self, factory=CursorTrazado):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, secuencia):
+        return self.cursor().executemany(sql, secuencia)
+
+def _llamador() -> str:
+    """Primera función fuera de este módulo en la pila (normalmente una de database.py)"""
+    frame = sys._getframe(2)
+    while frame and frame.f_code.co_filename == __file__:
+        frame = frame.f_back
+    if not frame:
+        return '?'
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}"
+
+def activar(umbral_ms: float = 50.0):
+    """Empezar a registrar sentencias que tarden al menos `umbral_ms`"""
+    global clase_conexion, _umbral_ms
+    _umbral_ms = umbral_ms
+    clase_conexion = ConexionTrazada
+    logger.info(f"Trazas SQL activadas (umbral {umbral_ms}ms)")
+
+def desactivar():
+    global clase_conexion, _umbral_ms
+    _umbral_ms = None
+    clase_conexion = sqlite3.Connection
+
+def activo() -> bool:
+    return _umbral_ms is not None
+
+def reporte_consultas_lentas(limite: int = 20) -> List[Dict]:
+    """Sentencias lentas ordenadas por tiempo total acumulado"""
+    with _lock:
+        entradas = [dict(e, llamadores=sorted(e['llamadores'])) for e in _consultas.values()]
+    entradas.sort(key=lambda e: e['total_ms'], reverse=True)
+    return entradas[:limite]
+
+def registrar_reporte(limite: int = 20):
+    """Volcar al log el ranking de consultas lentas para orientar índices"""
+    reporte = reporte_consultas_lentas(limite)
+    if not reporte:
+        return
+
+    logger.info(f"=== Top {len(reporte)} consultas lentas ===")
+    for posicion, e in enumerate(reporte, 1):
+        avisos = []
+        if e['scan_completo']:
+            avisos.append('SCAN COMPLETO')
+        if e['orden_temporal']:
+            avisos.append('ORDEN TEMPORAL')
+        logger.info(
+            f"#{posicion} total={e['total_ms']:.0f}ms n={e['veces']} max={e['max_ms']:.1f}ms "
+            f"{' '.join(avisos)} [{', '.join(e['llamadores'])}] {e['sql'][:200]}"
+        )
+        logger.info(f"    plan: {' / '.join(e['plan'])}")
+
+def reiniciar():
+    with _lock:
+        _consultas.clear()
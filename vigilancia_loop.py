@@ -0,0 +1,185 @@
+"""
+Vigilancia opcional del event loop: mide su retraso y detecta código bloqueante.
+
+Una tarea del loop deja un latido cada INTERVALO segundos y registra cuánto se
+atrasó (métrica 'loop.lag'). Un hilo aparte revisa los latidos: si el loop
+lleva más de `umbral_ms` sin latir, copia la pila del hilo del loop en ese
+momento, que es la del código que lo está bloqueando, y la atribuye al handler
+de main.py que aparece en ella (comando, evento o botón) y a la tarea de asyncio
+en curso. Al volver el latido se registra el bloqueo con su duración total.
+
+Se activa llamando a activar(umbral_ms) desde el loop; el bot lo hace si está
+definida la variable de entorno LOOP_BLOQUEO_MS. Con depurar_asyncio=True
+también se enciende el modo debug de asyncio, que registra cada callback que
+supere el umbral (tiene costo: dejarlo solo mientras se investiga).
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from typing import Dict, List, Optional
+
+from metricas import registrar, contar
+
+logger = logging.getLogger(__name__)
+
+INTERVALO = 0.05
+PROFUNDIDAD_PILA = 25
+ARCHIVO_BOT = 'main.py'
+_DIRECTORIO_ASYNCIO = os.path.dirname(asyncio.__file__)
+
+_estado: Optional[Dict] = None
+_bloqueos: Dict[str, Dict] = {}
+_lock = threading.Lock()
+
+def _atribuir(frame) -> Dict[str, str]:
+    """
+    Handler de main.py más externo de la pila (el comando o evento en curso) y
+    punto exacto donde está bloqueado el loop.
+    """
+    handler = None
+    actual = frame
+    # Hasta el callback del loop: más afuera está el propio asyncio (y bot.run en main.py)
+    while actual is not None and not actual.f_code.co_filename.startswith(_DIRECTORIO_ASYNCIO):
+        if os.path.basename(actual.f_code.co_filename) == ARCHIVO_BOT:
+            handler = actual.f_code.co_name
+        actual = actual.f_back
+
+    punto = f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}:{frame.f_lineno}"
+    return {'handler': handler or '?', 'punto': punto}
+
+def _nombre_tarea(loop: asyncio.AbstractEventLoop) -> str:
+    tarea = asyncio.current_task(loop)
+    if tarea is None:
+        return '(callback)'
+    coro = tarea.get_coro()
+    return f"{tarea.get_name()} ({getattr(coro, '__qualname__', coro)})"
+
+def _vigilar(estado: Dict):
+    """Hilo vigilante: captura la pila del loop cuando deja de latir"""
+    while not estado['detener'].wait(INTERVALO / 2):
+        atraso_ms = (time.monotonic() - estado['ultimo_latido'] - INTERVALO) * 1000
+        if atraso_ms < estado['umbral_ms'] or estado['captura'] is not None:
+            continue
+
+        frame = sys._current_frames().get(estado['hilo_loop'])
+        if frame is None:
+            continue
+        captura = _atribuir(frame)
+        captura['tarea'] = _nombre_tarea(estado['loop'])
+        captura['pila'] = ''.join(traceback.format_stack(frame, limit=PROFUNDIDAD_PILA))
+        with _lock:
+            estado['captura'] = captura
+
+def _registrar_bloqueo(duracion_ms: float, captura: Dict):
+    clave = f"{captura['handler']} @ {captura['punto']}"
+    with _lock:
+        entrada = _bloqueos.get(clave)
+        if entrada is None:
+            entrada = _bloqueos[clave] = {
+                'handler': captura['handler'],
+                'punto': captura['punto'],
+                'veces': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'tarea': captura['tarea'],
+                'pila': captura['pila']
+            }
+        entrada['veces'] += 1
+        entrada['total_ms'] += duracion_ms
+        if duracion_ms > entrada['max_ms']:
+            entrada['max_ms'] = duracion_ms
+            entrada['tarea'] = captura['tarea']
+            entrada['pila'] = captura['pila']
+
+    contar('loop.bloqueos')
+    logger.warning(
+        f"Event loop bloqueado {duracion_ms:.0f}ms en {captura['handler']} "
+        f"({captura['punto']}, tarea {captura['tarea']})\n{captura['pila']}"
+    )
+
+async def _latir(estado: Dict):
+    """Tarea del loop: deja el latido y mide cuánto tarda en volver a correr"""
+    while True:
+        antes = time.monotonic()
+        estado['ultimo_latido'] = antes
+        await asyncio.sleep(INTERVALO)
+        ahora = time.monotonic()
+        estado['ultimo_latido'] = ahora
+
+        lag_ms = (ahora - antes - INTERVALO) * 1000
+        registrar('loop.lag', max(0.0, lag_ms))
+
+        with _lock:
+            captura, estado['captura'] = estado['captura'], None
+        if captura is not None:
+            _registrar_bloqueo(lag_ms, captura)
+
+def activar(umbral_ms: float = 250.0, depurar_asyncio: bool = False):
+    """Empezar a vigilar el loop en ejecución (llamar desde dentro del loop)"""
+    global _estado
+    if _estado is not None:
+        return
+
+    loop = asyncio.get_running_loop()
+    _estado = {
+        'loop': loop,
+        'hilo_loop': threading.get_ident(),
+        'umbral_ms': umbral_ms,
+        'ultimo_latido': time.monotonic(),
+        'captura': None,
+        'detener': threading.Event()
+    }
+    _estado['tarea'] = loop.create_task(_latir(_estado), name='vigilancia-loop')
+    _estado['hilo'] = threading.Thread(target=_vigilar, args=(_estado,), name='vigilancia-loop', daemon=True)
+    _estado['hilo'].start()
+
+    if depurar_asyncio:
+        loop.set_debug(True)
+        loop.slow_callback_duration = umbral_ms / 1000
+        logging.getLogger('asyncio').setLevel(logging.WARNING)
+
+    logger.info(
+        f"Vigilancia del event loop activada (umbral {umbral_ms}ms"
+        f"{', debug de asyncio' if depurar_asyncio else ''})"
+    )
+
+def desactivar():
+    global _estado
+    if _estado is None:
+        return
+    _estado['detener'].set()
+    _estado['tarea'].cancel()
+    if _estado['loop'].get_debug():
+        _estado['loop'].set_debug(False)
+    _estado = None
+
+def activo() -> bool:
+    return _estado is not None
+
+def reporte_bloqueos(limite: int = 20) -> List[Dict]:
+    """Bloqueos agrupados por handler y punto, ordenados por tiempo total bloqueado"""
+    with _lock:
+        entradas = [dict(e) for e in _bloqueos.values()]
+    entradas.sort(key=lambda e: e['total_ms'], reverse=True)
+    return entradas[:limite]
+
+def registrar_reporte(limite: int = 20):
+    """Volcar al log el ranking de bloqueos del loop"""
+    reporte = reporte_bloqueos(limite)
+    if not reporte:
+        return
+
+    logger.info(f"=== Top {len(reporte)} bloqueos del event loop ===")
+    for posicion, e in enumerate(reporte, 1):
+        logger.info(
+            f"#{posicion} total={e['total_ms']:.0f}ms n={e['veces']} max={e['max_ms']:.0f}ms "
+            f"{e['handler']} @ {e['punto']}"
+        )
+
+def reiniciar():
+    with _lock:
+        _bloqueos.clear()